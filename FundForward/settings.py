@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'predictor.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +88,26 @@ DATABASES = {
     }
 }
 
+# SQLite production profile (opt in with FUNDFORWARD_SQLITE_PRODUCTION=1)
+# Run on every new connection by predictor.signals: WAL lets readers carry on while one
+# writer commits, busy_timeout makes a writer wait for the lock instead of failing, and
+# synchronous=NORMAL is durable across application crashes under WAL (a power loss can
+# drop the last commits). Writes start with BEGIN IMMEDIATE so two transactions never
+# both read and then deadlock upgrading to the write lock, which busy_timeout cannot wait out.
+SQLITE_PRODUCTION = os.environ.get("FUNDFORWARD_SQLITE_PRODUCTION") == "1"
+SQLITE_PRODUCTION_PRAGMAS = {
+    "busy_timeout": 5000,  # ms
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # KiB, i.e. 64 MB per connection
+    "mmap_size": 268435456,  # 256 MB
+    "temp_store": "MEMORY",
+}
+SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS if SQLITE_PRODUCTION else {}
+if SQLITE_PRODUCTION:
+    # transaction_mode is a Django 5.1+ option of the SQLite backend (see requirements.txt)
+    DATABASES["default"]["OPTIONS"] = {"transaction_mode": "IMMEDIATE"}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -126,6 +149,50 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Matching
+# When True (FUNDFORWARD_MATCH_WORKER=1), student/donor saves queue a MatchJob that
+# `manage.py run_match_worker` processes, instead of scoring every pair inside the HTTP
+# request. Only turn it on where a worker runs (docker-compose starts one), or matches
+# are never created.
+MATCHING_BACKGROUND_WORKER = os.environ.get("FUNDFORWARD_MATCH_WORKER") == "1"
+
+# Load predictor/models/matching_model.joblib when the app starts rather than on first use.
+# The Docker image turns it on and runs gunicorn with --preload, so workers share the model.
+MATCHING_MODEL_EAGER_LOAD = os.environ.get("FUNDFORWARD_EAGER_LOAD_MODEL") == "1"
+
+# Threads that score pairs for the async API views (predictor.async_api_views).
+SCORING_POOL_WORKERS = 4
+
+# Metrics (served at /metrics, see predictor.metrics)
+# Fraction of requests whose latency and queries are recorded; 0 turns recording off.
+METRICS_SAMPLE_RATE = 0.1
+# A sampled request that runs one SQL shape this many times is counted as a likely N+1.
+METRICS_N_PLUS_ONE_THRESHOLD = 10
+# Scrapers authenticate with "Authorization: Bearer <token>"; empty disables token access.
+METRICS_TOKEN = os.environ.get("FUNDFORWARD_METRICS_TOKEN", "")
+# Addresses allowed to scrape /metrics without a login or token. Only meaningful when
+# clients connect directly: behind a reverse proxy every request comes from the proxy.
+METRICS_ALLOWED_IPS = []
+
+# Caching
+# "default" holds per-process data. The transparency dashboard's aggregates and the CSR
+# leaderboard go to a file-based cache that every worker process on the host shares, so a
+# payment or `manage.py recompute_csr` invalidates them in all of them.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "dashboard": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(tempfile.gettempdir(), "fundforward-dashboard"),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+TRANSPARENCY_CACHE_ALIAS = "dashboard"
+# Seconds before a cached dashboard is refreshed (payments invalidate it immediately).
+TRANSPARENCY_CACHE_TIMEOUT = 600
+LEADERBOARD_CACHE_ALIAS = "dashboard"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
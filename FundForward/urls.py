@@ -6,6 +6,10 @@ from predictor import views
 from django.contrib.auth.views import LogoutView
 
 urlpatterns = [
+    # Staff pages under admin/ that are not part of the admin site (its catch-all would swallow them)
+    path("admin/queue-alerts/", views.queue_alerts, name="queue_alerts"),
+    path("admin/queue-alerts/stream/", views.queue_alerts_stream, name="queue_alerts_stream"),
+
     # Admin panel
     path("admin/", admin.site.urls),
 
@@ -20,6 +24,9 @@ urlpatterns = [
 
     # API endpoints
     path("api/", include("predictor.api_urls")),
+
+    # Prometheus scrape target (internal)
+    path("metrics", views.metrics_endpoint, name="metrics"),
 ]
 
 if settings.DEBUG:
@@ -1,7 +1,47 @@
 # predictor/admin.py
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+
+from . import wallet
 from .models import Student, Donor, UniversityPayment
 
-admin.site.register(Student)
-admin.site.register(Donor)
-admin.site.register(UniversityPayment)
\ No newline at end of file
+
+class WalletActionForm(ActionForm):
+    amount = forms.DecimalField(max_digits=10, decimal_places=2, required=False,
+                                help_text="For wallet top-ups; negative to withdraw.")
+
+
+# Wallet balances change only through predictor.wallet, which writes the ledger entry
+# with them; an edited balance would drift from the ledger (see reconcile_ledger).
+@admin.register(Donor)
+class DonorAdmin(admin.ModelAdmin):
+    readonly_fields = ("wallet_balance",)
+    action_form = WalletActionForm
+    actions = ["top_up_wallets"]
+
+    @admin.action(description="Top up selected wallets by the amount given")
+    def top_up_wallets(self, request, queryset):
+        try:
+            amount = WalletActionForm.base_fields["amount"].clean(request.POST.get("amount"))
+        except forms.ValidationError:
+            amount = None
+        if not amount:
+            self.message_user(request, "Enter a non-zero amount to top up by.", messages.ERROR)
+            return
+        done = 0
+        for donor in queryset:
+            try:
+                wallet.top_up(donor, amount)
+                done += 1
+            except wallet.InsufficientFunds:
+                self.message_user(request, f"{donor}: balance does not cover R{-amount:.2f}.", messages.WARNING)
+        self.message_user(request, f"Topped up {done} wallet(s) by R{amount:.2f}.")
+
+
+@admin.register(Student)
+class StudentAdmin(admin.ModelAdmin):
+    readonly_fields = ("wallet_balance",)
+
+
+admin.site.register(UniversityPayment)
@@ -0,0 +1,115 @@
+# predictor/alert_feed.py
+# In-process change feed of RegistrationFlag events ("new" / "resolved") for the queue
+# alerts stream. Writers publish on commit (see predictor.signals and predictor.wallet);
+# each connected browser holds an asyncio queue that is fed directly, so an idle
+# connection costs one suspended coroutine and no database reads.
+#
+# The feed is per process: run the stream under a single ASGI worker, or events
+# published by other processes are not seen.
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+from django.db import transaction
+
+HISTORY_SIZE = 500  # events kept for reconnecting clients (Last-Event-ID)
+QUEUE_SIZE = 100  # a subscriber this far behind is dropped and must reconnect
+HEARTBEAT_SECONDS = 15
+
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_history = deque(maxlen=HISTORY_SIZE)
+_subscribers = set()
+
+
+def flag_event(kind, flag, student=None):
+    """Event payload for a RegistrationFlag; `student` defaults to flag.student."""
+    student = student or flag.student
+    return {
+        "event": kind,
+        "flag_id": flag.pk,
+        "student_id": student.pk,
+        "student_number": student.student_number,
+        "name": f"{student.first_name} {student.last_name}",
+        "course": student.course,
+        "semester": flag.semester,
+        "reason": flag.flagged_reason,
+    }
+
+
+class _Subscriber:
+    def __init__(self, loop):
+        self.loop = loop
+        # One slot more than QUEUE_SIZE events, so the None that drops a subscriber always fits
+        self.queue = asyncio.Queue(QUEUE_SIZE + 1)
+        self.dropped = False
+
+    def deliver(self, event):
+        if self.dropped:
+            return
+        if self.queue.qsize() >= QUEUE_SIZE:
+            self.dropped = True
+            self.queue.put_nowait(None)  # the reader closes the stream on None
+            return
+        self.queue.put_nowait(event)
+
+
+def publish(payload):
+    """Give the payload an id, keep it in the history and push it to every subscriber. Thread-safe."""
+    with _lock:
+        event = dict(payload, id=next(_ids))
+        _history.append(event)
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+        except RuntimeError:
+            pass  # loop already closed; its stream is gone
+    return event
+
+
+def publish_on_commit(payloads):
+    """Publish the payloads once the current transaction commits (immediately outside one)."""
+    payloads = list(payloads)
+    if payloads:
+        transaction.on_commit(lambda: [publish(p) for p in payloads])
+
+
+def recent(after=0):
+    """Events still in the history with an id greater than `after`."""
+    with _lock:
+        return [e for e in _history if e["id"] > after]
+
+
+async def listen(last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+    """
+    Async generator of events: first any missed since `last_event_id`, then live ones.
+    Yields None every `heartbeat` seconds without an event, and stops if the
+    subscriber falls QUEUE_SIZE events behind.
+    """
+    subscriber = _Subscriber(asyncio.get_running_loop())
+    with _lock:
+        backlog = [e for e in _history if e["id"] > last_event_id] if last_event_id is not None else []
+        _subscribers.add(subscriber)
+    try:
+        # Registered under the same lock as the backlog snapshot: no event is missed or repeated.
+        for event in backlog:
+            yield event
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if event is None:
+                return
+            yield event
+    finally:
+        with _lock:
+            _subscribers.discard(subscriber)
+
+
+def subscriber_count():
+    with _lock:
+        return len(_subscribers)
@@ -1,9 +1,17 @@
 # predictor/api_urls.py
 from django.urls import path
-from . import api_views
+from . import api_views, async_api_views
 
 urlpatterns = [
     path('match-score/', api_views.match_score, name='api_match_score'),
+    path('match-score/batch/', api_views.match_scores, name='api_match_scores'),
     path('fund/', api_views.fund_student, name='api_fund_student'),
+    path('fund/bulk/', api_views.fund_matches, name='api_fund_matches'),
     path('registration-alerts/', api_views.registration_alerts, name='api_registration_alerts'),
+    path('leaderboard/', api_views.csr_leaderboard, name='api_csr_leaderboard'),
+
+    # Async versions, for ASGI deployments
+    path('async/match-score/', async_api_views.match_score, name='api_async_match_score'),
+    path('async/fund/', async_api_views.fund_student, name='api_async_fund_student'),
+    path('async/registration-alerts/', async_api_views.registration_alerts, name='api_async_registration_alerts'),
 ]
@@ -1,10 +1,27 @@
 # predictor/api_views.py
-from django.http import JsonResponse
+import hashlib
+from datetime import timezone as dt_timezone
+
+from django.db.models import Max, Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt
-from .models import Student, Donor, BursaryRequest, Transaction
+from .models import Student, Donor, BursaryRequest
+from .matcher import MATCHERS, DONOR_FEATURE_FIELDS, STUDENT_FEATURE_FIELDS, donor_features, student_features
 from .matcher import score as match_donor  # your ML match function
+from .pagination import decode_cursor, encode_cursor
+from . import leaderboard, wallet
 import json
 
+MAX_SCORE_PAIRS = 1000
+SCORE_CHUNK_SIZE = 100  # pairs scored (and streamed) at a time
+ALERTS_PAGE_SIZE = 500
+MAX_ALERTS_PAGE_SIZE = 2000
+ALERT_FIELDS = ("id", "first_name", "last_name", "course", "gpa", "need_score", "registration_paid", "updated_at")
+
 @csrf_exempt
 def match_score(request):
     """
@@ -17,68 +34,253 @@ def match_score(request):
             student = Student.objects.get(id=data["student_id"])
             donor = Donor.objects.get(id=data["donor_id"])
 
-            student_features = {
-                "gpa": student.gpa,
-                "course": student.course,
-                "need_score": student.need_score,
-            }
-            donor_features = {
-                "donor_type": donor.donor_type,
-                "preferred_course": donor.preferred_course,
-            }
-            score = match_donor(student_features, donor_features)
+            score, _ = match_donor(student_features(student), donor_features(donor))
             return JsonResponse({"match_score": round(float(score), 3)})
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=400)
     return JsonResponse({"error": "Invalid method"}, status=405)
 
 
+def _score_pairs(data):
+    """The (student_id, donor_id) pairs of a batch request, in request order."""
+    if "pairs" in data:
+        return [(int(p["student_id"]), int(p["donor_id"])) for p in data["pairs"]]
+    return [(int(data["student_id"]), int(donor_id)) for donor_id in data["donor_ids"]]
+
+
+def _stream_scores(matcher_name, matcher, pairs, students, donors):
+    yield f'{{"matcher": {json.dumps(matcher_name)}, "scores": ['
+    for start in range(0, len(pairs), SCORE_CHUNK_SIZE):
+        chunk = pairs[start:start + SCORE_CHUNK_SIZE]
+        known = [(s, d) for s, d in chunk if s in students and d in donors]
+        scored = dict(zip(known, matcher.score_pairs(
+            [(student_features(students[s]), donor_features(donors[d])) for s, d in known]
+        )))
+        results = []
+        for student_id, donor_id in chunk:
+            result = {"student_id": student_id, "donor_id": donor_id}
+            if (student_id, donor_id) in scored:
+                result["match_score"], result["explanation"] = scored[(student_id, donor_id)]
+            else:
+                result["error"] = "Unknown student" if student_id not in students else "Unknown donor"
+            results.append(json.dumps(result))
+        yield ("" if start == 0 else ", ") + ", ".join(results)
+    yield "]}"
+
+
 @csrf_exempt
+def match_scores(request):
+    """
+    POST: { "pairs": [ { "student_id": 1, "donor_id": 2 }, ... ], "matcher": "heuristic" }
+      or: { "student_id": 1, "donor_ids": [2, 3, ...], "matcher": "ml" }
+    Scores up to MAX_SCORE_PAIRS pairs with the heuristic (default) or ML matcher.
+    Returns (streamed, in request order):
+    { "matcher": "heuristic", "scores": [ { "student_id": 1, "donor_id": 2, "match_score": 0.87, "explanation": {...} }, ... ] }
+    Pairs naming an unknown student or donor get an "error" instead of a score.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid method"}, status=405)
+    try:
+        data = json.loads(request.body)
+        pairs = _score_pairs(data)
+        matcher_name = data.get("matcher", "heuristic")
+        if matcher_name not in MATCHERS:
+            raise ValueError(f"Unknown matcher {matcher_name!r}; choose from {', '.join(MATCHERS)}")
+        if len(pairs) > MAX_SCORE_PAIRS:
+            raise ValueError(f"At most {MAX_SCORE_PAIRS} pairs per request")
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    matcher = MATCHERS[matcher_name]()
+    try:
+        matcher.warm()
+    except OSError as e:
+        return JsonResponse({"error": f"Matcher {matcher_name!r} is unavailable: {e}"}, status=503)
+
+    # Every referenced row in two queries, only the columns the matchers read
+    students = Student.objects.only(*STUDENT_FEATURE_FIELDS).in_bulk({s for s, _ in pairs})
+    donors = Donor.objects.only(*DONOR_FEATURE_FIELDS).in_bulk({d for _, d in pairs})
+    stream = _stream_scores(matcher_name, matcher, pairs, students, donors)
+    return StreamingHttpResponse(stream, content_type="application/json")
+
+
 def fund_student(request):
     """
-    POST: { "bursary_id": 10, "donor_id": 2, "amount": 500 }
-    Simulates a donor funding a bursary request and marks it as funded.
+    POST: { "bursary_id": 10, "amount": 500 }
+    Simulates the logged-in donor (session auth, CSRF token required) funding a bursary
+    request; it is marked funded once covered.
     """
     if request.method == "POST":
+        if not request.user.is_authenticated:
+            return JsonResponse({"error": "Authentication required"}, status=401)
+        donor = Donor.objects.filter(user=request.user).first()
+        if donor is None:
+            return JsonResponse({"error": "Only donors can fund bursaries"}, status=403)
         try:
             data = json.loads(request.body)
             bursary = BursaryRequest.objects.get(id=data["bursary_id"])
-            donor = Donor.objects.get(id=data["donor_id"])
 
-            # Simple mock payment simulation
-            bursary.amount_funded += data["amount"]
-            bursary.save()
+            # Mock payment: debit the donor's wallet and record the Transaction atomically
+            tx, fulfilled = wallet.fund_bursary(donor, bursary, data["amount"])
 
-            Transaction.objects.create(
-                bursary_request=bursary,
-                donor=donor,
-                amount=data["amount"],
-                status="SUCCESS"
-            )
+            return JsonResponse({
+                "status": "success",
+                "message": f"{tx.amount} funded successfully",
+                "bursary_status": "fully funded" if fulfilled else "pending"
+            })
+        except wallet.InsufficientFunds as e:
+            return JsonResponse({"error": str(e)}, status=409)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"error": "Invalid method"}, status=405)
+
+
+def fund_matches(request):
+    """
+    POST: { "items": [ { "match_id": 10, "amount": 500 }, ... ] }
+    Spends the logged-in donor's wallet (session auth, CSRF token required). Funds every
+    listed match in one transaction; nothing is funded if any item is invalid or the
+    wallet does not cover the total.
+    """
+    if request.method == "POST":
+        if not request.user.is_authenticated:
+            return JsonResponse({"error": "Authentication required"}, status=401)
+        donor = Donor.objects.filter(user=request.user).first()
+        if donor is None:
+            return JsonResponse({"error": "Only donors can fund matches"}, status=403)
+        try:
+            data = json.loads(request.body)
+            items = [(int(item["match_id"]), item["amount"]) for item in data["items"]]
+
+            transactions = wallet.fund_matches(donor, items)
 
             return JsonResponse({
                 "status": "success",
-                "message": f"{data['amount']} funded successfully",
-                "bursary_status": "fully funded" if bursary.is_fully_funded() else "pending"
+                "funded": [
+                    {"match_id": tx.match_id, "amount": str(tx.amount), "tx_ref": tx.tx_ref}
+                    for tx in transactions
+                ],
+                "total": str(sum(tx.amount for tx in transactions)),
+                "wallet_balance": str(donor.wallet_balance),
             })
+        except wallet.InsufficientFunds as e:
+            return JsonResponse({"error": str(e)}, status=409)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=400)
     return JsonResponse({"error": "Invalid method"}, status=405)
 
 
+def _format_watermark(value):
+    # "Z" rather than "+00:00", which would arrive as a space in an unencoded ?since=
+    return value.astimezone(dt_timezone.utc).isoformat().replace("+00:00", "Z") if value else None
+
+
+def _parse_watermark(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def _alert_params(request):
+    """(limit, since) of a registration_alerts request; raises ValueError."""
+    try:
+        limit = min(int(request.GET.get("limit", ALERTS_PAGE_SIZE)), MAX_ALERTS_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        raise ValueError("limit must be a positive integer")
+    since = request.GET.get("since")
+    try:
+        return limit, _parse_watermark(since) if since else None
+    except ValueError:
+        raise ValueError(f"since must be an ISO timestamp, got {since!r}")
+
+
+def _alert_rows(since, cursor, limit):
+    """
+    One page of ALERT_FIELDS tuples in (updated_at, id) order, starting after `cursor`;
+    limit + 1 rows are fetched to tell whether there is a next page. Returns a lazy queryset.
+    """
+    rows = Student.objects.filter(registration_paid=False) if since is None else Student.objects.filter(updated_at__gt=since)
+    if cursor:
+        _, updated_at, pk = decode_cursor(cursor)
+        rows = rows.filter(Q(updated_at__gte=updated_at) & (Q(updated_at__gt=updated_at) | Q(id__gt=pk)))
+    return rows.order_by("updated_at", "id").values_list(*ALERT_FIELDS)[:limit + 1]
+
+
+def _alert_etag(request, last_updated):
+    watermark = _format_watermark(last_updated)
+    return watermark, quote_etag(hashlib.md5(f"{watermark}:{request.get_full_path()}".encode()).hexdigest())
+
+
+def _alert_response(page, limit, since, watermark, etag):
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor("next", page[-1][-1], page[-1][0])
+
+    unpaid, resolved = [], []
+    for pk, first_name, last_name, course, gpa, need_score, paid, _ in page:
+        if paid:
+            resolved.append(pk)
+        else:
+            unpaid.append({
+                "id": pk,
+                "name": f"{first_name} {last_name}",
+                "course": course,
+                "gpa": gpa,
+                "need_score": need_score,
+            })
+    body = {"unpaid_students": unpaid, "next_cursor": next_cursor, "watermark": watermark}
+    if since is not None:
+        body["resolved"] = resolved
+    response = JsonResponse(body)
+    response["ETag"] = etag
+    return response
+
+
 def registration_alerts(request):
     """
-    GET: Returns list of students with unpaid registration fees (for queue reduction).
+    GET: Students with unpaid registration fees (for queue reduction), in pages of
+    ?limit= (default 500); follow "next_cursor" with ?cursor= until it is null.
+
+    ?since=<watermark> returns only students changed after that watermark (a previous
+    response's "watermark"): still unpaid ones in "unpaid_students", paid ones by id in
+    "resolved". Responses carry an ETag; a matching If-None-Match gets a 304.
+    """
+    try:
+        limit, since = _alert_params(request)
+        rows = _alert_rows(since, request.GET.get("cursor"), limit)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # Read before the rows: anything changed while the page is built is newer than the
+    # watermark, so the next ?since= poll picks it up again.
+    watermark, etag = _alert_etag(request, Student.objects.aggregate(last=Max("updated_at"))["last"])
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    return _alert_response(list(rows), limit, since, watermark, etag)
+
+
+def csr_leaderboard(request):
+    """
+    GET ?donor_type=corporate (optional)
+    Returns: { "donor_type": "all", "leaderboard": [ { "rank": 1, "name": ..., "csr_score": ... }, ... ] }
     """
-    unpaid_students = Student.objects.filter(registration_paid=False)
-    results = [
+    donor_type = request.GET.get("donor_type") or None
+    if donor_type and donor_type not in dict(Donor.DONOR_TYPES):
+        return JsonResponse({"error": f"Unknown donor_type {donor_type!r}"}, status=400)
+    entries = [
         {
-            "id": s.id,
-            "name": s.name,
-            "course": s.course,
-            "gpa": s.gpa,
-            "need_score": s.need_score,
+            "rank": e["rank"],
+            "donor_id": e["donor_id"],
+            "name": e["name"],
+            "donor_type": e["donor_type"],
+            "csr_score": e["csr_score"],
+            "total_donated": str(e["total_donated"]),
         }
-        for s in unpaid_students
+        for e in leaderboard.get_leaderboard(donor_type)
     ]
-    return JsonResponse({"unpaid_students": results})
+    return JsonResponse({"donor_type": donor_type or "all", "leaderboard": entries})
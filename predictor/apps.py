@@ -1,4 +1,7 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PredictorConfig(AppConfig):
@@ -6,4 +9,11 @@ class PredictorConfig(AppConfig):
     name = 'predictor'
 
     def ready(self):
-        import predictor.signals 
+        import predictor.signals
+
+        # Load the ML model at startup instead of on the first request. In the gunicorn
+        # master (--preload) this lets the forked workers share its pages copy-on-write.
+        if getattr(settings, "MATCHING_MODEL_EAGER_LOAD", False):
+            from predictor.ml.model_utils import MODEL_PATH, get_registry
+            if os.path.exists(MODEL_PATH):
+                get_registry(MODEL_PATH).load()
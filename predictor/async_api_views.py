@@ -0,0 +1,108 @@
+# predictor/async_api_views.py
+# Async versions of the JSON API for ASGI deployments (FundForward/asgi.py), mounted
+# under /api/async/. Reads use the async ORM; scoring runs on a bounded thread pool so
+# it never blocks the event loop; wallet writes, which need a transaction, run through
+# sync_to_async. A slow database lock holds up one request, not a worker.
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Max
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+
+from . import wallet
+from .api_views import _alert_etag, _alert_params, _alert_response, _alert_rows
+from .matcher import donor_features, student_features
+from .matcher import score as match_donor
+from .models import BursaryRequest, Donor, Student
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def scoring_pool():
+    """The process-wide scoring pool (SCORING_POOL_WORKERS threads), created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=getattr(settings, "SCORING_POOL_WORKERS", 4), thread_name_prefix="scoring")
+        return _pool
+
+
+async def run_scoring(func, *args):
+    """Run CPU-bound `func(*args)` on the scoring pool and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(scoring_pool(), functools.partial(func, *args))
+
+
+@csrf_exempt
+async def match_score(request):
+    """
+    POST: { "student_id": 1, "donor_id": 2 }
+    Returns: { "match_score": 0.87 }
+    """
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+            student = await Student.objects.aget(id=data["student_id"])
+            donor = await Donor.objects.aget(id=data["donor_id"])
+
+            score, _ = await run_scoring(match_donor, student_features(student), donor_features(donor))
+            return JsonResponse({"match_score": round(float(score), 3)})
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"error": "Invalid method"}, status=405)
+
+
+async def fund_student(request):
+    """
+    POST: { "bursary_id": 10, "amount": 500 }
+    Same as api_views.fund_student (the logged-in donor's wallet, CSRF token required).
+    """
+    if request.method == "POST":
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({"error": "Authentication required"}, status=401)
+        donor = await Donor.objects.filter(user=user).afirst()
+        if donor is None:
+            return JsonResponse({"error": "Only donors can fund bursaries"}, status=403)
+        try:
+            data = json.loads(request.body)
+            bursary = await BursaryRequest.objects.aget(id=data["bursary_id"])
+
+            # The wallet flow is one transaction, which the async ORM cannot hold open
+            tx, fulfilled = await sync_to_async(wallet.fund_bursary)(donor, bursary, data["amount"])
+
+            return JsonResponse({
+                "status": "success",
+                "message": f"{tx.amount} funded successfully",
+                "bursary_status": "fully funded" if fulfilled else "pending"
+            })
+        except wallet.InsufficientFunds as e:
+            return JsonResponse({"error": str(e)}, status=409)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"error": "Invalid method"}, status=405)
+
+
+async def registration_alerts(request):
+    """
+    GET: Same as api_views.registration_alerts (?limit=, ?cursor=, ?since=, ETag).
+    """
+    try:
+        limit, since = _alert_params(request)
+        rows = _alert_rows(since, request.GET.get("cursor"), limit)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    last_updated = (await Student.objects.aaggregate(last=Max("updated_at")))["last"]
+    watermark, etag = _alert_etag(request, last_updated)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    return _alert_response([row async for row in rows], limit, since, watermark, etag)
@@ -0,0 +1,52 @@
+# predictor/cache_locks.py
+# "Only one process at a time" locks for work around a shared Django cache (dashboard
+# recomputes, leaderboard patches). On the file-based cache they are flocks in the cache
+# directory, since its add() is has_key-then-set and not atomic across processes.
+import os
+import zlib
+from contextlib import contextmanager
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to cache.add, which is not atomic for file caches
+    fcntl = None
+
+# File-based caches lock with flock on one of this many lock files in the cache directory
+LOCK_STRIPES = 64
+LOCK_TIMEOUT = 30
+
+
+@contextmanager
+def try_lock(cache, key, timeout=LOCK_TIMEOUT):
+    """
+    Yields True to the one caller holding `key`, False to the rest (it never waits). On the
+    file-based cache this is a non-blocking flock, atomic across the processes sharing the
+    directory and released if its holder dies; other backends use cache.add (expiring
+    after `timeout` seconds), which Redis, Memcached and the local-memory cache perform
+    atomically.
+    """
+    if fcntl is not None and isinstance(cache, FileBasedCache):
+        os.makedirs(cache._dir, exist_ok=True)
+        stripe = zlib.crc32(key.encode()) % LOCK_STRIPES
+        fd = os.open(os.path.join(cache._dir, f"lock-{stripe}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+    elif cache.add(f"{key}:lock", 1, timeout):
+        try:
+            yield True
+        finally:
+            cache.delete(f"{key}:lock")
+    else:
+        yield False
@@ -0,0 +1,111 @@
+# predictor/courses.py
+from django.db.models import Q
+
+from predictor.models import Course, Donor, Student
+
+ANY_COURSE = "any"
+
+
+def normalize_course(name):
+    """Lowercase and collapse whitespace: '  Civil   Engineering ' -> 'civil engineering'."""
+    return " ".join((name or "").lower().split())
+
+
+def parse_preferences(text):
+    """
+    Split a donor's preferred_course into normalised course names.
+    An empty list means the donor accepts any course.
+    """
+    names = []
+    for part in (text or "").split(","):
+        name = normalize_course(part)
+        if name == ANY_COURSE:
+            return []
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def course_matches(preferred_course, student_course):
+    """
+    The course rule of Matcher.score: the student's course contains any of the
+    donor's preferred courses, or the donor accepts any course.
+    """
+    preferences = parse_preferences(preferred_course)
+    course = normalize_course(student_course)
+    return not preferences or any(p in course for p in preferences)
+
+
+def resolve_course(name):
+    """
+    Return the Course for a (raw) course name, creating it on first use.
+    A new course is linked to every existing course it covers or is covered by;
+    this is the only place the substring rule is evaluated.
+    """
+    name = normalize_course(name)
+    if not name:
+        return None
+    course, created = Course.objects.get_or_create(name=name)
+    if created:
+        Link = Course.covers.through
+        links = [Link(from_course_id=course.id, to_course_id=course.id)]
+        for other_id, other_name in Course.objects.exclude(id=course.id).values_list("id", "name").iterator():
+            if name in other_name:
+                links.append(Link(from_course_id=course.id, to_course_id=other_id))
+            if other_name in name:
+                links.append(Link(from_course_id=other_id, to_course_id=course.id))
+        Link.objects.bulk_create(links, ignore_conflicts=True)
+    return course
+
+
+def index_student(student):
+    """Point student.course_ref at the normalised course (no post_save is fired)."""
+    student.course_ref = resolve_course(student.course)
+    Student.objects.filter(pk=student.pk).update(course_ref=student.course_ref)
+
+
+def index_donor(donor):
+    """Replace the donor's preferred_courses with the parsed preferred_course list."""
+    donor.preferred_courses.set([resolve_course(name) for name in parse_preferences(donor.preferred_course)])
+
+
+def accepted_course_ids(donor_ids):
+    """
+    Inverted-index probe: {donor_id: set of student course ids the donor accepts}.
+    Donors missing from the result accept any course.
+    """
+    Preference = Donor.preferred_courses.through
+    Link = Course.covers.through
+    preferences = {}
+    for donor_id, course_id in Preference.objects.filter(donor_id__in=donor_ids).values_list("donor_id", "course_id"):
+        preferences.setdefault(donor_id, set()).add(course_id)
+    if not preferences:
+        return {}
+
+    covers = {}
+    preferred_ids = set().union(*preferences.values())
+    for from_id, to_id in Link.objects.filter(from_course_id__in=preferred_ids).values_list("from_course_id", "to_course_id"):
+        covers.setdefault(from_id, set()).add(to_id)
+    return {
+        donor_id: set().union(*(covers.get(course_id, {course_id}) for course_id in course_ids))
+        for donor_id, course_ids in preferences.items()
+    }
+
+
+def candidate_students(donor):
+    """Students whose course this donor accepts."""
+    accepted = accepted_course_ids([donor.id]).get(donor.id)
+    students = Student.objects.all()
+    if accepted is not None:
+        students = students.filter(course_ref__in=accepted)
+    return students
+
+
+def candidate_donors(student):
+    """Donors that accept this student's course (including donors open to any course)."""
+    accepts_any = Q(preferred_courses__isnull=True)
+    if student.course_ref_id is None:
+        return Donor.objects.filter(accepts_any)
+    return Donor.objects.filter(
+        accepts_any | Q(preferred_courses__covers=student.course_ref_id)
+    ).distinct()
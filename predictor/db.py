@@ -0,0 +1,44 @@
+# predictor/db.py
+# SQLite connection tuning and lock handling. With SQLITE_PRAGMAS set (the production
+# profile in FundForward/settings.py) every new connection is configured through the
+# connection_created signal (see predictor.signals); write paths that can collide with
+# another worker are wrapped in retry_on_lock.
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+# SQLite reports write contention as "database is locked" / "database table is locked".
+LOCK_RETRIES = 15
+LOCK_BACKOFF_SECONDS = 0.01
+LOCK_BACKOFF_MAX_SECONDS = 0.25
+
+
+def apply_pragmas(connection, pragmas=None):
+    """Run PRAGMA name = value for each of `pragmas` (default: settings.SQLITE_PRAGMAS) on a SQLite connection."""
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", {}) if pragmas is None else pragmas
+    if connection.vendor != "sqlite" or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def retry_on_lock(func):
+    """
+    Re-run a short write transaction when the database is locked by another writer,
+    with capped, jittered exponential backoff. Only safe for functions that open their own atomic block.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(LOCK_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if "locked" not in str(e) or attempt == LOCK_RETRIES - 1 or transaction.get_connection().in_atomic_block:
+                    raise
+                # Jittered, so writers that collided do not retry in lockstep
+                time.sleep(min(LOCK_BACKOFF_SECONDS * 2 ** attempt, LOCK_BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.5))
+    return wrapper
@@ -0,0 +1,99 @@
+# predictor/exports.py
+# Streaming CSV / NDJSON exports of Transaction and UniversityPayment history for
+# reconciliation. Rows come from values_list(...).iterator(), so memory stays constant
+# however many rows are exported.
+import csv
+import json
+from datetime import date, datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Transaction, UniversityPayment
+
+CHUNK_SIZE = 2000
+FORMATS = ("csv", "ndjson")
+
+# name -> (model, date field, exported columns)
+EXPORTS = {
+    "transactions": (Transaction, "created_at", (
+        "id", "created_at", "donor_id", "donor__name", "student_id", "student__student_number",
+        "match_id", "bursary_request_id", "amount", "tx_ref", "description",
+    )),
+    "payments": (UniversityPayment, "timestamp", (
+        "id", "timestamp", "student_id", "student__student_number", "donor_id", "donor__name",
+        "amount", "payment_type", "approved", "description",
+    )),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"{name} must be a date (YYYY-MM-DD), got {value!r}")
+
+
+def _parse_id(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ExportError(f"{name} must be an id, got {value!r}")
+
+
+def export_rows(kind, start=None, end=None, donor=None, student=None):
+    """
+    (columns, row iterator) for an export. `start`/`end` are inclusive YYYY-MM-DD dates,
+    `donor`/`student` ids; all optional. Rows are in id order.
+    """
+    if kind not in EXPORTS:
+        raise ExportError(f"Unknown export {kind!r}; choose from {', '.join(EXPORTS)}")
+    model, date_field, columns = EXPORTS[kind]
+    rows = model.objects.all()
+    tz = timezone.get_current_timezone()
+    if start:
+        start = datetime.combine(_parse_date(start, "start"), time.min, tz)
+        rows = rows.filter(**{f"{date_field}__gte": start})
+    if end:
+        end = datetime.combine(_parse_date(end, "end") + timedelta(days=1), time.min, tz)
+        rows = rows.filter(**{f"{date_field}__lt": end})
+    if donor:
+        rows = rows.filter(donor_id=_parse_id(donor, "donor"))
+    if student:
+        rows = rows.filter(student_id=_parse_id(student, "student"))
+    return columns, rows.order_by("id").values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_cell(v) for v in row])
+
+
+def iter_ndjson(columns, rows):
+    for row in rows:
+        record = {c: v.isoformat() if isinstance(v, datetime) else v for c, v in zip(columns, row)}
+        yield json.dumps(record, default=str) + "\n"
+
+
+def iter_export(fmt, columns, rows):
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt!r}; choose from {', '.join(FORMATS)}")
+    return iter_csv(columns, rows) if fmt == "csv" else iter_ndjson(columns, rows)
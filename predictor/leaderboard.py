@@ -0,0 +1,116 @@
+# predictor/leaderboard.py
+# CSR leaderboard (overall and per donor_type), kept in a cache every worker process
+# shares (LEADERBOARD_CACHE_ALIAS). A board is built from the database once (one query)
+# and afterwards patched in place after every committed donation, instead of being
+# re-ranked on each request.
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache_locks import try_lock
+from .models import Donor
+
+LEADERBOARD_SIZE = 100
+# A board is rebuilt at least this often, in case a build raced a donation.
+LEADERBOARD_TIMEOUT = 300
+VERSION_KEY = "csr-leaderboard:version"
+
+
+def _cache():
+    return caches[getattr(settings, "LEADERBOARD_CACHE_ALIAS", "default")]
+
+
+def _version(cache):
+    # Boards are stored under a random version; invalidate() moves to a new one, so a
+    # patch written by another process under the old version is never read again.
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _key(version, donor_type=None):
+    return f"csr-leaderboard:v{version}:{donor_type or 'all'}"
+
+
+def _sort_key(entry):
+    return (-entry["csr_score"], -entry["total_donated"], entry["donor_id"])
+
+
+def _entry(donor_id, name, donor_type, csr_score, total_donated):
+    return {
+        "donor_id": donor_id,
+        "name": name,
+        "donor_type": donor_type,
+        "csr_score": csr_score,
+        "total_donated": total_donated,
+    }
+
+
+def _rank(entries):
+    """Sort and number the entries; equal CSR scores share a rank (1, 2, 2, 4)."""
+    entries.sort(key=_sort_key)
+    del entries[LEADERBOARD_SIZE:]
+    for position, entry in enumerate(entries):
+        same_as_previous = position and entry["csr_score"] == entries[position - 1]["csr_score"]
+        entry["rank"] = entries[position - 1]["rank"] if same_as_previous else position + 1
+    return entries
+
+
+def _build(donor_type=None):
+    donors = Donor.objects.filter(csr_score__gt=0)
+    if donor_type:
+        donors = donors.filter(donor_type=donor_type)
+    rows = donors.order_by("-csr_score", "-total_donated", "id").values_list(
+        "id", "name", "donor_type", "csr_score", "total_donated"
+    )[:LEADERBOARD_SIZE]
+    return _rank([_entry(*row) for row in rows])
+
+
+def get_leaderboard(donor_type=None):
+    """Ranked list of up to LEADERBOARD_SIZE donors with CSR points."""
+    cache = _cache()
+    key = _key(_version(cache), donor_type)
+    entries = cache.get(key)
+    if entries is None:
+        entries = _build(donor_type)
+        cache.add(key, entries, LEADERBOARD_TIMEOUT)  # never over a board a donation just patched
+    return entries
+
+
+def position(donor, donor_type=None):
+    """The donor's rank on a board, or None if they are not on it."""
+    return next((e["rank"] for e in get_leaderboard(donor_type) if e["donor_id"] == donor.pk), None)
+
+
+def record_donation(donor):
+    """
+    Patch the cached boards with the donor's new totals. Call after the donation has
+    committed. Donations only ever raise a score, so a donor either moves up a board
+    or enters it at the bottom; no other entry needs the database.
+
+    Patches are read-modify-write, so they run under a cross-process lock; a donation
+    that finds another process patching invalidates the boards instead of waiting.
+    """
+    cache = _cache()
+    entry = _entry(donor.pk, donor.name, donor.donor_type, donor.csr_score, donor.total_donated)
+    with try_lock(cache, VERSION_KEY) as won:
+        if not won:
+            invalidate()
+            return
+        version = _version(cache)
+        for donor_type in (None, donor.donor_type):
+            entries = cache.get(_key(version, donor_type))
+            if entries is None:
+                continue  # built on next read
+            entries = [e for e in entries if e["donor_id"] != donor.pk]
+            if entry["csr_score"] > 0:
+                entries.append(dict(entry))
+            cache.set(_key(version, donor_type), _rank(entries), LEADERBOARD_TIMEOUT)
+
+
+def invalidate():
+    """Drop every cached board, in every process (after a bulk recompute)."""
+    _cache().set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
@@ -0,0 +1,152 @@
+# predictor/ledger.py
+# Append-only wallet ledger. Every change to a Donor/Student wallet_balance is also written
+# as a signed LedgerEntry in the same transaction (see predictor.wallet). A wallet's balance
+# is its latest WalletSnapshot plus the entries after it; compaction keeps that tail short.
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from .models import Donor, LedgerEntry, Student, WalletSnapshot
+
+# Only entries at least this old are compacted, so an entry whose id was allocated before
+# a concurrent compaction but committed after it is never skipped.
+COMPACTION_GRACE_SECONDS = 60
+CHUNK_SIZE = 500
+WALLETS = (("donor", Donor), ("student", Student))
+
+
+def _wallet(instance):
+    return ("donor", instance.pk) if isinstance(instance, Donor) else ("student", instance.pk)
+
+
+def append(entries, tx=None):
+    """Write unsaved LedgerEntry objects, optionally linking them to a Transaction."""
+    for entry in entries:
+        entry.transaction = tx
+    LedgerEntry.objects.bulk_create(entries)
+
+
+def balance(wallet):
+    """
+    Balance of a Donor or Student according to the ledger: two indexed reads, the
+    latest snapshot and the (compacted, so short) sum of entries written after it.
+    """
+    kind, pk = _wallet(wallet)
+    snapshot = (
+        WalletSnapshot.objects.filter(**{kind: pk}).order_by("-last_entry_id").values_list("balance", "last_entry_id").first()
+    )
+    base, after = snapshot or (0, 0)
+    tail = LedgerEntry.objects.filter(**{kind: pk}, id__gt=after).aggregate(total=Sum("amount"))["total"]
+    return base + (tail or 0)
+
+
+def _latest_snapshots(kind, ids):
+    rows = WalletSnapshot.objects.filter(**{f"{kind}__in": ids}).order_by(kind, "last_entry_id").values_list(kind, "balance")
+    return dict(rows)  # later (newer) rows overwrite earlier ones
+
+
+def compact(grace_seconds=COMPACTION_GRACE_SECONDS):
+    """
+    Roll every wallet's new entries into a fresh snapshot and drop the snapshots it
+    supersedes (opening snapshots are kept for audit). Returns the number written.
+    """
+    with transaction.atomic():
+        previous = WalletSnapshot.objects.aggregate(last=Max("last_entry_id"))["last"] or 0
+        cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+        watermark = LedgerEntry.objects.filter(id__gt=previous, created_at__lte=cutoff).aggregate(last=Max("id"))["last"]
+        if watermark is None:
+            return 0
+
+        written = 0
+        for kind, _ in WALLETS:
+            sums = dict(
+                LedgerEntry.objects.filter(id__gt=previous, id__lte=watermark, **{f"{kind}__isnull": False})
+                .order_by().values_list(kind).annotate(total=Sum("amount"))
+            )
+            ids = list(sums)
+            for start in range(0, len(ids), CHUNK_SIZE):
+                chunk = ids[start:start + CHUNK_SIZE]
+                bases = _latest_snapshots(kind, chunk)
+                WalletSnapshot.objects.filter(**{f"{kind}__in": chunk}, last_entry_id__gt=0).delete()
+                WalletSnapshot.objects.bulk_create(
+                    WalletSnapshot(**{f"{kind}_id": pk}, balance=bases.get(pk, 0) + sums[pk], last_entry_id=watermark)
+                    for pk in chunk
+                )
+                written += len(chunk)
+        return written
+
+
+def reconcile(chunk_size=CHUNK_SIZE):
+    """
+    Compare every wallet's wallet_balance with balance() (latest snapshot plus the entries
+    after it) and yield a dict for each disagreement. Works a chunk of wallets at a time,
+    each chunk read in one transaction with a few set-based queries, so it is cheap
+    enough to run often; audit() replays every entry to also check the snapshots.
+    """
+    for kind, model in WALLETS:
+        after = 0
+        while True:
+            with transaction.atomic():
+                wallets = list(model.objects.filter(pk__gt=after).order_by("pk").values_list("pk", "wallet_balance")[:chunk_size])
+                if not wallets:
+                    break
+                ids = [pk for pk, _ in wallets]
+                snapshots = {
+                    pk: (bal, last)  # later (newer) rows overwrite earlier ones
+                    for pk, bal, last in WalletSnapshot.objects.filter(**{f"{kind}__in": ids})
+                    .order_by(kind, "last_entry_id").values_list(kind, "balance", "last_entry_id")
+                }
+                # Wallets compacted together share a watermark: one OR branch per watermark
+                by_watermark = {}
+                for pk in ids:
+                    by_watermark.setdefault(snapshots.get(pk, (0, 0))[1], []).append(pk)
+                tail = Q()
+                for last, pks in by_watermark.items():
+                    tail |= Q(**{f"{kind}__in": pks}, id__gt=last)
+                tails = dict(LedgerEntry.objects.filter(tail).order_by().values_list(kind).annotate(total=Sum("amount")))
+            for pk, recorded in wallets:
+                expected = snapshots.get(pk, (0, 0))[0] + (tails.get(pk) or 0)
+                if expected != recorded:
+                    yield {"wallet": kind, "id": pk, "check": "balance", "ledger": expected, "recorded": recorded}
+            after = ids[-1]
+
+
+def audit(chunk_size=2000):
+    """
+    Replay the whole ledger in id order (a streaming scan; memory grows with the number
+    of wallets, not entries) and yield a dict for every disagreement with the latest
+    snapshot or with the wallet_balance column.
+    """
+    replayed, snapshots = {}, {}
+    for kind, _ in WALLETS:
+        for pk, bal, last in WalletSnapshot.objects.filter(**{f"{kind}__isnull": False}).order_by("last_entry_id").values_list(kind, "balance", "last_entry_id").iterator(chunk_size):
+            if last == 0:
+                replayed[(kind, pk)] = bal
+            else:
+                snapshots[(kind, pk)] = (last, bal)
+
+    def check_snapshot(wallet):
+        last, bal = snapshots.pop(wallet)
+        if replayed.get(wallet, 0) != bal:
+            return {"wallet": wallet[0], "id": wallet[1], "check": "snapshot", "ledger": replayed.get(wallet, 0), "recorded": bal}
+
+    entries = LedgerEntry.objects.order_by("id").values_list("id", "donor_id", "student_id", "amount").iterator(chunk_size)
+    for entry_id, donor_id, student_id, amount in entries:
+        wallet = ("donor", donor_id) if donor_id else ("student", student_id)
+        if wallet in snapshots and entry_id > snapshots[wallet][0]:
+            problem = check_snapshot(wallet)
+            if problem:
+                yield problem
+        replayed[wallet] = replayed.get(wallet, 0) + amount
+    for wallet in list(snapshots):
+        problem = check_snapshot(wallet)
+        if problem:
+            yield problem
+
+    for kind, model in WALLETS:
+        for pk, recorded in model.objects.order_by("pk").values_list("pk", "wallet_balance").iterator(chunk_size):
+            expected = replayed.get((kind, pk), 0)
+            if expected != recorded:
+                yield {"wallet": kind, "id": pk, "check": "balance", "ledger": expected, "recorded": recorded}
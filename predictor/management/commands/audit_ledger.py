@@ -0,0 +1,22 @@
+# predictor/management/commands/audit_ledger.py
+from django.core.management.base import BaseCommand, CommandError
+
+from predictor import ledger
+
+
+class Command(BaseCommand):
+    help = "Replay the wallet ledger and report wallets whose snapshot or wallet_balance disagrees with it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched per database round trip.")
+
+    def handle(self, *args, **options):
+        problems = 0
+        for problem in ledger.audit(chunk_size=options["chunk_size"]):
+            problems += 1
+            self.stdout.write(
+                f"{problem['wallet']} {problem['id']}: {problem['check']} is {problem['recorded']}, ledger says {problem['ledger']}"
+            )
+        if problems:
+            raise CommandError(f"{problems} wallet(s) disagree with the ledger.")
+        self.stdout.write(self.style.SUCCESS("Ledger and wallet balances agree."))
@@ -0,0 +1,15 @@
+# predictor/management/commands/backfill_funding_rollups.py
+from django.core.management.base import BaseCommand
+
+from predictor import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily funding rollups of the transparency dashboard from UniversityPayment."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per fetch/insert batch.")
+
+    def handle(self, *args, **options):
+        rows = rollups.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} funding rollup rows."))
@@ -0,0 +1,189 @@
+# predictor/management/commands/bench_api.py
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from predictor.models import BursaryRequest, Donor, Student
+
+ENDPOINTS = ("match-score", "registration-alerts", "fund")
+
+
+def summarize(latencies, seconds, errors):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "requests_per_sec": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent-request throughput of the JSON API's sync views (WSGI handler, "
+        "one thread per concurrent request, like threaded workers) and its async views "
+        "(ASGI handler on one event loop). Runs in-process against a throwaway database, "
+        "logged in as a bench donor (who makes the fund requests), and prints (or writes) "
+        "JSON results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=ENDPOINTS)
+        parser.add_argument("--requests", type=int, default=400, help="Requests per endpoint, mode and concurrency.")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32],
+                            help="Concurrent requests in flight (WSGI threads / ASGI tasks).")
+        parser.add_argument("--students", type=int, default=2000)
+        parser.add_argument("--donors", type=int, default=50)
+        parser.add_argument("--output", default=None, help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or min(options["concurrency"]) < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # A file database, so concurrent threads see real SQLite locking
+            if connection.vendor == "sqlite":
+                connection.settings_dict["TEST"]["NAME"] = os.path.join(tmpdir, "bench_api.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.seed(options["students"], options["donors"])
+                # DEBUG off so neither path pays for query logging
+                with override_settings(ALLOWED_HOSTS=["testserver"], DEBUG=False):
+                    runs = [
+                        self.run(endpoint, concurrency, options["requests"])
+                        for endpoint in options["endpoints"]
+                        for concurrency in options["concurrency"]
+                    ]
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "cpu_count": os.cpu_count(),
+                "database": connection.vendor,
+            },
+            "runs": runs,
+        }
+        text = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(text + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(text)
+
+    def seed(self, n_students, n_donors):
+        self.stderr.write(f"Seeding {n_students} students x {n_donors} donors...")
+        rng = random.Random(42)
+        Student.objects.bulk_create(
+            (Student(student_number=f"BENCH{i:07d}", first_name="Bench", last_name=str(i), gpa=round(rng.uniform(1, 4), 2),
+                     need_score=rng.randint(0, 10), course=rng.choice(["ICT", "Engineering", "Commerce"]),
+                     registration_paid=rng.random() < 0.5)
+             for i in range(n_students)),
+            batch_size=2000,
+        )
+        Donor.objects.bulk_create(
+            Donor(name=f"Bench donor {j}", donor_type="corporate", preferred_course="ICT", min_gpa=2.5,
+                  wallet_balance=Decimal("10000000.00"))
+            for j in range(n_donors)
+        )
+        self.student_ids = list(Student.objects.values_list("id", flat=True))
+        self.donor_ids = list(Donor.objects.values_list("id", flat=True))
+        self.user = User.objects.create_user("bench-donor")
+        Donor.objects.filter(id=self.donor_ids[0]).update(user=self.user)
+        BursaryRequest.objects.bulk_create(
+            BursaryRequest(student_id=student_id, requested_amount=Decimal("1000000.00")) for student_id in self.student_ids
+        )
+        self.bursary_ids = list(BursaryRequest.objects.values_list("id", flat=True))
+
+    def request(self, endpoint, rng):
+        """(method, sync path, body) of one random request."""
+        if endpoint == "match-score":
+            return "post", "/api/match-score/", {"student_id": rng.choice(self.student_ids), "donor_id": rng.choice(self.donor_ids)}
+        if endpoint == "fund":
+            return "post", "/api/fund/", {"bursary_id": rng.choice(self.bursary_ids), "amount": 1}
+        return "get", "/api/registration-alerts/?limit=50", None
+
+    def run(self, endpoint, concurrency, n_requests):
+        rng = random.Random(endpoint)
+        requests = [self.request(endpoint, rng) for _ in range(n_requests)]
+        self.stderr.write(f"  {endpoint} x{concurrency}")
+        return {
+            "endpoint": endpoint,
+            "concurrency": concurrency,
+            "wsgi": self.run_wsgi(requests, concurrency),
+            "asgi": self.run_asgi(requests, concurrency),
+        }
+
+    def run_wsgi(self, requests, concurrency):
+        local = threading.local()
+        latencies, errors = [], []
+
+        def send(req):
+            method, path, body = req
+            client = getattr(local, "client", None)
+            if client is None:
+                client = local.client = Client()
+                client.force_login(self.user)
+            started = time.perf_counter()
+            if body is None:
+                response = getattr(client, method)(path)
+            else:
+                response = getattr(client, method)(path, json.dumps(body), content_type="application/json")
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, requests))
+        return summarize(latencies, time.perf_counter() - started, len(errors))
+
+    def run_asgi(self, requests, concurrency):
+        latencies, errors = [], []
+
+        async def main():
+            client = AsyncClient()
+            await client.aforce_login(self.user)
+            gate = asyncio.Semaphore(concurrency)
+
+            async def send(req):
+                method, path, body = req
+                path = path.replace("/api/", "/api/async/", 1)
+                async with gate:
+                    started = time.perf_counter()
+                    if body is None:
+                        response = await getattr(client, method)(path)
+                    else:
+                        response = await getattr(client, method)(path, json.dumps(body), content_type="application/json")
+                    latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+            await asyncio.gather(*(send(req) for req in requests))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        return summarize(latencies, time.perf_counter() - started, len(errors))
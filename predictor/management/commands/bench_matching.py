@@ -0,0 +1,208 @@
+# predictor/management/commands/bench_matching.py
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import django
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from predictor import courses
+from predictor.matcher import Matcher, ModelMatcher, iter_student_rows
+from predictor.models import Course, Donor, Student
+
+
+def parse_size(value):
+    try:
+        students, donors = (int(n) for n in value.lower().split("x"))
+    except ValueError:
+        raise CommandError(f"Invalid size {value!r}; expected STUDENTSxDONORS, e.g. 1000x100")
+    return students, donors
+
+
+class QueryCounter:
+    """Counts queries through an execute wrapper (no SQL is kept in memory)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(result, pairs, run, memory=True):
+    """
+    Fill `result` with wall time, pairs/sec and query count of `run()` and return its value.
+    With `memory`, peak traced memory comes from a second, untimed call: tracemalloc hooks
+    every allocation and would skew pairs/sec if it ran during the timed one.
+    """
+    counter = QueryCounter()
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        value = run()
+    seconds = time.perf_counter() - started
+    result.update({
+        "seconds": round(seconds, 4),
+        "pairs": pairs,
+        "pairs_per_sec": round(pairs / seconds) if seconds else None,
+        "queries": counter.count,
+    })
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        finally:
+            tracemalloc.stop()
+    return value
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark matching on synthetic data from predictor.ml.train_synthetic. "
+        "Runs against a throwaway test database and prints (or writes) JSON results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", default=["1000x100"],
+                            help="STUDENTSxDONORS populations to benchmark, e.g. 1000x100 100000x5000.")
+        parser.add_argument("--workers", type=int, default=1, help="Process pool size for generate_for_all.")
+        parser.add_argument("--batch-size", type=int, default=None, help="Students per scoring block.")
+        parser.add_argument("--model", default=None,
+                            help="Model file for ML scoring (default: train a small one from train_synthetic).")
+        parser.add_argument("--skip-ml", action="store_true", help="Do not benchmark ML scoring.")
+        parser.add_argument("--output", default=None, help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        sizes = [parse_size(value) for value in options["sizes"]]
+        batch = {"batch_size": options["batch_size"]} if options["batch_size"] else {}
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                model_path = None
+                if not options["skip_ml"]:
+                    model_path = options["model"] or self.train_model(tmpdir)
+                runs = [self.run_size(n_students, n_donors, options["workers"], batch, model_path)
+                        for n_students, n_donors in sizes]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "numpy": np.__version__,
+                "cpu_count": os.cpu_count(),
+                "database": connection.vendor,
+                "workers": options["workers"],
+            },
+            "runs": runs,
+        }
+        text = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(text + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(text)
+
+    def train_model(self, tmpdir):
+        import joblib
+        from sklearn.ensemble import RandomForestClassifier
+        from predictor.ml import train_synthetic
+
+        pairs = train_synthetic.make_pairs(train_synthetic.gen_students(500), train_synthetic.gen_donors(100), n_pairs=5000)
+        X = train_synthetic.fe(pairs.drop(columns=["label"]))
+        model = RandomForestClassifier(n_estimators=120, random_state=42).fit(X, pairs["label"])
+        path = os.path.join(tmpdir, "matching_model.joblib")
+        joblib.dump({"model": model, "columns": X.columns.tolist()}, path)
+        return path
+
+    def seed(self, n_students, n_donors):
+        from predictor.ml import train_synthetic
+
+        Student.objects.all().delete()
+        Donor.objects.all().delete()
+        Course.objects.all().delete()
+
+        students = train_synthetic.gen_students(n_students)
+        donors = train_synthetic.gen_donors(n_donors)
+        Student.objects.bulk_create(
+            (Student(student_number=f"BENCH{i:07d}", first_name="Bench", last_name=str(i),
+                     gpa=float(row.gpa), need_score=float(row.need_score), course=row.course, province=row.province)
+             for i, row in enumerate(students.itertuples())),
+            batch_size=2000,
+        )
+        Donor.objects.bulk_create(
+            (Donor(name=f"Bench donor {j}", donor_type=row.donor_type, preferred_course=row.preferred_course,
+                   min_gpa=float(row.min_gpa), max_amount=int(row.max_amount))
+             for j, row in enumerate(donors.itertuples())),
+            batch_size=2000,
+        )
+        # bulk_create skips post_save, so index the courses here
+        for name in students.course.unique():
+            Student.objects.filter(course=name).update(course_ref=courses.resolve_course(name))
+        Preference = Donor.preferred_courses.through
+        course_ids = {name: courses.resolve_course(name) for name in donors.preferred_course.unique()}
+        Preference.objects.bulk_create(
+            Preference(donor_id=donor_id, course_id=course_ids[name].id)
+            for donor_id, name in Donor.objects.values_list("id", "preferred_course")
+            if course_ids[name] is not None
+        )
+
+    def run_size(self, n_students, n_donors, workers, batch, model_path):
+        self.stderr.write(f"Seeding {n_students} students x {n_donors} donors...")
+        self.seed(n_students, n_donors)
+        results = {}
+        pairs = n_students * n_donors
+
+        self.stderr.write("  generate_for_all")
+        results["generate_for_all"] = {}
+        # Re-running is an upsert of the same matches, so the memory pass repeats the same work
+        results["generate_for_all"]["matches"] = measure(
+            results["generate_for_all"], pairs, lambda: Matcher(**batch).generate_for_all(workers=workers),
+        )
+
+        # The receivers as a request sees them when matching runs inline (no worker queue).
+        # Creating a row cannot be repeated, so these are timed only.
+        with override_settings(MATCHING_BACKGROUND_WORKER=False):
+            self.stderr.write("  post_save (student)")
+            results["post_save_student"] = {}
+            student = measure(results["post_save_student"], n_donors, lambda: Student.objects.create(
+                student_number="BENCH-NEW", first_name="New", last_name="Student", gpa=3.2, need_score=0.4, course="Engineering",
+            ), memory=False)
+            self.stderr.write("  post_save (donor)")
+            results["post_save_donor"] = {}
+            measure(results["post_save_donor"], n_students + 1, lambda: Donor.objects.create(
+                name="Bench new donor", donor_type="corporate", preferred_course="ICT", min_gpa=2.5,
+            ), memory=False)
+
+        self.stderr.write("  request_fee scoring")
+        results["request_fee_scoring"] = {}
+        measure(results["request_fee_scoring"], n_donors + 1, lambda: Matcher().rank_donors(student, limit=10))
+
+        if model_path:
+            self.stderr.write("  ML scoring")
+            ml = ModelMatcher(model_path=model_path, **batch)
+            donors = ml.load_donors(Donor.objects.all())
+            rows = next(iter_student_rows(Student.objects.all(), ml.student_columns, ml.batch_size))
+            ml._model()  # load outside the timed section
+            results["ml_scoring"] = {"students": len(rows)}
+            measure(results["ml_scoring"], len(rows) * len(donors[0]), lambda: ml.match_rows(rows, donors))
+
+        return {
+            "students": n_students,
+            "donors": n_donors,
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "results": results,
+        }
@@ -0,0 +1,165 @@
+# predictor/management/commands/bench_sqlite.py
+import json
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import Count, Q, Sum
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from predictor import wallet
+from predictor.models import Donor, Student, Transaction
+
+PROFILES = ("default", "production")
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent reader/writer throughput on a file SQLite database with the "
+        "default connection settings and with the production profile (WAL, busy timeout, "
+        "synchronous=NORMAL, larger cache, mmap, BEGIN IMMEDIATE). Reader threads run "
+        "dashboard-style queries while writer threads fund students through the wallet; "
+        "prints (or writes) JSON results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=PROFILES)
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each profile's run.")
+        parser.add_argument("--students", type=int, default=5000)
+        parser.add_argument("--donors", type=int, default=50)
+        parser.add_argument("--output", default=None, help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("bench_sqlite needs the SQLite backend")
+        if options["readers"] < 0 or options["writers"] < 0 or options["seconds"] <= 0:
+            raise CommandError("--readers/--writers must not be negative and --seconds must be positive")
+
+        runs = [self.run_profile(profile, options) for profile in options["profiles"]]
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "cpu_count": os.cpu_count(),
+            },
+            "readers": options["readers"],
+            "writers": options["writers"],
+            "seconds": options["seconds"],
+            "runs": runs,
+        }
+        text = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(text + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(text)
+
+    def run_profile(self, profile, options):
+        self.stderr.write(f"{profile}: seeding {options['students']} students x {options['donors']} donors...")
+        db_options = connection.settings_dict.setdefault("OPTIONS", {})
+        saved_options = dict(db_options)
+        db_options.pop("transaction_mode", None)
+        if profile == "production":
+            db_options["transaction_mode"] = "IMMEDIATE"
+        pragmas = settings.SQLITE_PRODUCTION_PRAGMAS if profile == "production" else {}
+
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(SQLITE_PRAGMAS=pragmas, DEBUG=False):
+            # A fresh file database per profile: journal_mode=WAL is persistent
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(tmpdir, f"bench_sqlite_{profile}.sqlite3")
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.seed(options["students"], options["donors"])
+                with connection.cursor() as cursor:
+                    journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+                connection.close()
+                result = self.run(options["readers"], options["writers"], options["seconds"])
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                db_options.clear()
+                db_options.update(saved_options)
+        return dict(profile=profile, journal_mode=journal_mode, **result)
+
+    def seed(self, n_students, n_donors):
+        rng = random.Random(42)
+        Student.objects.bulk_create(
+            (Student(student_number=f"BENCH{i:07d}", first_name="Bench", last_name=str(i), gpa=round(rng.uniform(1, 4), 2),
+                     need_score=rng.randint(0, 10), course=rng.choice(["ICT", "Engineering", "Commerce"]),
+                     registration_paid=rng.random() < 0.5)
+             for i in range(n_students)),
+            batch_size=2000,
+        )
+        Donor.objects.bulk_create(
+            Donor(name=f"Bench donor {j}", donor_type="corporate", preferred_course="ICT", min_gpa=2.5,
+                  wallet_balance=Decimal("10000000.00"))
+            for j in range(n_donors)
+        )
+        self.student_ids = list(Student.objects.values_list("id", flat=True))
+        self.donor_ids = list(Donor.objects.values_list("id", flat=True))
+
+    def read(self, rng):
+        """What a donor dashboard and the registration alerts page ask for."""
+        donor_id = rng.choice(self.donor_ids)
+        Donor.objects.get(id=donor_id)
+        list(Transaction.objects.filter(donor_id=donor_id).order_by("-created_at")[:20])
+        Transaction.objects.filter(donor_id=donor_id).aggregate(total=Sum("amount"))
+        list(Student.objects.filter(registration_paid=False).order_by("updated_at", "id")[:50])
+        Student.objects.aggregate(unpaid=Count("id", filter=Q(registration_paid=False)))
+
+    def write(self, rng):
+        donor = Donor.objects.get(id=rng.choice(self.donor_ids))
+        student = Student.objects.get(id=rng.choice(self.student_ids))
+        wallet.fund_student(donor, student, 1, "bench")
+
+    def run(self, n_readers, n_writers, seconds):
+        lock = threading.Lock()
+        counts = {"reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0}
+        start = threading.Barrier(n_readers + n_writers + 1)
+        deadline = []
+
+        def worker(kind, seed):
+            rng = random.Random(seed)
+            action = self.read if kind == "reads" else self.write
+            done = errors = 0
+            start.wait()
+            try:
+                while time.perf_counter() < deadline[0]:
+                    try:
+                        action(rng)
+                        done += 1
+                    except OperationalError:
+                        errors += 1
+            finally:
+                connection.close()
+            with lock:
+                counts[kind] += done
+                counts[kind[:-1] + "_errors"] += errors
+
+        threads = [threading.Thread(target=worker, args=("reads", i)) for i in range(n_readers)]
+        threads += [threading.Thread(target=worker, args=("writes", 1000 + i)) for i in range(n_writers)]
+        for thread in threads:
+            thread.start()
+        deadline.append(time.perf_counter() + seconds)
+        start.wait()
+        for thread in threads:
+            thread.join()
+        return {
+            **counts,
+            "reads_per_sec": round(counts["reads"] / seconds, 1),
+            "writes_per_sec": round(counts["writes"] / seconds, 1),
+        }
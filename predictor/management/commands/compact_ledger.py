@@ -0,0 +1,32 @@
+# predictor/management/commands/compact_ledger.py
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from predictor import ledger
+
+
+class Command(BaseCommand):
+    help = "Roll new wallet ledger entries into snapshots, so balance reads stay O(1). Runs until stopped unless --once."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=300.0, help="Seconds between compactions.")
+        parser.add_argument("--grace", type=int, default=ledger.COMPACTION_GRACE_SECONDS,
+                            help="Only compact entries at least this many seconds old.")
+        parser.add_argument("--once", action="store_true", help="Compact once and exit.")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        while not self.stopping:
+            written = ledger.compact(grace_seconds=options["grace"])
+            self.stdout.write(f"Wrote {written} wallet snapshots")
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+
+    def _stop(self, signum, frame):
+        self.stopping = True
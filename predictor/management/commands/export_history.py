@@ -0,0 +1,37 @@
+# predictor/management/commands/export_history.py
+from django.core.management.base import BaseCommand, CommandError
+
+from predictor import exports
+
+
+class Command(BaseCommand):
+    help = "Stream Transaction or UniversityPayment history as CSV or NDJSON (constant memory)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(exports.EXPORTS), help="What to export.")
+        parser.add_argument("--format", choices=exports.FORMATS, default="csv")
+        parser.add_argument("--start", help="First day to include (YYYY-MM-DD).")
+        parser.add_argument("--end", help="Last day to include (YYYY-MM-DD).")
+        parser.add_argument("--donor", type=int, help="Only this donor id.")
+        parser.add_argument("--student", type=int, help="Only this student id.")
+        parser.add_argument("--output", help="Write to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            columns, rows = exports.export_rows(
+                options["kind"], start=options["start"], end=options["end"],
+                donor=options["donor"], student=options["student"],
+            )
+        except exports.ExportError as e:
+            raise CommandError(str(e))
+        chunks = exports.iter_export(options["format"], columns, rows)
+        if options["output"]:
+            lines = 0
+            with open(options["output"], "w", newline="") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    lines += 1
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']} ({lines} lines)"))
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
@@ -0,0 +1,41 @@
+# predictor/management/commands/recompute_csr.py
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Floor
+
+from predictor import leaderboard
+from predictor.models import Donor, Transaction
+
+
+def _per_donor(expression, output_field):
+    totals = (
+        Transaction.objects.filter(donor=OuterRef("pk"))
+        .order_by()
+        .values("donor")
+        .annotate(total=Sum(expression, output_field=output_field))
+        .values("total")
+    )
+    return Subquery(totals, output_field=output_field)
+
+
+class Command(BaseCommand):
+    help = "Rebuild every donor's total_donated and csr_score from their Transactions (a single UPDATE)."
+
+    def handle(self, *args, **options):
+        # Points are awarded per donation (see Donor.csr_points), so floor each amount before summing.
+        updated = Donor.objects.update(
+            total_donated=Coalesce(
+                _per_donor(F("amount"), DecimalField(max_digits=14, decimal_places=2)),
+                Value(Decimal("0.00")),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            csr_score=Coalesce(
+                _per_donor(Floor(F("amount") / Value(Decimal("100"))), IntegerField()),
+                Value(0),
+                output_field=IntegerField(),
+            ),
+        )
+        leaderboard.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Recomputed CSR totals for {updated} donors."))
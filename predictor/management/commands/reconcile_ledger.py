@@ -0,0 +1,23 @@
+# predictor/management/commands/reconcile_ledger.py
+from django.core.management.base import BaseCommand, CommandError
+
+from predictor import ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare every wallet_balance with its ledger balance (latest snapshot plus later entries) "
+        "and report the wallets that drifted. Cheaper than audit_ledger; schedule it next to compact_ledger."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=ledger.CHUNK_SIZE, help="Wallets checked per transaction.")
+
+    def handle(self, *args, **options):
+        problems = 0
+        for problem in ledger.reconcile(chunk_size=options["chunk_size"]):
+            problems += 1
+            self.stdout.write(f"{problem['wallet']} {problem['id']}: wallet_balance is {problem['recorded']}, ledger says {problem['ledger']}")
+        if problems:
+            raise CommandError(f"{problems} wallet(s) disagree with the ledger.")
+        self.stdout.write(self.style.SUCCESS("Wallet balances match the ledger."))
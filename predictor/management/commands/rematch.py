@@ -0,0 +1,24 @@
+# predictor/management/commands/rematch.py
+from django.core.management.base import BaseCommand
+
+from predictor.matcher import DEFAULT_BATCH_SIZE, Matcher, ModelMatcher
+
+
+class Command(BaseCommand):
+    help = "Rematch every student against every donor (streamed, checkpointed, optionally multi-process)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threshold", type=float, default=0.5, help="Minimum score to store a match.")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Students per block.")
+        parser.add_argument("--workers", type=int, default=1, help="Scoring processes (the command itself does all writes).")
+        parser.add_argument("--ml", action="store_true", help="Score with the trained model instead of the heuristic.")
+        parser.add_argument("--model", default=None, help="Model file for --ml (default: predictor/models/matching_model.joblib).")
+        parser.add_argument("--resume", action="store_true", help="Continue the last interrupted run.")
+
+    def handle(self, *args, **options):
+        if options["ml"]:
+            matcher = ModelMatcher(min_threshold=options["threshold"], batch_size=options["batch_size"], model_path=options["model"])
+        else:
+            matcher = Matcher(min_threshold=options["threshold"], batch_size=options["batch_size"])
+        total = matcher.generate_for_all(resume=options["resume"], workers=options["workers"])
+        self.stdout.write(self.style.SUCCESS(f"Rematch finished: {total} matches written."))
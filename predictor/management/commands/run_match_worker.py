@@ -0,0 +1,38 @@
+# predictor/management/commands/run_match_worker.py
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from predictor import match_queue
+
+
+class Command(BaseCommand):
+    help = "Process queued MatchJobs. Safe to run several workers side by side."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50, help="Jobs claimed per iteration.")
+        parser.add_argument("--lease", type=int, default=match_queue.DEFAULT_LEASE_SECONDS,
+                            help="Seconds without progress before a job can be reclaimed by another worker.")
+        parser.add_argument("--max-attempts", type=int, default=match_queue.DEFAULT_MAX_ATTEMPTS)
+        parser.add_argument("--sleep", type=float, default=2.0, help="Idle poll interval in seconds.")
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit.")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        while not self.stopping:
+            jobs = match_queue.claim(limit=options["batch_size"], lease_seconds=options["lease"])
+            if not jobs:
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+                continue
+            done = match_queue.process(jobs, max_attempts=options["max_attempts"], lease_seconds=options["lease"])
+            self.stdout.write(f"Processed {done}/{len(jobs)} match jobs")
+
+    def _stop(self, signum, frame):
+        # Finish the current batch, then exit.
+        self.stopping = True
@@ -0,0 +1,145 @@
+# predictor/match_queue.py
+import functools
+import logging
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from predictor import metrics
+from predictor.db import retry_on_lock
+from predictor.models import MatchJob
+from predictor.matcher import Matcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 10
+
+
+@retry_on_lock
+def enqueue(student_ids=(), donor_ids=()):
+    """
+    Queue rematch jobs. A student/donor that already has a pending job is skipped
+    (the partial unique constraints turn the duplicate insert into a no-op).
+    """
+    jobs = [MatchJob(student_id=sid) for sid in student_ids]
+    jobs += [MatchJob(donor_id=did) for did in donor_ids]
+    if jobs:
+        MatchJob.objects.bulk_create(jobs, ignore_conflicts=True)
+        metrics.match_jobs.inc(len(jobs), outcome="enqueued")
+
+
+def has_pending_jobs(student=None, donor=None):
+    """True while a rematch for this student/donor is waiting or running."""
+    jobs = MatchJob.objects.filter(status__in=('pending', 'running'))
+    if student is not None:
+        jobs = jobs.filter(student=student)
+    if donor is not None:
+        jobs = jobs.filter(donor=donor)
+    return jobs.exists()
+
+
+def _claimable(now):
+    # Pending jobs that are due, plus running jobs whose lease ran out: process() renews it
+    # after every block it writes, so the worker died or stalled.
+    return Q(status='pending', run_after__lte=now) | Q(status='running', lease_expires_at__lt=now)
+
+
+@retry_on_lock
+def claim(limit=50, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Lease up to `limit` due jobs for this worker.
+    Claiming is a single conditional UPDATE, so concurrent workers never get the same job.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    candidate_ids = list(
+        MatchJob.objects.filter(_claimable(now)).order_by('run_after', 'id').values_list('id', flat=True)[:limit]
+    )
+    if not candidate_ids:
+        return []
+    MatchJob.objects.filter(_claimable(now), id__in=candidate_ids).update(
+        status='running',
+        locked_by=token,
+        lease_expires_at=now + timedelta(seconds=lease_seconds),
+        attempts=F('attempts') + 1,
+    )
+    return list(MatchJob.objects.filter(status='running', locked_by=token))
+
+
+@retry_on_lock
+def renew(jobs, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Extend the lease of jobs this worker still holds to `lease_seconds` from now."""
+    MatchJob.objects.filter(
+        id__in=[job.id for job in jobs], status='running', locked_by__in={job.locked_by for job in jobs}
+    ).update(lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds))
+
+
+@retry_on_lock
+def complete(jobs):
+    """Finished jobs are deleted; the Match table is the durable result."""
+    MatchJob.objects.filter(id__in=[job.id for job in jobs], locked_by__in={job.locked_by for job in jobs}).delete()
+    metrics.match_jobs.inc(len(jobs), outcome="completed")
+
+
+@retry_on_lock
+def fail(job, error, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Put a failed job back in the queue with exponential backoff, or park it as
+    'failed' once it has used up max_attempts.
+    """
+    if job.attempts >= max_attempts:
+        MatchJob.objects.filter(id=job.id).update(status='failed', last_error=str(error), lease_expires_at=None)
+        metrics.match_jobs.inc(outcome="failed")
+        return
+    metrics.match_jobs.inc(outcome="retried")
+    run_after = timezone.now() + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+    try:
+        with transaction.atomic():
+            MatchJob.objects.filter(id=job.id).update(
+                status='pending', run_after=run_after, locked_by='', lease_expires_at=None, last_error=str(error)
+            )
+    except IntegrityError:
+        # A newer pending job for the same student/donor already covers this one.
+        MatchJob.objects.filter(id=job.id).delete()
+
+
+def process(jobs, matcher=None, max_attempts=DEFAULT_MAX_ATTEMPTS, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Run claimed jobs. All donors and all students of the batch are rematched in one
+    pass each; if a pass fails, its jobs are retried one by one so a single bad
+    record does not hold back the rest. The batch's leases are renewed after every
+    block of students, so a long rematch is not reclaimed while it is making progress.
+    Returns the number of jobs completed.
+    """
+    matcher = matcher or Matcher(min_threshold=0.5)
+    on_block = functools.partial(renew, jobs, lease_seconds)
+    groups = [
+        ([job for job in jobs if job.donor_id], matcher.generate_for_donors, 'donor_id'),
+        ([job for job in jobs if job.student_id], matcher.generate_for_students, 'student_id'),
+    ]
+    completed = 0
+    for group, run, attr in groups:
+        if not group:
+            continue
+        try:
+            run({getattr(job, attr) for job in group}, on_block=on_block)
+            complete(group)
+            completed += len(group)
+            continue
+        except Exception:
+            logger.exception("Batch rematch failed, retrying %d jobs individually", len(group))
+        for job in group:
+            try:
+                run({getattr(job, attr)}, on_block=on_block)
+            except Exception as e:
+                logger.exception("Match job %s failed", job.id)
+                fail(job, e, max_attempts=max_attempts)
+            else:
+                complete([job])
+                completed += 1
+    return completed
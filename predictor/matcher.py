@@ -1,16 +1,117 @@
 # predictor/matcher.py
-from predictor.models import Student, Donor, Match
+import heapq
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from predictor import metrics
+from predictor.db import retry_on_lock
+from predictor.models import Student, Donor, Match, MatchRun
+from predictor.courses import accepted_course_ids, course_matches
+
+# Scoring happens on blocks of (batch_size x all donors) pairs so memory stays bounded.
+DEFAULT_BATCH_SIZE = 2000
+
+# Rounding to 3 decimals can lift a raw score by at most 0.0005, so anything below
+# threshold - ROUNDING_SLACK can never survive the exact (rounded) threshold test.
+ROUNDING_SLACK = 0.0006
+
+# Student columns read by the engine; plain tuples, never model instances.
+STUDENT_COLUMNS = ("id", "gpa", "need_score", "course_ref_id")
+
+
+class StudentArrays:
+    """
+    Column-wise student features for the matrix engine.
+    rows: iterable of (id, gpa, need_score, course_ref_id) tuples, e.g. from values_list().
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.gpa = np.array([r[1] or 0 for r in rows], dtype=np.float64)
+        self.need_score = np.array([r[2] or 0 for r in rows], dtype=np.float64)
+        self.course_ids = np.array([r[3] or 0 for r in rows], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        return cls(queryset.values_list(*STUDENT_COLUMNS))
+
+
+def iter_student_rows(queryset, columns, batch_size, after_id=0):
+    """
+    Keyset-paginate `queryset` by id, yielding lists of at most batch_size `columns`
+    tuples (id first) for students with id > after_id. Each page is an index range
+    scan, however deep.
+    """
+    last_id = after_id
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by("id").values_list(*columns)[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+class DonorArrays:
+    """
+    Column-wise donor features for the matrix engine.
+    rows: iterable of (id, min_gpa) tuples.
+    accepted: {donor_id: set of accepted student course ids}; donors not in it accept any course.
+    The course preferences become a boolean (donor x course id) table, with column 0
+    standing for students without a (known) course.
+    """
+
+    def __init__(self, rows, accepted):
+        rows = list(rows)
+        self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.min_gpa = np.array([r[1] or 0 for r in rows], dtype=np.float64)
+
+        width = max((max(ids) for ids in accepted.values() if ids), default=0) + 1
+        self.accepts = np.zeros((len(rows), width), dtype=bool)
+        for j, donor_id in enumerate(self.ids.tolist()):
+            course_ids = accepted.get(donor_id)
+            if course_ids is None:
+                self.accepts[j, :] = True
+            elif course_ids:
+                self.accepts[j, list(course_ids)] = True
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        return cls(queryset.values_list("id", "min_gpa"), accepted_course_ids(queryset.values("id")))
+
+    def course_match_matrix(self, course_ids):
+        """Boolean (n_students x n_donors) matrix of the course rule used by Matcher.score."""
+        width = self.accepts.shape[1]
+        columns = np.where(course_ids < width, course_ids, 0)
+        return self.accepts[:, columns].T
+
 
 class Matcher:
     """
     Matcher class to score student–donor compatibility and store matches.
     """
+    name = "heuristic"  # metrics label
 
-    def __init__(self, min_threshold=0.5):
+    def __init__(self, min_threshold=0.5, batch_size=DEFAULT_BATCH_SIZE):
         """
         min_threshold: Minimum score required to save a match (0-1).
+        batch_size: Number of students scored per matrix block in generate_for_all.
         """
         self.min_threshold = min_threshold
+        self.batch_size = batch_size
 
     def score(self, student_features, donor_features):
         """
@@ -29,10 +130,8 @@ class Matcher:
             score += gpa_score
             explanation["gpa_match"] = round(gpa_score, 3)
 
-        # Course match
-        preferred_course = (donor_features.get("preferred_course") or "Any").lower()
-        student_course = (student_features.get("course") or "").lower()
-        if preferred_course == "any" or preferred_course in student_course:
+        # Course match (preferred_course may list several comma-separated courses)
+        if course_matches(donor_features.get("preferred_course"), student_features.get("course")):
             score += 0.4
             explanation["course_match"] = 0.4
 
@@ -45,41 +144,339 @@ class Matcher:
         final_score = round(min(score, 1.0), 3)
         return final_score, explanation
 
-    def generate_for_all(self):
+    def warm(self):
+        """Load whatever scoring needs, so a missing model fails before any output."""
+
+    def score_pairs(self, pairs):
         """
-        Generate matches for all students and donors, store them in DB.
+        Score a list of (student_features, donor_features) pairs; returns
+        [(score, explanation)] in input order.
         """
-        Match.objects.all().delete()  # optional: clear old matches
-        total_matches = 0
+        return [self.score(student, donor) for student, donor in pairs]
+
+    def iter_matches(self, students, donors):
+        """
+        Vectorised counterpart of `score` over the students x donors cross product.
+        students: StudentArrays, donors: DonorArrays.
+        Yields (student_id, donor_id, score, explanation) for every pair that passes
+        min_threshold, with exactly the values `score` would return for that pair.
+        """
+        if not len(students) or not len(donors):
+            return
+
+        # Per-student components (same float operations, in the same order, as `score`)
+        gpa_score = 0.4 * np.minimum(students.gpa / 4.0, 1.0)
+        need_contrib = 0.2 * (np.minimum(students.need_score, 100) / 100)
 
-        students = Student.objects.all()
-        donors = Donor.objects.all()
-
-        for student in students:
-            student_features = {
-                "gpa": student.gpa,
-                "need_score": student.need_score,
-                "course": student.course,
-            }
-
-            for donor in donors:
-                donor_features = {
-                    "min_gpa": donor.min_gpa,
-                    "preferred_course": donor.preferred_course,
-                    "donor_type": donor.donor_type,
-                    "max_amount": donor.max_amount,
-                }
-                s, explanation = self.score(student_features, donor_features)
-                if s >= self.min_threshold:
-                    Match.objects.update_or_create(
-                        student=student,
-                        donor=donor,
-                        defaults={"score": s, "top_features": explanation}
-                    )
-                    total_matches += 1
+        # Per-pair components
+        gpa_ok = students.gpa[:, None] >= donors.min_gpa[None, :]
+        course_ok = donors.course_match_matrix(students.course_ids)
 
+        raw = np.where(gpa_ok, gpa_score[:, None], 0.0)
+        raw = raw + np.where(course_ok, 0.4, 0.0)
+        raw = raw + need_contrib[:, None]
+
+        # Cheap vectorised pre-filter; the exact rounded test is applied per survivor.
+        rows, cols = np.nonzero(raw >= self.min_threshold - ROUNDING_SLACK)
+        if not len(rows):
+            return
+
+        gpa_rounded = [round(float(v), 3) for v in gpa_score]
+        need_rounded = [round(float(v), 3) for v in need_contrib]
+        student_ids = students.ids.tolist()
+        donor_ids = donors.ids.tolist()
+        pair_raw = raw[rows, cols].tolist()
+        pair_gpa_ok = gpa_ok[rows, cols].tolist()
+        pair_course_ok = course_ok[rows, cols].tolist()
+
+        for k, (i, j) in enumerate(zip(rows.tolist(), cols.tolist())):
+            final_score = round(min(pair_raw[k], 1.0), 3)
+            if final_score < self.min_threshold:
+                continue
+            explanation = {}
+            if pair_gpa_ok[k]:
+                explanation["gpa_match"] = gpa_rounded[i]
+            if pair_course_ok[k]:
+                explanation["course_match"] = 0.4
+            explanation["need_score"] = need_rounded[i]
+            yield student_ids[i], donor_ids[j], final_score, explanation
+
+    def rank_donors(self, student, limit=10):
+        """
+        Score one student against every donor and return the `limit` best
+        (student_id, donor_id, score, explanation) rows, whatever min_threshold is.
+        """
+        students = StudentArrays([(student.id, student.gpa, student.need_score, student.course_ref_id)])
+        donors = DonorArrays.from_queryset(Donor.objects.all())
+        everything = Matcher(min_threshold=float("-inf"), batch_size=self.batch_size)
+        return heapq.nlargest(limit, everything.iter_matches(students, donors), key=lambda row: row[2])
+
+    # ---------- Block pipeline (shared with ModelMatcher) ----------
+    student_columns = STUDENT_COLUMNS
+
+    def load_donors(self, donor_qs):
+        """Donor features in the form match_rows expects; loaded once per run."""
+        return DonorArrays.from_queryset(donor_qs)
+
+    def donor_count(self, donors):
+        return len(donors)
+
+    def match_rows(self, rows, donors):
+        """Score one block of student_columns rows against `donors`; returns match rows."""
+        return list(self.iter_matches(StudentArrays(rows), donors))
+
+    def generate_for_all(self, resume=False, workers=1):
+        """
+        Rematch every student against every donor.
+        Students are streamed in keyset-paginated blocks of batch_size and each block's
+        matches are replaced in its own transaction, so memory stays flat and readers
+        keep seeing the previous matches until their block is rewritten. Progress is
+        checkpointed in a MatchRun; resume=True continues the last unfinished run.
+        workers > 1 scores blocks in a process pool; this process stays the only writer.
+        Returns the number of matches written by the run.
+        """
+        run = None
+        if resume:
+            run = MatchRun.objects.filter(status="running", min_threshold=self.min_threshold).order_by("-id").first()
+        if run is None:
+            run = MatchRun.objects.create(min_threshold=self.min_threshold)
+
+        donors = self.load_donors(Donor.objects.all())
+        blocks = iter_student_rows(Student.objects.all(), self.student_columns, self.batch_size, after_id=run.last_student_id)
+        @retry_on_lock
+        def checkpoint(rows, matches):
+            with transaction.atomic():
+                written = self.save_block([row[0] for row in rows], matches)
+                MatchRun.objects.filter(id=run.id).update(
+                    last_student_id=rows[-1][0],
+                    students_done=F("students_done") + len(rows),
+                    matches_written=F("matches_written") + written,
+                )
+
+        for rows, matches in self.score_blocks(blocks, donors, workers):
+            metrics.pairs_scored.inc(len(rows) * self.donor_count(donors), matcher=self.name)
+            checkpoint(rows, matches)
+
+        MatchRun.objects.filter(id=run.id).update(status="finished", finished_at=timezone.now())
+        run.refresh_from_db()
+        return run.matches_written
+
+    def generate_for_students(self, student_ids, on_block=None):
+        """
+        (Re)score the given students against every donor and upsert the matches.
+        on_block, if given, is called after each block is written.
+        """
+        return self._generate(Student.objects.filter(id__in=student_ids), Donor.objects.all(), on_block=on_block)
+
+    def generate_for_donors(self, donor_ids, on_block=None):
+        """
+        (Re)score every student against the given donors and upsert the matches.
+        on_block, if given, is called after each block is written.
+        """
+        donor_ids = list(donor_ids)
+        return self._generate(Student.objects.all(), Donor.objects.filter(id__in=donor_ids), donor_ids, on_block)
+
+    def _generate(self, student_qs, donor_qs, donor_ids=None, on_block=None):
+        donors = self.load_donors(donor_qs)
+        if donor_ids is not None and not self.donor_count(donors):
+            return 0
+
+        total_matches = 0
+        for rows in iter_student_rows(student_qs, self.student_columns, self.batch_size):
+            matches = self.match_rows(rows, donors)
+            metrics.pairs_scored.inc(len(rows) * self.donor_count(donors), matcher=self.name)
+            total_matches += self._write_block([row[0] for row in rows], matches, donor_ids)
+            if on_block is not None:
+                on_block()
         return total_matches
 
+    @retry_on_lock
+    def _write_block(self, student_ids, matches, donor_ids=None):
+        with transaction.atomic():
+            return self.save_block(student_ids, matches, donor_ids)
+
+    def score_blocks(self, blocks, donors, workers=1):
+        """
+        Yield (rows, matches) for each block, in order.
+        With workers > 1 the blocks are scored by a forked process pool: each worker
+        receives the donor features once (inherited at fork) and only student rows and
+        match rows cross process boundaries. At most 2 blocks per worker are in flight.
+        """
+        if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            for rows in blocks:
+                yield rows, self.match_rows(rows, donors)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_pool_worker,
+            initargs=(self, donors),
+        ) as pool:
+            in_flight = deque()
+            for rows in blocks:
+                in_flight.append((rows, pool.submit(_pool_match_rows, rows)))
+                if len(in_flight) >= workers * 2:
+                    rows, future = in_flight.popleft()
+                    yield rows, future.result()
+            while in_flight:
+                rows, future = in_flight.popleft()
+                yield rows, future.result()
+
+    def save_block(self, student_ids, matches, donor_ids=None):
+        """
+        Make the stored matches of one block reflect its new scores: upsert pairs that
+        pass min_threshold and delete unfunded pairs that no longer do. donor_ids limits
+        the pruning to those donors (None: the block was scored against every donor).
+        Returns the number of matches written.
+        """
+        written = save_matches(matches)
+        prune_matches(student_ids, {(m[0], m[1]) for m in matches}, donor_ids)
+        metrics.matches_written.inc(written, matcher=self.name)
+        return written
+
+
+class ModelMatcher(Matcher):
+    """
+    Matcher that scores pairs with the trained model (predictor.ml.model_utils)
+    instead of the heuristic rule; same pipeline, thresholds and storage.
+    """
+    name = "ml"
+    student_columns = ("id", "gpa", "need_score", "course")
+
+    def __init__(self, min_threshold=0.5, batch_size=DEFAULT_BATCH_SIZE, model_path=None):
+        super().__init__(min_threshold=min_threshold, batch_size=batch_size)
+        self.model_path = model_path
+
+    def _model(self):
+        # Imported lazily: pandas/sklearn are only needed when ML scoring is used.
+        from predictor.ml.model_utils import MODEL_PATH, Matcher as MLMatcher
+        return MLMatcher(self.model_path or MODEL_PATH)
+
+    def warm(self):
+        self._model()
+
+    def score_pairs(self, pairs):
+        if not pairs:
+            return []
+        model = self._model()
+        scores = model.score_pairs([
+            (student, dict(donor, preferred_course=donor.get("preferred_course") or "Any")) for student, donor in pairs
+        ])
+        return [(round(float(score), 3), {"model_version": model.version}) for score in scores]
+
+    def load_donors(self, donor_qs):
+        rows = list(donor_qs.values_list("id", "donor_type", "preferred_course", "min_gpa", "max_amount"))
+        features = [
+            {"donor_type": r[1], "preferred_course": r[2] or "Any", "min_gpa": r[3], "max_amount": r[4]}
+            for r in rows
+        ]
+        return [r[0] for r in rows], features
+
+    def donor_count(self, donors):
+        return len(donors[0])
+
+    def match_rows(self, rows, donors):
+        donor_ids, donor_features = donors
+        if not rows or not donor_ids:
+            return []
+        model = self._model()
+        students = [{"gpa": r[1], "need_score": r[2], "course": r[3]} for r in rows]
+        scores = model.score_many(students, donor_features)
+        explanation = {"model_version": model.version}
+        matches = []
+        for i, j in zip(*np.nonzero(scores >= self.min_threshold - ROUNDING_SLACK)):
+            final_score = round(float(scores[i, j]), 3)
+            if final_score >= self.min_threshold:
+                matches.append((rows[i][0], donor_ids[j], final_score, dict(explanation)))
+        return matches
+
+
+# Matchers selectable by name (e.g. by the match-score API).
+MATCHERS = {"heuristic": Matcher, "ml": ModelMatcher}
+
+# Model fields behind student_features / donor_features.
+STUDENT_FEATURE_FIELDS = ("gpa", "course", "need_score")
+DONOR_FEATURE_FIELDS = ("donor_type", "preferred_course", "min_gpa", "max_amount")
+
+
+def student_features(student):
+    return {name: getattr(student, name) for name in STUDENT_FEATURE_FIELDS}
+
+
+def donor_features(donor):
+    return {name: getattr(donor, name) for name in DONOR_FEATURE_FIELDS}
+
+
+# Per-process state of pool workers (set once by the initializer).
+_pool_state = {}
+
+
+def _init_pool_worker(matcher, donors):
+    _pool_state["matcher"] = matcher
+    _pool_state["donors"] = donors
+
+
+def _pool_match_rows(rows):
+    return _pool_state["matcher"].match_rows(rows, _pool_state["donors"])
+
+
+def save_matches(rows, batch_size=500):
+    """
+    Bulk upsert (student_id, donor_id, score, explanation) rows into Match.
+    Existing pairs get their score/top_features refreshed; `funded` is left untouched.
+    Returns the number of rows written.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    if connection.vendor not in ("sqlite", "postgresql"):
+        Match.objects.bulk_create(
+            [Match(student_id=s_id, donor_id=d_id, score=s, top_features=explanation) for s_id, d_id, s, explanation in rows],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["student", "donor"],
+            update_fields=["score", "top_features"],
+        )
+        return len(rows)
+
+    # Building a Match instance per row costs more than scoring it, so on backends with
+    # INSERT ... ON CONFLICT the rows go straight to executemany.
+    qn = connection.ops.quote_name
+    column = {name: qn(Match._meta.get_field(name).column) for name in ("student", "donor", "score", "top_features", "matched_at", "funded")}
+    sql = (
+        f"INSERT INTO {qn(Match._meta.db_table)} "
+        f"({column['student']}, {column['donor']}, {column['score']}, {column['top_features']}, {column['matched_at']}, {column['funded']}) "
+        f"VALUES (%s, %s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({column['student']}, {column['donor']}) DO UPDATE SET "
+        f"{column['score']} = excluded.{column['score']}, {column['top_features']} = excluded.{column['top_features']}"
+    )
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, [
+                (s_id, d_id, s, json.dumps(explanation), now, False)
+                for s_id, d_id, s, explanation in rows[start:start + batch_size]
+            ])
+    return len(rows)
+
+
+def prune_matches(student_ids, keep, donor_ids=None, batch_size=500):
+    """
+    Delete unfunded matches of `student_ids` (optionally only with `donor_ids`) whose
+    (student_id, donor_id) pair is not in `keep`. Funded matches are history and stay.
+    """
+    existing = Match.objects.filter(student_id__in=student_ids, funded=False)
+    if donor_ids is not None:
+        existing = existing.filter(donor_id__in=donor_ids)
+    stale = [
+        match_id for match_id, student_id, donor_id in existing.values_list("id", "student_id", "donor_id")
+        if (student_id, donor_id) not in keep
+    ]
+    for start in range(0, len(stale), batch_size):
+        Match.objects.filter(id__in=stale[start:start + batch_size]).delete()
+
 
 # Convenience function if you just want scoring without instantiating Matcher
 def score(student_features, donor_features):
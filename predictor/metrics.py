@@ -0,0 +1,189 @@
+# predictor/metrics.py
+# In-process counters and histograms, rendered in the Prometheus text format at /metrics.
+# Request metrics come from predictor.middleware.MetricsMiddleware (sampled); matching
+# counters are bumped by predictor.matcher and predictor.match_queue. Every process keeps
+# its own values, so scrape each worker (or run one) to see all of them.
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter as ShapeCounter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+N_PLUS_ONE_THRESHOLD = 10
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self._key(labels)) or ((), 0)
+        return sum(counts)
+
+    def total(self, **labels):
+        return (self._values.get(self._key(labels)) or ((), 0))[1]
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', _number(bound))])} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+# ---------- Requests ----------
+request_duration = Histogram(
+    "fundforward_request_duration_seconds", "Time to build the response, per view (sampled requests).", ("view", "method"),
+)
+request_queries = Histogram(
+    "fundforward_request_queries", "Database queries per request, per view (sampled requests).", ("view",), QUERY_COUNT_BUCKETS,
+)
+request_query_duration = Histogram(
+    "fundforward_request_query_duration_seconds", "Time spent in database queries per request, per view (sampled requests).", ("view",),
+)
+n_plus_one = Counter(
+    "fundforward_n_plus_one_total", "Sampled requests that ran one SQL shape at least the N+1 threshold times.", ("view",),
+)
+
+# ---------- Matching ----------
+match_jobs = Counter("fundforward_match_jobs_total", "Match jobs by outcome (enqueued, completed, retried, failed).", ("outcome",))
+pairs_scored = Counter("fundforward_match_pairs_scored_total", "Student x donor pairs scored, per matcher.", ("matcher",))
+matches_written = Counter("fundforward_matches_written_total", "Match rows upserted, per matcher.", ("matcher",))
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# ---------- Per-request query recording ----------
+# Set for the duration of a sampled request; asgiref carries it into sync_to_async threads,
+# so the async views' ORM queries are counted too.
+_current = contextvars.ContextVar("fundforward_request_stats", default=None)
+
+_IN_LIST = re.compile(r"\((?:%s, )+%s\)")
+
+
+def sql_shape(sql):
+    """The query with IN (%s, %s, ...) lists collapsed, so batches of any size share a shape."""
+    return _IN_LIST.sub("(%s, ...)", sql)
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.shapes = ShapeCounter()
+
+
+def begin_request():
+    """Start recording queries for this request; returns (stats, token for end_request)."""
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(stats, token, view, method):
+    _current.reset(token)
+    request_duration.observe(time.perf_counter() - stats.started, view=view, method=method)
+    request_queries.observe(stats.queries, view=view)
+    request_query_duration.observe(stats.query_seconds, view=view)
+    if stats.shapes:
+        shape, repeats = stats.shapes.most_common(1)[0]
+        if repeats >= getattr(settings, "METRICS_N_PLUS_ONE_THRESHOLD", N_PLUS_ONE_THRESHOLD):
+            n_plus_one.inc(view=view)
+            logger.warning("Possible N+1 in %s: one query ran %d times: %s", view, repeats, shape[:300])
+
+
+def record_query(execute, sql, params, many, context):
+    """Connection execute wrapper (see predictor.signals); a no-op outside sampled requests."""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started
+        stats.shapes[sql_shape(sql)] += 1
@@ -0,0 +1,54 @@
+# predictor/middleware.py
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match else "unresolved"
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count and query time per view for a METRICS_SAMPLE_RATE
+    fraction of requests (0 turns it off: one settings lookup per request), and counts
+    requests that repeat one SQL shape METRICS_N_PLUS_ONE_THRESHOLD times or more.
+    Works for sync and async views; see predictor.metrics.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        rate = getattr(settings, "METRICS_SAMPLE_RATE", 0.0)
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        stats, token = metrics.begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(stats, token, _view_name(request), request.method)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        stats, token = metrics.begin_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(stats, token, _view_name(request), request.method)
+        return response
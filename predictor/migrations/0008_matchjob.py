@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0007_alter_transaction_bursary_request_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=64)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('donor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='match_jobs', to='predictor.donor')),
+                ('student', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='match_jobs', to='predictor.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='matchjob_status_run_after')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('student',), name='unique_pending_student_match_job'), models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('donor',), name='unique_pending_donor_match_job')],
+            },
+        ),
+    ]
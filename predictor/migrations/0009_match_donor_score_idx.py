@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0008_matchjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['donor', '-score'], name='match_donor_score_idx'),
+        ),
+    ]
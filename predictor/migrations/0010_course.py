@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def normalize(name):
+    # Same rule as predictor.courses.normalize_course (frozen here for the migration).
+    return " ".join((name or "").lower().split())
+
+
+def backfill_courses(apps, schema_editor):
+    Course = apps.get_model('predictor', 'Course')
+    Student = apps.get_model('predictor', 'Student')
+    Donor = apps.get_model('predictor', 'Donor')
+
+    student_courses = {s.id: normalize(s.course) for s in Student.objects.only('id', 'course')}
+    donor_preferences = {}
+    for donor in Donor.objects.only('id', 'preferred_course'):
+        names = [normalize(part) for part in (donor.preferred_course or "").split(",")]
+        names = [n for n in names if n]
+        if names and "any" not in names:
+            donor_preferences[donor.id] = set(names)
+
+    names = {n for n in student_courses.values() if n}.union(*donor_preferences.values())
+    ids = {name: Course.objects.create(name=name).id for name in sorted(names)}
+
+    Link = Course.covers.through
+    Link.objects.bulk_create([
+        Link(from_course_id=ids[a], to_course_id=ids[b]) for a in ids for b in ids if a in b
+    ])
+    for student_id, name in student_courses.items():
+        if name:
+            Student.objects.filter(id=student_id).update(course_ref_id=ids[name])
+    Preference = Donor.preferred_courses.through
+    Preference.objects.bulk_create([
+        Preference(donor_id=donor_id, course_id=ids[name])
+        for donor_id, names in donor_preferences.items() for name in names
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0009_match_donor_score_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='donor',
+            name='preferred_course',
+            field=models.CharField(blank=True, help_text='One or more courses, comma-separated. Leave blank for any course.', max_length=120, null=True),
+        ),
+        migrations.CreateModel(
+            name='Course',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=120, unique=True)),
+                ('covers', models.ManyToManyField(blank=True, related_name='covered_by', to='predictor.course')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='donor',
+            name='preferred_courses',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='preferring_donors', to='predictor.course'),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='course_ref',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='students', to='predictor.course'),
+        ),
+        migrations.RunPython(backfill_courses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0010_course'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('finished', 'Finished')], default='running', max_length=20)),
+                ('min_threshold', models.FloatField()),
+                ('last_student_id', models.BigIntegerField(default=0)),
+                ('students_done', models.PositiveIntegerField(default=0)),
+                ('matches_written', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
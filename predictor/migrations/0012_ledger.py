@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def opening_snapshots(apps, schema_editor):
+    # Existing balances become each wallet's first snapshot (covering no entries).
+    WalletSnapshot = apps.get_model('predictor', 'WalletSnapshot')
+    Donor = apps.get_model('predictor', 'Donor')
+    Student = apps.get_model('predictor', 'Student')
+    snapshots = [
+        WalletSnapshot(donor_id=pk, balance=balance)
+        for pk, balance in Donor.objects.exclude(wallet_balance=0).values_list('id', 'wallet_balance').iterator()
+    ]
+    snapshots += [
+        WalletSnapshot(student_id=pk, balance=balance)
+        for pk, balance in Student.objects.exclude(wallet_balance=0).values_list('id', 'wallet_balance').iterator()
+    ]
+    WalletSnapshot.objects.bulk_create(snapshots, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0011_matchrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'Opening balance'), ('top_up', 'Top-up'), ('withdrawal', 'Withdrawal'), ('debit', 'Debit'), ('credit', 'Credit')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('donor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='predictor.donor')),
+                ('student', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='predictor.student')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='predictor.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['donor', 'id'], name='ledger_donor_id_idx'), models.Index(fields=['student', 'id'], name='ledger_student_id_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('donor__isnull', False), ('student__isnull', True)), models.Q(('donor__isnull', True), ('student__isnull', False)), _connector='OR'), name='ledger_entry_one_wallet')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WalletSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('last_entry_id', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('donor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='wallet_snapshots', to='predictor.donor')),
+                ('student', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='wallet_snapshots', to='predictor.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['donor', '-last_entry_id'], name='snapshot_donor_latest_idx'), models.Index(fields=['student', '-last_entry_id'], name='snapshot_student_latest_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('donor__isnull', False), ('student__isnull', True)), models.Q(('donor__isnull', True), ('student__isnull', False)), _connector='OR'), name='wallet_snapshot_one_wallet')],
+            },
+        ),
+        migrations.RunPython(opening_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:21
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    # Same rows as predictor.rollups.rebuild (frozen here for the migration).
+    UniversityPayment = apps.get_model('predictor', 'UniversityPayment')
+    FundingRollup = apps.get_model('predictor', 'FundingRollup')
+    totals = defaultdict(lambda: [Decimal('0.00'), Decimal('0.00'), 0])
+    payments = UniversityPayment.objects.values_list('timestamp', 'donor_id', 'student_id', 'amount', 'approved')
+    for timestamp, donor_id, student_id, amount, approved in payments.iterator():
+        day = timezone.localdate(timestamp) if timezone.is_aware(timestamp) else timestamp.date()
+        donor_key = donor_id or 0
+        for key in (('all', 0, 0), ('donor', donor_key, 0), ('student', 0, student_id), ('pair', donor_key, student_id)):
+            total = totals[(key[0], day, key[1], key[2])]
+            total[0] += amount
+            total[1] += amount if approved else 0
+            total[2] += 1
+    FundingRollup.objects.bulk_create(
+        (FundingRollup(scope=scope, day=day, donor_key=donor_key, student_key=student_key,
+                       amount=amount, approved_amount=approved, payments=count)
+         for (scope, day, donor_key, student_key), (amount, approved, count) in totals.items()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0012_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FundingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('all', 'All payments'), ('donor', 'Per donor'), ('student', 'Per student'), ('pair', 'Per donor and student')], max_length=10)),
+                ('day', models.DateField()),
+                ('donor_key', models.PositiveBigIntegerField(default=0)),
+                ('student_key', models.PositiveBigIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('approved_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('payments', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', 'donor_key', 'day'], name='funding_rollup_donor_idx'), models.Index(fields=['scope', 'student_key', 'day'], name='funding_rollup_student_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scope', 'day', 'donor_key', 'student_key'), name='funding_rollup_key')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
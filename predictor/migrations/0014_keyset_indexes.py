@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0013_funding_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registrationflag',
+            index=models.Index(fields=['flagged', 'created_at', 'id'], name='regflag_flagged_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['donor', 'created_at', 'id'], name='tx_donor_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['student', 'created_at', 'id'], name='tx_student_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='universitypayment',
+            index=models.Index(fields=['timestamp', 'id'], name='payment_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='universitypayment',
+            index=models.Index(fields=['student', 'timestamp', 'id'], name='payment_student_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='universitypayment',
+            index=models.Index(fields=['donor', 'timestamp', 'id'], name='payment_donor_ts_idx'),
+        ),
+    ]
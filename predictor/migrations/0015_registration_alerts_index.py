@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0014_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(condition=models.Q(('registration_paid', False)), fields=['updated_at', 'id'], name='student_unpaid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['updated_at', 'id'], name='student_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0015_registration_alerts_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='registrationflag',
+            name='regflag_flagged_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='academicrecord',
+            index=models.Index(fields=['student', 'uploaded_at'], name='record_student_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accessrequest',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['student', 'created_at'], name='accessreq_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bursaryrequest',
+            index=models.Index(condition=models.Q(('fulfilled', False)), fields=['student', 'id'], name='bursary_open_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrationflag',
+            index=models.Index(condition=models.Q(('flagged', True)), fields=['created_at', 'id'], name='regflag_open_created_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0016_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='donor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='predictor.donor'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='student',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='predictor.student'),
+        ),
+        migrations.AlterField(
+            model_name='walletsnapshot',
+            name='donor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='wallet_snapshots', to='predictor.donor'),
+        ),
+        migrations.AlterField(
+            model_name='walletsnapshot',
+            name='student',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='wallet_snapshots', to='predictor.student'),
+        ),
+    ]
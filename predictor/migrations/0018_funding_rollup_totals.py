@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:24
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+TOTAL_DAY = datetime.date(1, 1, 1)  # predictor.rollups.TOTAL_DAY, frozen here for the migration
+
+
+def add_totals(apps, schema_editor):
+    # The all-time row of every (scope, donor_key, student_key), summed from its daily rows.
+    FundingRollup = apps.get_model('predictor', 'FundingRollup')
+    totals = (
+        FundingRollup.objects.exclude(day=TOTAL_DAY).order_by()
+        .values('scope', 'donor_key', 'student_key')
+        .annotate(total=Sum('amount'), approved_total=Sum('approved_amount'), count=Sum('payments'))
+    )
+    FundingRollup.objects.bulk_create(
+        (FundingRollup(scope=row['scope'], day=TOTAL_DAY, donor_key=row['donor_key'], student_key=row['student_key'],
+                       amount=row['total'], approved_amount=row['approved_total'], payments=row['count'])
+         for row in totals.iterator()),
+        batch_size=1000,
+    )
+
+
+def remove_totals(apps, schema_editor):
+    apps.get_model('predictor', 'FundingRollup').objects.filter(day=TOTAL_DAY).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictor', '0017_protect_ledger_wallets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fundingrollup',
+            index=models.Index(fields=['scope', 'day', '-amount'], name='funding_rollup_rank_idx'),
+        ),
+        migrations.RunPython(add_totals, remove_totals),
+    ]
@@ -1,16 +1,134 @@
+import hashlib
 import joblib
+import numpy as np
 import pandas as pd
 import os
+import threading
+import time
 
 
 MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', 'models', 'matching_model.joblib')
 
+# Raw features and their defaults, as used by prepare(). Numeric features map to one
+# column each; the others are one-hot encoded as '<feature>_<value>' like pd.get_dummies.
+STUDENT_FEATURES = {'gpa': 0.0, 'need_score': 0.0, 'course': 'Unknown'}
+DONOR_FEATURES = {'donor_type': 'alumni', 'preferred_course': 'Any', 'min_gpa': 0.0, 'max_amount': 0.0}
+NUMERIC_FEATURES = {'gpa', 'need_score', 'min_gpa', 'max_amount'}
 
-class Matcher:
-	def __init__(self):
-		data = joblib.load(MODEL_PATH)
+# Pairs per predict_proba call in score_many/score_pairs.
+DEFAULT_BATCH_SIZE = 50000
+
+# How often (seconds) the registry checks MODEL_PATH for a newer file.
+RELOAD_CHECK_INTERVAL = 5.0
+
+# Read size when hashing the model file for its version.
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class LoadedModel:
+	def __init__(self, data, version, load_seconds):
 		self.model = data['model']
 		self.columns = data['columns']
+		self.column_index = {c: i for i, c in enumerate(self.columns)}
+		self.version = version
+		self.load_seconds = load_seconds
+		self.loaded_at = time.time()
+
+
+class ModelRegistry:
+	"""
+	Process-wide cache of one joblib model file.
+	- Loads lazily on first get() (or eagerly via load()). A tree ensemble is unpickled
+	  into private memory (sklearn copies the node arrays), so workers only share it
+	  when it is loaded before the fork: MATCHING_MODEL_EAGER_LOAD under gunicorn
+	  --preload, after which the pages are shared copy-on-write.
+	- Reloads when the file's mtime/size change; the new model is fully loaded before
+	  it replaces the old one, so callers never see a half-loaded model.
+	"""
+
+	def __init__(self, path, check_interval=RELOAD_CHECK_INTERVAL):
+		self.path = path
+		self.check_interval = check_interval
+		self.loads = 0
+		self._lock = threading.Lock()
+		self._current = None
+		self._stamp = None
+		self._checked_at = 0.0
+
+	def _file_version(self):
+		digest = hashlib.sha256()
+		with open(self.path, 'rb') as f:
+			while chunk := f.read(HASH_CHUNK_SIZE):
+				digest.update(chunk)
+		return digest.hexdigest()[:12]
+
+	def _file_stamp(self):
+		st = os.stat(self.path)
+		return (st.st_mtime_ns, st.st_size)
+
+	def _changed_on_disk(self):
+		now = time.monotonic()
+		if now - self._checked_at < self.check_interval:
+			return False
+		self._checked_at = now
+		try:
+			return self._file_stamp() != self._stamp
+		except OSError:
+			# Keep serving the loaded model while the file is being replaced.
+			return False
+
+	def get(self):
+		current = self._current
+		if current is None or self._changed_on_disk():
+			current = self.load()
+		return current
+
+	def load(self):
+		with self._lock:
+			stamp = self._file_stamp()
+			if self._current is not None and stamp == self._stamp:
+				return self._current
+			started = time.perf_counter()
+			data = joblib.load(self.path)
+			self._current = LoadedModel(data, self._file_version(), time.perf_counter() - started)
+			self._stamp = stamp
+			self._checked_at = time.monotonic()
+			self.loads += 1
+			return self._current
+
+	def stats(self):
+		"""Load time and version of the current model, for monitoring."""
+		current = self._current
+		return {
+			'path': self.path,
+			'loaded': current is not None,
+			'version': current.version if current else None,
+			'loaded_at': current.loaded_at if current else None,
+			'load_seconds': current.load_seconds if current else None,
+			'loads': self.loads,
+		}
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(path=MODEL_PATH):
+	path = os.path.abspath(path)
+	with _registries_lock:
+		if path not in _registries:
+			_registries[path] = ModelRegistry(path)
+		return _registries[path]
+
+
+class Matcher:
+	def __init__(self, path=MODEL_PATH):
+		# Cheap: the model itself is shared through the process-wide registry.
+		loaded = get_registry(path).get()
+		self.model = loaded.model
+		self.columns = loaded.columns
+		self.column_index = loaded.column_index
+		self.version = loaded.version
 
 	def prepare(self, student, donor):
 		row = {
@@ -22,6 +140,9 @@ class Matcher:
 			'min_gpa': donor.get('min_gpa', 0.0),
 			'max_amount': donor.get('max_amount', 0.0),
 		}
+		for name in NUMERIC_FEATURES:
+			# Decimals (e.g. Donor.max_amount) would otherwise be one-hot encoded by get_dummies.
+			row[name] = float(row[name] or 0)
 		df = pd.DataFrame([row])
 		df = pd.get_dummies(df)
 		for c in self.columns:
@@ -30,7 +151,56 @@ class Matcher:
 		df = df[self.columns]
 		return df
 
+	def encode(self, items, features):
+		"""
+		Encode student or donor feature dicts into a (len(items) x len(columns)) matrix.
+		Only the columns belonging to `features` are filled, so a student row plus a
+		donor row is exactly the row prepare() builds for that pair.
+		"""
+		X = np.zeros((len(items), len(self.columns)), dtype=np.float64)
+		for i, item in enumerate(items):
+			for name, default in features.items():
+				value = item.get(name, default)
+				if name in NUMERIC_FEATURES:
+					col = self.column_index.get(name)
+					if col is not None:
+						X[i, col] = float(value or 0)
+				elif value is not None:
+					col = self.column_index.get(f"{name}_{value}")
+					if col is not None:
+						X[i, col] = 1.0
+		return X
+
+	def _predict(self, X):
+		# Keep the training column names so sklearn does not warn about missing feature names.
+		return self.model.predict_proba(pd.DataFrame(X, columns=self.columns))[:, 1]
+
+	def score_many(self, students, donors, batch_size=DEFAULT_BATCH_SIZE):
+		"""
+		Score every student against every donor.
+		Returns a (len(students) x len(donors)) array of match probabilities, computed
+		with one predict_proba call per batch_size pairs.
+		"""
+		S = self.encode(students, STUDENT_FEATURES)
+		D = self.encode(donors, DONOR_FEATURES)
+		n_students, n_donors = len(students), len(donors)
+		scores = np.empty(n_students * n_donors, dtype=np.float64)
+		for start in range(0, len(scores), batch_size):
+			pair = np.arange(start, min(start + batch_size, len(scores)))
+			scores[start:start + len(pair)] = self._predict(S[pair // n_donors] + D[pair % n_donors])
+		return scores.reshape(n_students, n_donors)
+
+	def score_pairs(self, pairs, batch_size=DEFAULT_BATCH_SIZE):
+		"""
+		Score a list of (student, donor) feature-dict pairs; returns an array in input order.
+		"""
+		scores = np.empty(len(pairs), dtype=np.float64)
+		for start in range(0, len(pairs), batch_size):
+			batch = pairs[start:start + batch_size]
+			S = self.encode([student for student, _ in batch], STUDENT_FEATURES)
+			D = self.encode([donor for _, donor in batch], DONOR_FEATURES)
+			scores[start:start + len(batch)] = self._predict(S + D)
+		return scores
+
 	def score(self, student, donor):
-		X = self.prepare(student, donor)
-		proba = self.model.predict_proba(X)[0][1]
-		return float(proba)
\ No newline at end of file
+		return float(self.score_pairs([(student, donor)])[0])
\ No newline at end of file
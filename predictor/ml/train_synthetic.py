@@ -77,7 +77,10 @@ def main():
     print("Train score:", model.score(X_train, y_train))
     print("Test score:", model.score(X_test, y_test))
     os.makedirs('predictor/models', exist_ok=True)
-    joblib.dump({'model': model, 'columns': X.columns.tolist()}, 'predictor/models/matching_model.joblib')
+    # Write then rename, so running servers never reload a half-written file.
+    tmp_path = 'predictor/models/matching_model.joblib.tmp'
+    joblib.dump({'model': model, 'columns': X.columns.tolist()}, tmp_path)
+    os.replace(tmp_path, 'predictor/models/matching_model.joblib')
     print("Model saved to predictor/models/matching_model.joblib")
 
 if __name__ == '__main__':
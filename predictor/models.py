@@ -1,15 +1,33 @@
 from django.db import models
+from django.db.models import F, Q
 from decimal import Decimal
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+class Course(models.Model):
+    """
+    Normalised course name (see predictor.courses.normalize_course).
+    `covers` holds the courses this one matches under the course rule of Matcher.score
+    (its name is contained in theirs, itself included), so matching compares ids only.
+    """
+    name = models.CharField(max_length=120, unique=True)
+    covers = models.ManyToManyField('self', symmetrical=False, related_name='covered_by', blank=True)
+
+    def __str__(self):
+        return self.name
+
 class Donor(models.Model):
     DONOR_TYPES = (('alumni', 'Alumni'), ('corporate', 'Corporate'), ('ngo', 'NGO'))
 
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=150)
     donor_type = models.CharField(max_length=30, choices=DONOR_TYPES)
-    preferred_course = models.CharField(max_length=120, blank=True, null=True)
+    preferred_course = models.CharField(
+        max_length=120, blank=True, null=True,
+        help_text="One or more courses, comma-separated. Leave blank for any course.",
+    )
+    # Parsed from preferred_course on save; empty means any course.
+    preferred_courses = models.ManyToManyField(Course, blank=True, editable=False, related_name='preferring_donors')
     min_gpa = models.FloatField(default=0.0)
     max_amount = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('5000.00'))
 
@@ -26,11 +44,21 @@ class Donor(models.Model):
         return f"{self.name} ({self.donor_type})"
 
     # ---------- CSR helpers ----------
-    def update_csr_score(self, amount):
+    # (minimum csr_score, rank label), highest first
+    CSR_RANKS = ((1000, "Gold"), (500, "Silver"), (100, "Bronze"), (0, "Newbie"))
+
+    @staticmethod
+    def csr_points(amount):
+        """Points rule: 1 point per R100 of a single donation."""
+        return int(Decimal(str(amount)).quantize(Decimal('0.01')) // Decimal('100.00'))
+
+    def update_csr_score(self, amount, points=None):
         """
         Update donor totals and CSR score when they donate `amount`.
         - amount: Decimal or float or int (Rands)
-        - Points rule: 1 point per R100 donated (adjust if needed)
+        - Points rule: see csr_points
+        - points: awarded instead of csr_points(amount), e.g. when `amount` is the sum of several donations
+        Done as one UPDATE with F() expressions, so concurrent donations are never lost.
         """
         if amount is None:
             return
@@ -38,38 +66,26 @@ class Donor(models.Model):
         # Normalize to Decimal
         amount = Decimal(str(amount)).quantize(Decimal('0.01'))
 
-        # compute points (integer)
-        points = int(amount // Decimal('100.00'))
+        Donor.objects.filter(pk=self.pk).update(
+            total_donated=F('total_donated') + amount,
+            csr_score=F('csr_score') + (self.csr_points(amount) if points is None else points),
+        )
+        self.refresh_from_db(fields=['total_donated', 'csr_score'])
 
-        # Update totals and score
-        # Use Python-side update (simple). If you expect concurrent updates use F() expressions.
-        self.total_donated = (self.total_donated or Decimal('0.00')) + amount
-        self.csr_score = (self.csr_score or 0) + points
-        self.save(update_fields=['total_donated', 'csr_score'])
+    def _csr_rank_index(self):
+        s = self.csr_score or 0
+        return next(i for i, (minimum, _) in enumerate(self.CSR_RANKS) if s >= minimum)
 
     @property
     def current_rank(self):
         """Return human rank label based on csr_score."""
-        s = self.csr_score or 0
-        if s >= 1000:
-            return "Gold"
-        if s >= 500:
-            return "Silver"
-        if s >= 100:
-            return "Bronze"
-        return "Newbie"
+        return self.CSR_RANKS[self._csr_rank_index()][1]
 
     @property
     def next_rank_goal(self):
         """Return the CSR score needed for the next rank, or None if already max."""
-        s = self.csr_score or 0
-        if s >= 1000:
-            return None
-        if s >= 500:
-            return 1000
-        if s >= 100:
-            return 500
-        return 100
+        i = self._csr_rank_index()
+        return self.CSR_RANKS[i - 1][0] if i else None
 
     @property
     def progress_to_next(self):
@@ -88,10 +104,22 @@ class Student(models.Model):
     last_name = models.CharField(max_length=100)
     gpa = models.FloatField(default=0.0)
     course = models.CharField(max_length=120, blank=True, null=True)
+    # Normalised from `course` on save.
+    course_ref = models.ForeignKey(Course, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='students')
     need_score = models.FloatField(default=5.0)  # scale 0-10
     province = models.CharField(max_length=100, blank=True, null=True)
     wallet_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
     registration_paid = models.BooleanField(default=False)
+    # Bumped on every save(); bulk .update()s that change registration_paid set it too.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Registration alerts: the unpaid list in (updated_at, id) order, and the
+            # changes since a poller's last watermark (also MAX(updated_at) for the ETag)
+            models.Index(fields=['updated_at', 'id'], condition=Q(registration_paid=False), name='student_unpaid_idx'),
+            models.Index(fields=['updated_at', 'id'], name='student_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student_number} - {self.first_name} {self.last_name}"
@@ -102,6 +130,12 @@ class AcademicRecord(models.Model):
     file = models.FileField(upload_to='academic_records/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # A student's records, newest first (profile and donor views)
+            models.Index(fields=['student', 'uploaded_at'], name='record_student_uploaded_idx'),
+        ]
+
     def __str__(self):
         return f"{self.student.student_number} - {self.title}"
 
@@ -114,6 +148,13 @@ class BursaryRequest(models.Model):
     fulfilled = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Open bursaries of a student (funding a match or a student); fulfilled ones,
+            # the bulk of the table over time, are left out of the index
+            models.Index(fields=['student', 'id'], condition=Q(fulfilled=False), name='bursary_open_student_idx'),
+        ]
+
     def __str__(self):
         return f"BR-{self.id} ({self.student.student_number}) - {self.priority} - {'Fulfilled' if self.fulfilled else 'Open'}"
 
@@ -127,6 +168,11 @@ class Match(models.Model):
 
     class Meta:
         unique_together = ('student', 'donor')
+        indexes = [
+            # Serves the donor dashboard's top-K read (filter donor, order by -score)
+            # straight from the index, without sorting all of the donor's matches.
+            models.Index(fields=['donor', '-score'], name='match_donor_score_idx'),
+        ]
 
 
 
@@ -141,6 +187,13 @@ class Transaction(models.Model):
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a donor's / student's transactions, newest first
+            models.Index(fields=['donor', 'created_at', 'id'], name='tx_donor_created_idx'),
+            models.Index(fields=['student', 'created_at', 'id'], name='tx_student_created_idx'),
+        ]
+
     def __str__(self):
         return f"Tx {self.id} | Donor: {self.donor.name} | Amount: {self.amount}"
 
@@ -152,6 +205,13 @@ class RegistrationFlag(models.Model):
     flagged_reason = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the queue alerts (flagged=True, newest first); only open
+            # flags are indexed, resolved ones never appear there
+            models.Index(fields=['created_at', 'id'], condition=Q(flagged=True), name='regflag_open_created_idx'),
+        ]
+
 class AccessRequest(models.Model):
     STATUS_CHOICES = (('pending', 'Pending'), ('approved', 'Approved'), ('denied', 'Denied'))
     donor = models.ForeignKey(Donor, on_delete=models.CASCADE)
@@ -163,6 +223,10 @@ class AccessRequest(models.Model):
 
     class Meta:
         unique_together = ('donor', 'student')  # one request per donor-student pair
+        indexes = [
+            # A student's pending requests, oldest first
+            models.Index(fields=['student', 'created_at'], condition=Q(status='pending'), name='accessreq_pending_idx'),
+        ]
 
     def __str__(self):
         return f"AccessRequest({self.donor} -> {self.student}) [{self.status}]"
@@ -181,5 +245,162 @@ class UniversityPayment(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
     approved = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of payments, newest first: all, per student, per donor
+            models.Index(fields=['timestamp', 'id'], name='payment_timestamp_idx'),
+            models.Index(fields=['student', 'timestamp', 'id'], name='payment_student_ts_idx'),
+            models.Index(fields=['donor', 'timestamp', 'id'], name='payment_donor_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.student} - R{self.amount} from {self.donor or 'University/Trust'}"
+
+class MatchJob(models.Model):
+    """
+    Queued rematch for one student or one donor, processed by `manage.py run_match_worker`.
+    At most one pending job exists per student/donor; repeated saves coalesce into it.
+    """
+    STATUS_CHOICES = (('pending', 'Pending'), ('running', 'Running'), ('failed', 'Failed'))
+    student = models.ForeignKey('Student', on_delete=models.CASCADE, null=True, blank=True, related_name="match_jobs")
+    donor = models.ForeignKey('Donor', on_delete=models.CASCADE, null=True, blank=True, related_name="match_jobs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student'], condition=models.Q(status='pending'), name='unique_pending_student_match_job'),
+            models.UniqueConstraint(fields=['donor'], condition=models.Q(status='pending'), name='unique_pending_donor_match_job'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='matchjob_status_run_after'),
+        ]
+
+    def __str__(self):
+        target = f"student {self.student_id}" if self.student_id else f"donor {self.donor_id}"
+        return f"MatchJob {self.id} ({target}) [{self.status}]"
+
+
+class MatchRun(models.Model):
+    """
+    Checkpoint of a full rematch (Matcher.generate_for_all). Students are processed in id
+    order, so last_student_id is enough to resume an interrupted run.
+    """
+    STATUS_CHOICES = (('running', 'Running'), ('finished', 'Finished'))
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    min_threshold = models.FloatField()
+    last_student_id = models.BigIntegerField(default=0)
+    students_done = models.PositiveIntegerField(default=0)
+    matches_written = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"MatchRun {self.id} [{self.status}] after student {self.last_student_id}"
+
+
+class LedgerEntry(models.Model):
+    """
+    One signed change to a donor's or a student's wallet. Entries are append-only; a
+    wallet's balance is its latest WalletSnapshot plus the entries written after it.
+    A donor or student with ledger history cannot be deleted (PROTECT).
+    """
+    KIND_CHOICES = (
+        ('opening', 'Opening balance'),
+        ('top_up', 'Top-up'),
+        ('withdrawal', 'Withdrawal'),
+        ('debit', 'Debit'),
+        ('credit', 'Credit'),
+    )
+    donor = models.ForeignKey('Donor', on_delete=models.PROTECT, null=True, blank=True, related_name="ledger_entries")
+    student = models.ForeignKey('Student', on_delete=models.PROTECT, null=True, blank=True, related_name="ledger_entries")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # negative for money leaving the wallet
+    transaction = models.ForeignKey('Transaction', on_delete=models.SET_NULL, null=True, blank=True, related_name="ledger_entries")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(donor__isnull=False, student__isnull=True) | models.Q(donor__isnull=True, student__isnull=False),
+                name='ledger_entry_one_wallet',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['donor', 'id'], name='ledger_donor_id_idx'),
+            models.Index(fields=['student', 'id'], name='ledger_student_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError("Ledger entries are append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        wallet = f"donor {self.donor_id}" if self.donor_id else f"student {self.student_id}"
+        return f"Ledger {self.id} ({wallet}) {self.kind} {self.amount}"
+
+
+class WalletSnapshot(models.Model):
+    """
+    A wallet's balance after all of its ledger entries up to and including last_entry_id.
+    Written by `manage.py compact_ledger`.
+    """
+    donor = models.ForeignKey('Donor', on_delete=models.PROTECT, null=True, blank=True, related_name="wallet_snapshots")
+    student = models.ForeignKey('Student', on_delete=models.PROTECT, null=True, blank=True, related_name="wallet_snapshots")
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    last_entry_id = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(donor__isnull=False, student__isnull=True) | models.Q(donor__isnull=True, student__isnull=False),
+                name='wallet_snapshot_one_wallet',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['donor', '-last_entry_id'], name='snapshot_donor_latest_idx'),
+            models.Index(fields=['student', '-last_entry_id'], name='snapshot_student_latest_idx'),
+        ]
+
+    def __str__(self):
+        wallet = f"donor {self.donor_id}" if self.donor_id else f"student {self.student_id}"
+        return f"Snapshot ({wallet}) {self.balance} @ {self.last_entry_id}"
+
+
+class FundingRollup(models.Model):
+    """
+    Daily UniversityPayment totals, kept current by predictor.signals and rebuilt by
+    `manage.py backfill_funding_rollups`. One row per (scope, day, donor_key, student_key):
+    scope 'all' sums every payment, 'donor'/'student' one donor's/student's payments, and
+    'pair' one donor-student combination. Keys are plain ids (unique constraints need
+    non-NULL columns); 0 means the key is not part of the scope, or no donor (University/Trust).
+    Likewise day 0001-01-01 (rollups.TOTAL_DAY) holds the all-time totals of each key.
+    """
+    SCOPE_CHOICES = (('all', 'All payments'), ('donor', 'Per donor'), ('student', 'Per student'), ('pair', 'Per donor and student'))
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    day = models.DateField()
+    donor_key = models.PositiveBigIntegerField(default=0)
+    student_key = models.PositiveBigIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    approved_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    payments = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'day', 'donor_key', 'student_key'], name='funding_rollup_key'),
+        ]
+        indexes = [
+            models.Index(fields=['scope', 'donor_key', 'day'], name='funding_rollup_donor_idx'),
+            models.Index(fields=['scope', 'student_key', 'day'], name='funding_rollup_student_idx'),
+            models.Index(fields=['scope', 'day', '-amount'], name='funding_rollup_rank_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.student} - R{self.amount} from {self.donor or 'University/Trust'}"
\ No newline at end of file
+        return f"{self.scope} {self.day} d{self.donor_key} s{self.student_key}: R{self.amount}"
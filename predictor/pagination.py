@@ -0,0 +1,103 @@
+# predictor/pagination.py
+# Keyset (cursor) pagination for newest-first lists. A page is fetched with
+# WHERE (field, id) < cursor ORDER BY field DESC, id DESC LIMIT n, which a composite
+# (…, field, id) index answers directly: page N costs the same as page 1.
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.http import urlencode
+
+DEFAULT_PAGE_SIZE = 20
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, value, pk):
+    raw = json.dumps([direction, value.isoformat(), pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        direction, value, pk = json.loads(raw)
+        if direction not in ("next", "prev"):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(value), int(pk)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor {token!r}") from e
+
+
+class KeysetPage:
+    """One page of rows plus the cursors of its neighbours (None at either end)."""
+
+    def __init__(self, items, field, has_next, has_prev, request=None, param="cursor"):
+        self.items = items
+        self.field = field
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.request = request
+        self.param = param
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def _cursor(self, direction, item):
+        return encode_cursor(direction, getattr(item, self.field), item.pk)
+
+    @property
+    def next_cursor(self):
+        return self._cursor("next", self.items[-1]) if self.has_next else None
+
+    @property
+    def prev_cursor(self):
+        return self._cursor("prev", self.items[0]) if self.has_prev else None
+
+    def _url(self, cursor):
+        params = self.request.GET.copy() if self.request is not None else {}
+        params.pop(self.param, None)
+        if cursor:
+            params[self.param] = cursor
+        return "?" + urlencode(params, doseq=True) if params else "?"
+
+    @property
+    def next_url(self):
+        return self._url(self.next_cursor) if self.has_next else None
+
+    @property
+    def prev_url(self):
+        return self._url(self.prev_cursor) if self.has_prev else None
+
+
+def keyset_page(queryset, field, cursor=None, page_size=DEFAULT_PAGE_SIZE, request=None, param="cursor"):
+    """
+    A newest-first page of `queryset`, ordered by (field, pk) descending.
+    `cursor` is a token from a previous page's next_cursor/prev_cursor (None: first page).
+    Raises InvalidCursor for a malformed token.
+    """
+    direction, value, pk = decode_cursor(cursor) if cursor else ("next", None, None)
+    if value is None:
+        rows = queryset.order_by(f"-{field}", "-pk")
+    elif direction == "next":
+        # field <= value leads, so the index range scan starts at the cursor
+        rows = queryset.filter(Q(**{f"{field}__lte": value}) & (Q(**{f"{field}__lt": value}) | Q(pk__lt=pk))).order_by(f"-{field}", "-pk")
+    else:
+        rows = queryset.filter(Q(**{f"{field}__gte": value}) & (Q(**{f"{field}__gt": value}) | Q(pk__gt=pk))).order_by(field, "pk")
+
+    items = list(rows[:page_size + 1])
+    more = len(items) > page_size
+    items = items[:page_size]
+    if direction == "prev":
+        items.reverse()
+        return KeysetPage(items, field, has_next=bool(items), has_prev=more, request=request, param=param)
+    return KeysetPage(items, field, has_next=more, has_prev=value is not None and bool(items), request=request, param=param)
@@ -0,0 +1,281 @@
+# predictor/rollups.py
+# Daily funding rollups (FundingRollup) behind the transparency dashboard. Every
+# UniversityPayment write adds/subtracts its contribution here (see predictor.signals),
+# so the dashboard reads a handful of small rollup rows instead of the payment table.
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .cache_locks import try_lock
+from .models import Donor, FundingRollup, Student, UniversityPayment
+
+TOP_N = 20
+# Rollup rows on this day hold each key's all-time totals, which the rankings read
+TOTAL_DAY = date(1, 1, 1)
+# Days of the daily funding chart, ending today
+DASHBOARD_DAYS = 90
+# Stampede guard: one process recomputes an expired dashboard while the others serve the
+# stale copy; with nothing cached at all they wait up to RECOMPUTE_WAIT_SECONDS for it.
+RECOMPUTE_LOCK_SECONDS = 30
+RECOMPUTE_WAIT_SECONDS = 2.0
+RECOMPUTE_POLL_SECONDS = 0.05
+
+
+def payment_values(payment):
+    """The fields of a UniversityPayment that its rollup rows depend on."""
+    day = timezone.localdate(payment.timestamp) if timezone.is_aware(payment.timestamp) else payment.timestamp.date()
+    return {
+        "day": day,
+        "donor_key": payment.donor_id or 0,
+        "student_key": payment.student_id,
+        "amount": Decimal(str(payment.amount)),
+        "approved": bool(payment.approved),
+    }
+
+
+def _keys(values):
+    donor, student = values["donor_key"], values["student_key"]
+    return [("all", 0, 0), ("donor", donor, 0), ("student", 0, student), ("pair", donor, student)]
+
+
+def apply(values, sign=1):
+    """Add (sign=1) or remove (sign=-1) one payment's contribution to its daily and all-time rollup rows."""
+    amount = sign * values["amount"]
+    approved = amount if values["approved"] else Decimal("0.00")
+    _add([
+        (scope, day, donor_key, student_key, amount, approved, sign)
+        for scope, donor_key, student_key in _keys(values)
+        for day in (values["day"], TOTAL_DAY)
+    ])
+
+
+def _add(rows):
+    """Add (scope, day, donor_key, student_key, amount, approved, payments) deltas to their rollup rows."""
+    if connection.vendor not in ("sqlite", "postgresql"):
+        with transaction.atomic():
+            for scope, day, donor_key, student_key, amount, approved, count in rows:
+                rollup, _ = FundingRollup.objects.select_for_update().get_or_create(
+                    scope=scope, day=day, donor_key=donor_key, student_key=student_key
+                )
+                FundingRollup.objects.filter(pk=rollup.pk).update(
+                    amount=F("amount") + amount, approved_amount=F("approved_amount") + approved, payments=F("payments") + count
+                )
+        return
+
+    # Single-statement upsert: concurrent payments on the same day never lose an increment.
+    qn = connection.ops.quote_name
+    column = {f: qn(FundingRollup._meta.get_field(f).column)
+              for f in ("scope", "day", "donor_key", "student_key", "amount", "approved_amount", "payments")}
+    table = qn(FundingRollup._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(column.values())}) VALUES (%s, %s, %s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({column['scope']}, {column['day']}, {column['donor_key']}, {column['student_key']}) DO UPDATE SET "
+        + ", ".join(f"{column[f]} = {table}.{column[f]} + excluded.{column[f]}" for f in ("amount", "approved_amount", "payments"))
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (scope, connection.ops.adapt_datefield_value(day), donor_key, student_key,
+             connection.ops.adapt_decimalfield_value(amount, 14, 2), connection.ops.adapt_decimalfield_value(approved, 14, 2), count)
+            for scope, day, donor_key, student_key, amount, approved, count in rows
+        ])
+
+
+def record_change(before, after):
+    """
+    Move a payment's contribution from its old values to its new ones (either may be None)
+    and, once committed, invalidate the cached dashboards that showed it.
+    """
+    if before == after:
+        return
+    with transaction.atomic():
+        if before:
+            apply(before, -1)
+        if after:
+            apply(after, 1)
+        scopes = {scope for values in (before, after) if values for scope in dashboard_scopes(values)}
+        transaction.on_commit(lambda: invalidate_dashboards(scopes))
+
+
+def detach_donor(donor_id):
+    """
+    Move a donor's rollup rows to donor_key 0 (University/Trust). Call before the donor is
+    deleted: its payments' donor is then set to NULL by a bulk UPDATE that sends no signals.
+    """
+    with transaction.atomic():
+        rows = FundingRollup.objects.filter(scope__in=("donor", "pair"), donor_key=donor_id)
+        moved = [
+            (scope, day, 0, student_key, amount, approved, payments)
+            for scope, day, student_key, amount, approved, payments
+            in rows.values_list("scope", "day", "student_key", "amount", "approved_amount", "payments")
+        ]
+        if not moved:
+            return
+        rows.delete()
+        _add(moved)
+        scopes = {"global", f"donor:{donor_id}"} | {f"student:{row[3]}" for row in moved if row[0] == "pair"}
+        transaction.on_commit(lambda: invalidate_dashboards(scopes))
+
+
+def rebuild(batch_size=1000):
+    """Recompute every rollup row from UniversityPayment (GROUP BY in the database). Returns the row count."""
+    grouped = (
+        UniversityPayment.objects.order_by()
+        .annotate(day=TruncDate("timestamp"))
+        .values("day", "donor_id", "student_id")
+        .annotate(
+            total=Sum("amount"),
+            approved_total=Sum("amount", filter=Q(approved=True), default=Value(Decimal("0.00"))),
+            count=Count("id"),
+        )
+    )
+    totals = defaultdict(lambda: [Decimal("0.00"), Decimal("0.00"), 0])
+    for row in grouped.iterator(chunk_size=batch_size):
+        values = {"day": row["day"], "donor_key": row["donor_id"] or 0, "student_key": row["student_id"]}
+        for scope, donor_key, student_key in _keys(values):
+            for day in (row["day"], TOTAL_DAY):
+                total = totals[(scope, day, donor_key, student_key)]
+                total[0] += row["total"]
+                total[1] += row["approved_total"] or 0
+                total[2] += row["count"]
+
+    with transaction.atomic():
+        FundingRollup.objects.all().delete()
+        FundingRollup.objects.bulk_create(
+            (FundingRollup(scope=scope, day=day, donor_key=donor_key, student_key=student_key,
+                           amount=amount, approved_amount=approved, payments=count)
+             for (scope, day, donor_key, student_key), (amount, approved, count) in totals.items()),
+            batch_size=batch_size,
+        )
+    return len(totals)
+
+
+def _donor_names(ids):
+    return dict(Donor.objects.filter(pk__in=ids).values_list("id", "name"))
+
+
+def _student_names(ids):
+    return {pk: f"{first} {last}" for pk, first, last in Student.objects.filter(pk__in=ids).values_list("id", "first_name", "last_name")}
+
+
+def _ranked(rows, key, name_of, fallback):
+    """The TOP_N largest all-time totals among `rows`, one per `key`, as [{'id', 'name', 'total'}]."""
+    totals = list(rows.filter(day=TOTAL_DAY).order_by("-amount", key).values(key, total=F("amount"))[:TOP_N])
+    names = name_of([t[key] for t in totals if t[key]])
+    return [{"id": t[key], "name": names.get(t[key], fallback), "total": t["total"]} for t in totals]
+
+
+def dashboard_totals(student=None, donor=None):
+    """
+    The transparency dashboard's aggregates for a student, a donor, or everyone:
+    total approved funding, top donors, top students (all read from all-time rows) and
+    the daily funding series of the last DASHBOARD_DAYS days.
+    """
+    rollups = FundingRollup.objects.all()
+    if student is not None:
+        own = rollups.filter(scope="student", student_key=student.pk)
+        donors = rollups.filter(scope="pair", student_key=student.pk)
+        students = own
+    elif donor is not None:
+        own = rollups.filter(scope="donor", donor_key=donor.pk)
+        donors = own
+        students = rollups.filter(scope="pair", donor_key=donor.pk)
+    else:
+        own = rollups.filter(scope="all")
+        donors = rollups.filter(scope="donor")
+        students = rollups.filter(scope="student")
+
+    since = timezone.localdate() - timedelta(days=DASHBOARD_DAYS - 1)
+    return {
+        "total_funded": own.filter(day=TOTAL_DAY).aggregate(total=Sum("approved_amount"))["total"] or Decimal("0.00"),
+        "donors": _ranked(donors, "donor_key", _donor_names, "University/Trust"),
+        "students": _ranked(students, "student_key", _student_names, ""),
+        "daily_funding": list(own.filter(day__gte=since).order_by("day").values("day", total=F("amount"))),
+    }
+
+
+# ---------- Dashboard cache ----------
+def _cache():
+    return caches[getattr(settings, "TRANSPARENCY_CACHE_ALIAS", "default")]
+
+
+def dashboard_scope(student=None, donor=None):
+    if student is not None:
+        return f"student:{student.pk}"
+    if donor is not None:
+        return f"donor:{donor.pk}"
+    return "global"
+
+
+def dashboard_scopes(values):
+    """The dashboards a payment with these rollup values appears on."""
+    scopes = ["global", f"student:{values['student_key']}"]
+    if values["donor_key"]:
+        scopes.append(f"donor:{values['donor_key']}")
+    return scopes
+
+
+def _version_key(scope):
+    return f"transparency:{scope}:version"
+
+
+def _version(cache, scope):
+    # A missing version (never set, or culled) starts as a fresh random one, never as a
+    # value an older cached entry could still be stored under.
+    version = cache.get(_version_key(scope))
+    if version is None:
+        cache.add(_version_key(scope), uuid.uuid4().hex, timeout=None)
+        version = cache.get(_version_key(scope))
+    return version
+
+
+def invalidate_dashboards(scopes):
+    """
+    Give each scope a new random version, so its cached dashboard (and any recompute
+    already in flight, which stores under the old version) is never served again.
+    A plain set, not incr: file caches cannot increment atomically, and concurrent
+    invalidations only need to leave *a* new version behind.
+    """
+    cache = _cache()
+    for scope in scopes:
+        cache.set(_version_key(scope), uuid.uuid4().hex, timeout=None)
+
+
+def cached_dashboard_totals(student=None, donor=None):
+    """dashboard_totals, cached per role scope (a student, a donor, or everyone)."""
+    cache = _cache()
+    scope = dashboard_scope(student, donor)
+    key = f"transparency:{scope}:v{_version(cache, scope)}"
+    timeout = getattr(settings, "TRANSPARENCY_CACHE_TIMEOUT", 600)
+
+    entry = cache.get(key)
+    if entry and entry["fresh_until"] > time.time():
+        return entry["totals"]
+
+    with try_lock(cache, key, RECOMPUTE_LOCK_SECONDS) as won:
+        if won:
+            latest = cache.get(key)
+            if latest and latest["fresh_until"] > time.time():
+                return latest["totals"]  # refreshed by the previous holder
+            totals = dashboard_totals(student=student, donor=donor)
+            # Kept past its freshness so it can be served while the next recompute runs.
+            cache.set(key, {"fresh_until": time.time() + timeout, "totals": totals}, timeout * 2)
+            return totals
+
+    if entry:
+        return entry["totals"]  # another worker is refreshing it
+    deadline = time.time() + RECOMPUTE_WAIT_SECONDS
+    while time.time() < deadline:
+        time.sleep(RECOMPUTE_POLL_SECONDS)
+        entry = cache.get(key)
+        if entry:
+            return entry["totals"]
+    return dashboard_totals(student=student, donor=donor)
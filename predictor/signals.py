@@ -1,64 +1,193 @@
 # predictor/signals.py
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from predictor.models import Student, Donor
+from predictor.models import Student, Donor, RegistrationFlag, UniversityPayment
 from predictor.matcher import Matcher
+from predictor import alert_feed, courses, db, match_queue, metrics, rollups
+
+# Only changes to these fields can change a match score. Saves that touch nothing
+# else (wallet top-ups, registration flags, CSR points) never trigger a rematch.
+MATCHING_FIELDS = {
+    Student: ("gpa", "course", "need_score"),
+    Donor: ("min_gpa", "preferred_course", "max_amount"),
+}
+
+_UNKNOWN = object()
+
+
+def _matching_values(instance):
+    # Read straight from __dict__ so deferred fields are not fetched just to snapshot them.
+    return {f: instance.__dict__.get(f, _UNKNOWN) for f in MATCHING_FIELDS[type(instance)]}
+
+
+def changed_matching_fields(instance, created, update_fields=None):
+    """
+    The matching fields a save of `instance` may have changed.
+    """
+    fields = MATCHING_FIELDS[type(instance)]
+    if created:
+        return set(fields)
+    if update_fields is not None:
+        fields = [f for f in fields if f in update_fields]
+    before = getattr(instance, "_matching_snapshot", {})
+    after = _matching_values(instance)
+    return {
+        f for f in fields
+        if before.get(f, _UNKNOWN) is _UNKNOWN or before[f] != after[f]
+    }
+
+
+class PendingRematch:
+    """
+    Student/donor ids whose matches must be refreshed when the current transaction commits.
+    One instance is registered per transaction, so a request that saves the same donor
+    several times rematches it once. With MATCHING_BACKGROUND_WORKER the ids are queued
+    as MatchJobs instead of being scored inside the request.
+    """
+
+    def __init__(self):
+        self.student_ids = set()
+        self.donor_ids = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        if getattr(settings, "MATCHING_BACKGROUND_WORKER", False):
+            match_queue.enqueue(student_ids=self.student_ids, donor_ids=self.donor_ids)
+            return
+        matcher = Matcher(min_threshold=0.5)
+        if self.donor_ids:
+            matcher.generate_for_donors(self.donor_ids)
+        # Students already covered by a donor rematch still need scoring against other donors.
+        if self.student_ids:
+            matcher.generate_for_students(self.student_ids)
+
+
+def schedule_rematch(student_id=None, donor_id=None):
+    """
+    Queue a rematch for a student and/or donor to run once, on commit.
+    Outside an atomic block it runs immediately.
+    """
+    connection = transaction.get_connection()
+    pending = getattr(connection, "_pending_rematch", None)
+    # Rolled-back transactions drop their on_commit callbacks; start a fresh batch then.
+    registered = pending is not None and not pending.done and any(
+        callback[1] is pending for callback in connection.run_on_commit
+    )
+    if not connection.in_atomic_block or not registered:
+        pending = PendingRematch()
+        if connection.in_atomic_block:
+            connection._pending_rematch = pending
+
+    if student_id is not None:
+        pending.student_ids.add(student_id)
+    if donor_id is not None:
+        pending.donor_ids.add(donor_id)
+
+    if not registered:
+        transaction.on_commit(pending)
+
+
+@receiver(post_init, sender=Student)
+@receiver(post_init, sender=Donor)
+def remember_matching_fields(sender, instance, **kwargs):
+    instance._matching_snapshot = _matching_values(instance)
+
 
 @receiver(post_save, sender=Student)
-def generate_matches_for_student(sender, instance, created, **kwargs):
+def generate_matches_for_student(sender, instance, created, update_fields=None, **kwargs):
     """
-    Run matching when a new student is created or updated.
+    Rematch a student when it is created or one of its matching fields changes.
     """
-    matcher = Matcher(min_threshold=0.5)
-    students = [instance]  # just this student
-    donors = list(Donor.objects.all())
-    for donor in donors:
-        student_features = {
-            "gpa": instance.gpa,
-            "need_score": instance.need_score,
-            "course": instance.course,
-        }
-        donor_features = {
-            "min_gpa": donor.min_gpa,
-            "preferred_course": donor.preferred_course,
-            "donor_type": donor.donor_type,
-            "max_amount": donor.max_amount,
-        }
-        score, explanation = matcher.score(student_features, donor_features)
-        if score >= matcher.min_threshold:
-            from predictor.models import Match
-            Match.objects.update_or_create(
-                student=instance,
-                donor=donor,
-                defaults={"score": score, "top_features": explanation}
-            )
+    changed = changed_matching_fields(instance, created, update_fields)
+    if "course" in changed:
+        courses.index_student(instance)
+    if changed:
+        schedule_rematch(student_id=instance.pk)
+    instance._matching_snapshot = _matching_values(instance)
 
 
 @receiver(post_save, sender=Donor)
-def generate_matches_for_donor(sender, instance, created, **kwargs):
+def generate_matches_for_donor(sender, instance, created, update_fields=None, **kwargs):
     """
-    Run matching when a new donor is created or updated.
+    Rematch a donor when it is created or one of its matching fields changes.
     """
-    matcher = Matcher(min_threshold=0.5)
-    donors = [instance]  # just this donor
-    students = list(Student.objects.all())
-    for student in students:
-        student_features = {
-            "gpa": student.gpa,
-            "need_score": student.need_score,
-            "course": student.course,
-        }
-        donor_features = {
-            "min_gpa": instance.min_gpa,
-            "preferred_course": instance.preferred_course,
-            "donor_type": instance.donor_type,
-            "max_amount": instance.max_amount,
-        }
-        score, explanation = matcher.score(student_features, donor_features)
-        if score >= matcher.min_threshold:
-            from predictor.models import Match
-            Match.objects.update_or_create(
-                student=student,
-                donor=instance,
-                defaults={"score": score, "top_features": explanation}
-            )
+    changed = changed_matching_fields(instance, created, update_fields)
+    if "preferred_course" in changed:
+        courses.index_donor(instance)
+    if changed:
+        schedule_rematch(donor_id=instance.pk)
+    instance._matching_snapshot = _matching_values(instance)
+
+
+# ---------- Funding rollups ----------
+@receiver(post_init, sender=UniversityPayment)
+def remember_rollup_values(sender, instance, **kwargs):
+    # Unsaved or partially loaded payments have no rollup contribution to remember.
+    loaded = instance.pk and all(f in instance.__dict__ for f in ("timestamp", "donor_id", "student_id", "amount", "approved"))
+    instance._rollup_snapshot = rollups.payment_values(instance) if loaded else None
+
+
+@receiver(pre_save, sender=UniversityPayment)
+def load_rollup_values(sender, instance, **kwargs):
+    # A partially loaded payment is re-read once so its old contribution is known.
+    if not instance._state.adding and getattr(instance, "_rollup_snapshot", None) is None:
+        stored = UniversityPayment.objects.filter(pk=instance.pk).first()
+        instance._rollup_snapshot = rollups.payment_values(stored) if stored else None
+
+
+@receiver(post_save, sender=UniversityPayment)
+def update_funding_rollups(sender, instance, created, **kwargs):
+    """Move the payment's contribution in FundingRollup from its old values to its new ones."""
+    before = None if created else getattr(instance, "_rollup_snapshot", None)
+    after = rollups.payment_values(instance)
+    rollups.record_change(before, after)
+    instance._rollup_snapshot = after
+
+
+@receiver(post_delete, sender=UniversityPayment)
+def remove_from_funding_rollups(sender, instance, **kwargs):
+    before = getattr(instance, "_rollup_snapshot", None) or rollups.payment_values(instance)
+    rollups.record_change(before, None)
+
+
+@receiver(pre_delete, sender=Donor)
+def detach_donor_rollups(sender, instance, **kwargs):
+    # UniversityPayment.donor is SET_NULL through a signal-less bulk UPDATE; a deleted
+    # student's payments are cascade-deleted one by one, through the receiver above.
+    rollups.detach_donor(instance.pk)
+
+
+# ---------- Queue alert feed ----------
+@receiver(post_init, sender=RegistrationFlag)
+def remember_flagged(sender, instance, **kwargs):
+    instance._was_flagged = instance.__dict__.get("flagged", False) if instance.pk else False
+
+
+@receiver(post_save, sender=RegistrationFlag)
+def publish_flag_change(sender, instance, created, **kwargs):
+    """Push "new" when a flag is raised and "resolved" when it is cleared, once committed."""
+    was_flagged = not created and getattr(instance, "_was_flagged", False)
+    if instance.flagged and not was_flagged:
+        alert_feed.publish_on_commit([alert_feed.flag_event("new", instance)])
+    elif was_flagged and not instance.flagged:
+        alert_feed.publish_on_commit([alert_feed.flag_event("resolved", instance)])
+    instance._was_flagged = instance.flagged
+
+
+# ---------- Metrics ----------
+@receiver(connection_created)
+def record_request_queries(sender, connection, **kwargs):
+    # Counts queries of sampled requests (predictor.middleware); a no-op otherwise.
+    if metrics.record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.record_query)
+
+
+# ---------- SQLite tuning ----------
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    # WAL, busy timeout, cache and mmap of the production profile (settings.SQLITE_PRAGMAS)
+    db.apply_pragmas(connection)
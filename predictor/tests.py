@@ -1,3 +1,1362 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import joblib
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections
+from django.db.models import ProtectedError, Sum
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import alert_feed, cache_locks, db, leaderboard, ledger, match_queue, metrics, rollups, views, wallet
+from .pagination import keyset_page
+from .courses import candidate_donors, candidate_students
+from .matcher import Matcher, ModelMatcher, StudentArrays, DonorArrays
+from .models import (
+    Student, Donor, Match, MatchJob, MatchRun, BursaryRequest, RegistrationFlag, AccessRequest, AcademicRecord, Transaction, LedgerEntry, WalletSnapshot,
+    UniversityPayment, FundingRollup,
+)
+
+
+COURSES = ["Engineering", "Civil  engineering", "Commerce", "Health", "ICT", "", None]
+PREFERENCES = ["Engineering", "commerce", "Any", "", None, "Law", "eng", "Health, ICT", "law, any"]
+
+
+class MatrixEngineTests(TestCase):
+    def test_iter_matches_agrees_with_score(self):
+        rng = random.Random(7)
+        for i in range(60):
+            Student.objects.create(
+                student_number=f"S{i}", first_name="A", last_name="B",
+                gpa=rng.choice([0.0, 2.0, 2.4, 3.0, 3.5, 4.0, 4.5]),
+                need_score=rng.choice([0, 5.0, 55.5, 100, 250]),
+                course=rng.choice(COURSES),
+            )
+        for j in range(25):
+            Donor.objects.create(
+                name=f"D{j}", donor_type="alumni",
+                min_gpa=rng.choice([0.0, 2.5, 3.0, 3.9]),
+                preferred_course=rng.choice(PREFERENCES),
+            )
+        matcher = Matcher(min_threshold=0.5)
+
+        expected = {}
+        for student in Student.objects.all():
+            for donor in Donor.objects.all():
+                s, explanation = matcher.score(
+                    {"gpa": student.gpa, "need_score": student.need_score, "course": student.course},
+                    {"min_gpa": donor.min_gpa, "preferred_course": donor.preferred_course},
+                )
+                if s >= matcher.min_threshold:
+                    expected[(student.id, donor.id)] = (s, explanation)
+
+        students = StudentArrays.from_queryset(Student.objects.all())
+        donors = DonorArrays.from_queryset(Donor.objects.all())
+        got = {
+            (sid, did): (s, explanation)
+            for sid, did, s, explanation in matcher.iter_matches(students, donors)
+        }
+        self.assertEqual(got, expected)
+
+    def test_generate_for_all_persists_scores(self):
+        Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+        Student.objects.create(student_number="S2", first_name="C", last_name="D", gpa=1.0, course="Health", need_score=2)
+        Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="Engineering", min_gpa=3.0)
+
+        total = Matcher(min_threshold=0.5, batch_size=1).generate_for_all()
+
+        self.assertEqual(total, 1)
+        match = Match.objects.get()
+        self.assertEqual(match.student.student_number, "S1")
+        self.assertEqual(match.score, 0.776)
+        self.assertEqual(match.top_features, {"gpa_match": 0.36, "course_match": 0.4, "need_score": 0.016})
+
+    def test_process_pool_gives_the_same_matches(self):
+        rng = random.Random(3)
+        for i in range(40):
+            Student.objects.create(student_number=f"S{i}", first_name="A", last_name="B", gpa=rng.uniform(0, 4), need_score=rng.uniform(0, 100), course=rng.choice(COURSES))
+        for j in range(10):
+            Donor.objects.create(name=f"D{j}", donor_type="alumni", min_gpa=rng.uniform(0, 3), preferred_course=rng.choice(PREFERENCES))
+
+        Matcher(batch_size=7).generate_for_all()
+        serial = set(Match.objects.values_list("student_id", "donor_id", "score"))
+        Match.objects.all().delete()
+        total = Matcher(batch_size=7).generate_for_all(workers=2)
+
+        self.assertEqual(set(Match.objects.values_list("student_id", "donor_id", "score")), serial)
+        self.assertEqual(total, len(serial))
+
+    def test_generate_for_all_prunes_stale_and_resumes_from_checkpoint(self):
+        students = [
+            Student.objects.create(student_number=f"S{i}", first_name="A", last_name="B", gpa=3.6, course="Engineering")
+            for i in range(3)
+        ]
+        donor = Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="Engineering", min_gpa=3.0)
+        other = Donor.objects.create(name="Law Firm", donor_type="corporate", preferred_course="Law", min_gpa=3.9)
+        Match.objects.create(student=students[0], donor=other, score=0.9)
+        Match.objects.create(student=students[1], donor=other, score=0.9, funded=True)
+        # A run that was interrupted after the first student
+        MatchRun.objects.create(min_threshold=0.5, last_student_id=students[0].id, students_done=1)
+
+        total = Matcher(min_threshold=0.5, batch_size=1).generate_for_all(resume=True)
+
+        self.assertEqual(total, 2)
+        self.assertEqual(MatchRun.objects.get().status, "finished")
+        self.assertEqual(
+            set(Match.objects.values_list("student_id", "donor_id")),
+            {(students[0].id, other.id), (students[1].id, other.id), (students[1].id, donor.id), (students[2].id, donor.id)},
+        )
+
+    def test_request_fee_shows_top_donors_but_saves_only_matches_above_threshold(self):
+        user = User.objects.create_user("stu", password="pw")
+        student = Student.objects.create(user=user, student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering")
+        good = Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="Engineering", min_gpa=3.0)
+        poor = Donor.objects.create(name="Law Firm", donor_type="corporate", preferred_course="Law", min_gpa=3.9)
+        self.client.force_login(user)
+
+        response = self.client.post(f"/student/{student.id}/request_fee/", {"requested_amount": "500", "priority": "tuition"})
+
+        self.assertEqual([r["donor"] for r in response.context["results"]], [good, poor])
+        self.assertLess(response.context["results"][1]["score"], 0.5)
+        self.assertEqual(list(Match.objects.values_list("donor_id", flat=True)), [good.id])
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=False)
+class RematchSignalTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.student = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+            self.donor = Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="Engineering", min_gpa=3.0)
+
+    def test_wallet_only_saves_do_not_rematch(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.donor.wallet_balance += 100
+            self.donor.save(update_fields=["wallet_balance"])
+            self.donor.update_csr_score(500)
+            self.student.registration_paid = True
+            self.student.save()
+        self.assertEqual(callbacks, [])
+
+    def test_changes_are_rematched_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.donor.min_gpa = 2.0
+            self.donor.save()
+            self.donor.preferred_course = "Any"
+            self.donor.save()
+            self.student.gpa = 3.9
+            self.student.save()
+        self.assertEqual(len(callbacks), 1)
+        match = Match.objects.get(student=self.student, donor=self.donor)
+        self.assertEqual(match.score, Matcher().score(
+            {"gpa": 3.9, "need_score": 8, "course": "Engineering"},
+            {"min_gpa": 2.0, "preferred_course": "Any"},
+        )[0])
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class MatchQueueTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.student = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+            self.donor = Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="Engineering", min_gpa=3.0)
+
+    def test_saves_enqueue_coalesced_jobs(self):
+        self.assertFalse(Match.objects.exists())
+        self.assertTrue(match_queue.has_pending_jobs(donor=self.donor))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.donor.min_gpa = 2.0
+            self.donor.save()
+        self.assertEqual(MatchJob.objects.filter(donor=self.donor).count(), 1)
+        self.assertEqual(MatchJob.objects.count(), 2)
+
+    def test_claimed_jobs_are_not_handed_out_twice(self):
+        first = match_queue.claim(limit=10)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(match_queue.claim(limit=10), [])
+
+        self.assertEqual(match_queue.process(first), 2)
+        self.assertFalse(MatchJob.objects.exists())
+        self.assertTrue(Match.objects.filter(student=self.student, donor=self.donor).exists())
+
+    def test_leases_are_renewed_while_a_batch_makes_progress(self):
+        for i in range(3):
+            Student.objects.create(student_number=f"S{i + 2}", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+        jobs = match_queue.claim(limit=10, lease_seconds=1)
+        leases = []
+
+        def renew(jobs, lease_seconds):
+            real_renew(jobs, lease_seconds)
+            leases.append(min(MatchJob.objects.filter(id__in=[job.id for job in jobs]).values_list("lease_expires_at", flat=True)))
+
+        real_renew = match_queue.renew
+        with mock.patch.object(match_queue, "renew", renew):
+            self.assertEqual(match_queue.process(jobs, matcher=Matcher(batch_size=2), lease_seconds=300), 2)
+        # donor job: 4 students in 2 blocks; student job: 1 block
+        self.assertEqual(len(leases), 3)
+        self.assertGreater(leases[0], timezone.now() + timedelta(seconds=250))
+
+    def test_register_message_depends_on_where_matching_runs(self):
+        def register(email):
+            response = self.client.post("/donor/register/", {
+                "name": "Acme", "donor_type": "corporate", "min_gpa": 2.5, "max_amount": 500, "wallet_balance": 0,
+                "email": email, "password": "pw",
+            }, follow=True)
+            return [str(m) for m in response.context["messages"]]
+
+        self.assertIn("being prepared", register("a@example.com")[0])
+        with override_settings(MATCHING_BACKGROUND_WORKER=False):
+            self.assertEqual(register("b@example.com"), ["Donor account created. Please log in."])
+
+    def test_failed_jobs_are_retried_then_parked(self):
+        job = MatchJob.objects.get(donor=self.donor)
+        job.attempts = 1
+        match_queue.fail(job, RuntimeError("boom"), max_attempts=2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "pending")
+        self.assertGreater(job.run_after, job.created_at)
+
+        job.attempts = 2
+        match_queue.fail(job, RuntimeError("boom"), max_attempts=2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.last_error, "boom")
+
+
+class DonorTopMatchesIndexTests(TestCase):
+    def test_dashboard_top_k_reads_from_index(self):
+        donor = Donor.objects.create(name="Acme", donor_type="corporate")
+        queryset = Match.objects.filter(donor=donor).select_related("student").order_by("-score")[:10]
+        plan = queryset.explain()
+        self.assertIn("match_donor_score_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class HotPathIndexTests(TestCase):
+    """Every query the dashboards run against the big tables must be an index search."""
+    HOT_TABLES = ("predictor_match", "predictor_transaction", "predictor_registrationflag", "predictor_universitypayment",
+                  "predictor_bursaryrequest", "predictor_accessrequest", "predictor_academicrecord")
+
+    def setUp(self):
+        caches["dashboard"].clear()
+        self.student_user = User.objects.create_user("student", password="pw")
+        self.donor_user = User.objects.create_user("donor", password="pw")
+        self.staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        self.student = Student.objects.create(user=self.student_user, student_number="S1", first_name="A", last_name="B",
+                                              gpa=3.5, course="ICT", need_score=7)
+        self.donor = Donor.objects.create(user=self.donor_user, name="Acme", donor_type="corporate", preferred_course="ICT",
+                                          wallet_balance=Decimal("1000.00"))
+        others = [Student.objects.create(student_number=f"O{i}", first_name="O", last_name=str(i)) for i in range(5)]
+        self.match = Match.objects.create(student=self.student, donor=self.donor, score=0.9)
+        for student in [self.student] + others:
+            BursaryRequest.objects.create(student=student, requested_amount=Decimal("50.00"))
+            RegistrationFlag.objects.create(student=student, flagged=True)
+            AccessRequest.objects.create(student=student, donor=self.donor)
+            UniversityPayment.objects.create(student=student, donor=self.donor, amount=10)
+        for _ in range(30):
+            wallet.fund_student(self.donor, self.student, 1)
+
+    def assert_index_searches(self, queries):
+        for query in queries:
+            if not query["sql"].startswith("SELECT"):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                table = next((t for t in self.HOT_TABLES if f" {t}" in step or f'"{t}"' in step), None)
+                if table is None:
+                    continue
+                self.assertFalse(step.startswith("SCAN") and "INDEX" not in step, f"Full scan of {table}: {plan}\n{query['sql']}")
+                self.assertNotIn("TEMP B-TREE", " ".join(plan), f"Sort without an index: {plan}\n{query['sql']}")
+
+    def get(self, user, url):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assert_index_searches(queries)
+        return response
+
+    def test_dashboards_use_indexes(self):
+        page = self.get(self.donor_user, "/donor/dashboard/")
+        self.get(self.donor_user, "/donor/dashboard/" + page.context["transactions"].next_url)
+        self.get(self.donor_user, "/transparency/")
+        page = self.get(self.student_user, "/student/wallet/")
+        self.get(self.student_user, "/student/wallet/" + page.context["transactions"].next_url)
+        self.get(self.student_user, "/student/profile/")
+        self.get(self.staff, "/admin/queue-alerts/")
+        self.get(self.staff, "/transparency/")
+
+    def test_funding_and_unrouted_view_lookups_use_indexes(self):
+        with CaptureQueriesContext(connection) as queries:
+            wallet.fund_match(self.donor, self.match, 5)
+            wallet.fund_matches(self.donor, [(self.match.id, 5)])
+            list(AccessRequest.objects.filter(student=self.student, status="pending").order_by("created_at"))
+            list(AcademicRecord.objects.filter(student=self.student).order_by("-uploaded_at"))
+        self.assert_index_searches(queries)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.student = Student.objects.create(student_number="S1", first_name="A", last_name="B")
+        # Several payments share a timestamp, so the id tie-breaker matters
+        base = timezone.now()
+        UniversityPayment.objects.bulk_create(
+            UniversityPayment(student=self.student, amount=i + 1, timestamp=base - timedelta(minutes=i // 3)) for i in range(25)
+        )
+        self.newest_first = list(UniversityPayment.objects.order_by("-timestamp", "-id").values_list("id", flat=True))
+
+    def test_walks_forward_and_back_without_gaps(self):
+        payments = UniversityPayment.objects.filter(student=self.student)
+        pages, cursor = [], None
+        while True:
+            page = keyset_page(payments, "timestamp", cursor, page_size=7)
+            pages.append([p.id for p in page])
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(sum(pages, []), self.newest_first)
+        self.assertEqual([len(p) for p in pages], [7, 7, 7, 4])
+
+        back = keyset_page(payments, "timestamp", page.prev_cursor, page_size=7)
+        self.assertEqual([p.id for p in back], pages[2])
+        self.assertTrue(back.has_prev and back.has_next)
+
+    def test_later_pages_use_the_index(self):
+        page = keyset_page(UniversityPayment.objects.all(), "timestamp", page_size=5)
+        for _ in range(3):
+            page = keyset_page(UniversityPayment.objects.all(), "timestamp", page.next_cursor, page_size=5)
+        with CaptureQueriesContext(connection) as queries:
+            keyset_page(UniversityPayment.objects.filter(student=self.student), "timestamp", page.next_cursor, page_size=5)
+        self.assertEqual(len(queries), 1)
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + queries[0]["sql"])
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertIn("payment_student_ts_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_views_page_through_their_lists(self):
+        staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        self.client.force_login(staff)
+        RegistrationFlag.objects.bulk_create(RegistrationFlag(student=self.student, semester="S1", flagged=True) for _ in range(30))
+        first = self.client.get("/admin/queue-alerts/")
+        self.assertEqual(len(first.context["flags"]), 24)
+        second = self.client.get("/admin/queue-alerts/" + first.context["flags"].next_url)
+        self.assertEqual(len(second.context["flags"]), 6)
+        self.assertFalse(second.context["flags"].has_next)
+        self.assertEqual(self.client.get("/admin/queue-alerts/?cursor=garbage").status_code, 200)
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class ExportTests(TestCase):
+    def setUp(self):
+        self.students = [Student.objects.create(student_number=f"S{i}", first_name="A", last_name="B") for i in range(2)]
+        self.donor = Donor.objects.create(name="Acme, Inc.", donor_type="corporate")
+        now = timezone.now()
+        for i in range(6):
+            UniversityPayment.objects.create(student=self.students[i % 2], donor=self.donor if i % 3 else None,
+                                             amount=Decimal("10.50") * (i + 1), timestamp=now - timedelta(days=i))
+        self.today = timezone.localdate(now)
+
+    def test_streamed_csv_with_filters(self):
+        staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        self.client.force_login(staff)
+        start = (self.today - timedelta(days=3)).isoformat()
+        response = self.client.get(f"/exports/payments/?start={start}&end={self.today}&student={self.students[1].id}")
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:4], ["id", "timestamp", "student_id", "student__student_number"])
+        self.assertEqual([r[6] for r in rows[1:]], ["21.00", "42.00"])
+        self.assertEqual(rows[1][5], "Acme, Inc.")
+
+        self.assertEqual(self.client.get("/exports/payments/?start=yesterday").status_code, 400)
+        self.assertEqual(self.client.get("/exports/ledger/").status_code, 400)
+        self.client.logout()
+        self.client.force_login(User.objects.create_user("someone", password="pw"))
+        self.assertEqual(self.client.get("/exports/payments/").status_code, 403)
+
+    def test_command_streams_ndjson(self):
+        out = StringIO()
+        call_command("export_history", "payments", "--format", "ndjson", f"--donor={self.donor.id}", stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r["amount"] for r in records], ["21.00", "31.50", "52.50", "63.00"])
+        self.assertTrue(all(r["donor__name"] == "Acme, Inc." for r in records))
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class RegistrationAlertsApiTests(TestCase):
+    def setUp(self):
+        self.students = [
+            Student.objects.create(student_number=f"S{i}", first_name="Ann", last_name=f"B{i}", course="ICT", registration_paid=i % 4 == 0)
+            for i in range(12)
+        ]
+
+    def test_pages_through_unpaid_students(self):
+        ids, url = [], "/api/registration-alerts/?limit=4"
+        while url:
+            body = self.client.get(url).json()
+            ids += [s["id"] for s in body["unpaid_students"]]
+            url = body["next_cursor"] and f"/api/registration-alerts/?limit=4&cursor={body['next_cursor']}"
+        self.assertEqual(ids, [s.id for s in self.students if not s.registration_paid])
+        self.assertEqual(self.client.get("/api/registration-alerts/").json()["unpaid_students"][0]["name"], "Ann B1")
+        self.assertEqual(self.client.get("/api/registration-alerts/?cursor=garbage").status_code, 400)
+
+    def test_unpaid_page_uses_partial_index(self):
+        page = Student.objects.filter(registration_paid=False, updated_at__gt=timezone.now()).order_by("updated_at", "id")[:10]
+        plan = page.explain()
+        self.assertIn("student_unpaid_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_etag_and_since(self):
+        first = self.client.get("/api/registration-alerts/")
+        self.assertEqual(self.client.get("/api/registration-alerts/", HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+        watermark = first.json()["watermark"]
+
+        self.students[1].registration_paid = True
+        self.students[1].save()
+        self.students[2].course = "Law"
+        self.students[2].save()
+        self.assertEqual(self.client.get("/api/registration-alerts/", HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 200)
+        changes = self.client.get(f"/api/registration-alerts/?since={watermark}").json()
+        self.assertEqual([s["course"] for s in changes["unpaid_students"]], ["Law"])
+        self.assertEqual(changes["resolved"], [self.students[1].id])
+        self.assertEqual(self.client.get("/api/registration-alerts/?since=yesterday").status_code, 400)
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class QueueAlertStreamTests(TestCase):
+    def setUp(self):
+        self.student = Student.objects.create(student_number="S1", first_name="Ann", last_name="Bee")
+        self.start = alert_feed.publish({"event": "marker"})["id"]
+
+    def test_flag_changes_are_published_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            flag = RegistrationFlag.objects.create(student=self.student, semester="S1", flagged=True, flagged_reason="Unpaid")
+            self.assertEqual(alert_feed.recent(self.start), [])
+        flag = RegistrationFlag.objects.get(pk=flag.pk)
+        flag.semester = "S2"
+        with self.captureOnCommitCallbacks(execute=True):
+            flag.save()  # still flagged: nothing to push
+        flag.flagged = False
+        with self.captureOnCommitCallbacks(execute=True):
+            flag.save()
+        events = alert_feed.recent(self.start)
+        self.assertEqual([(e["event"], e["flag_id"]) for e in events], [("new", flag.pk), ("resolved", flag.pk)])
+        self.assertEqual(events[0]["name"], "Ann Bee")
+
+    def test_bursary_payment_resolves_flag(self):
+        donor = Donor.objects.create(name="Acme", donor_type="corporate", wallet_balance=Decimal("100.00"))
+        bursary = BursaryRequest.objects.create(student=self.student, requested_amount=Decimal("50.00"), priority="registration_fee")
+        flag = RegistrationFlag.objects.create(student=self.student, flagged=True)
+        start = alert_feed.recent()[-1]["id"]
+        with self.captureOnCommitCallbacks(execute=True):
+            wallet.fund_bursary(donor, bursary, 50)
+        self.assertEqual([(e["event"], e["flag_id"]) for e in alert_feed.recent(start)], [("resolved", flag.pk)])
+
+    def test_stream_replays_missed_events_then_pushes_live_ones(self):
+        missed = alert_feed.publish({"event": "new", "flag_id": 1})
+        staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        request = AsyncRequestFactory().get("/admin/queue-alerts/stream/", headers={"Last-Event-ID": str(self.start)})
+        request.user = staff
+
+        async def user():
+            return staff
+        request.auser = user
+
+        async def read():
+            response = await views.queue_alerts_stream(request)
+            chunks = aiter(response.streaming_content)
+            received = [await anext(chunks), await anext(chunks)]
+            self.assertEqual(alert_feed.subscriber_count(), 1)
+            threading.Thread(target=alert_feed.publish, args=({"event": "resolved", "flag_id": 1},)).start()
+            received.append(await asyncio.wait_for(anext(chunks), 5))
+            await chunks.aclose()
+            return [c.decode() if isinstance(c, bytes) else c for c in received]
+
+        retry, replayed, live = asyncio.run(read())
+        self.assertEqual(retry, "retry: 5000\n\n")
+        self.assertTrue(replayed.startswith(f"id: {missed['id']}\nevent: new\n"))
+        self.assertIn("event: resolved", live)
+        self.assertEqual(alert_feed.subscriber_count(), 0)
+
+    def test_idle_stream_sends_heartbeats(self):
+        async def first():
+            events = alert_feed.listen(heartbeat=0.01)
+            event = await anext(events)
+            await events.aclose()
+            return event
+        self.assertIsNone(asyncio.run(first()))
+
+    def test_slow_subscriber_is_closed_after_queue_size_events(self):
+        async def read():
+            events = alert_feed.listen(heartbeat=1)
+            first = asyncio.ensure_future(anext(events))
+            await asyncio.sleep(0)  # subscribed, waiting for an event
+            for i in range(alert_feed.QUEUE_SIZE + 5):
+                alert_feed.publish({"event": "new", "flag_id": i})
+
+            async def drain():
+                return [await first] + [event async for event in events]
+            return await asyncio.wait_for(drain(), 5)  # the stream ends instead of idling
+
+        with mock.patch.object(alert_feed, "QUEUE_SIZE", 3):
+            received = asyncio.run(read())
+        self.assertEqual([e["flag_id"] for e in received], [0, 1, 2])
+        self.assertEqual(alert_feed.subscriber_count(), 0)
+
+    def test_stream_is_staff_only(self):
+        self.client.force_login(User.objects.create_user("someone", password="pw"))
+        self.assertEqual(self.client.get("/admin/queue-alerts/stream/").status_code, 403)
+
+    def test_wsgi_does_not_stream_and_page_polls(self):
+        self.client.force_login(User.objects.create_user("staff", password="pw", is_staff=True))
+        self.assertEqual(self.client.get("/admin/queue-alerts/stream/").status_code, 204)
+        page = self.client.get("/admin/queue-alerts/")
+        self.assertNotContains(page, "EventSource(")
+        self.assertContains(page, "location.reload()")
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class MatchScoreApiTests(TestCase):
+    def setUp(self):
+        self.students = [Student.objects.create(student_number=f"S{i}", first_name="A", last_name="B", gpa=2 + i / 2,
+                                                course="Engineering", need_score=8) for i in range(4)]
+        self.donors = [Donor.objects.create(name=f"D{i}", donor_type="corporate", preferred_course=c, min_gpa=2.5)
+                       for i, c in enumerate(["Engineering", "Law", None])]
+
+    def post(self, body):
+        return self.client.post("/api/match-score/batch/", json.dumps(body), content_type="application/json")
+
+    def test_scores_pairs_in_request_order_with_two_queries(self):
+        pairs = [(s.id, d.id) for d in reversed(self.donors) for s in self.students] + [(999, self.donors[0].id)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post({"pairs": [{"student_id": s, "donor_id": d} for s, d in pairs]})
+            body = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(body["matcher"], "heuristic")
+        self.assertEqual([(r["student_id"], r["donor_id"]) for r in body["scores"]], pairs)
+        self.assertEqual(body["scores"][-1]["error"], "Unknown student")
+
+        matcher = Matcher()
+        for result in body["scores"][:-1]:
+            student = Student.objects.get(pk=result["student_id"])
+            donor = Donor.objects.get(pk=result["donor_id"])
+            expected = matcher.score({"gpa": student.gpa, "course": student.course, "need_score": student.need_score},
+                                     {"preferred_course": donor.preferred_course, "min_gpa": donor.min_gpa})
+            self.assertEqual((result["match_score"], result["explanation"]), expected)
+
+    def test_one_student_against_many_donors(self):
+        body = json.loads(b"".join(self.post({"student_id": self.students[3].id, "donor_ids": [d.id for d in self.donors]}).streaming_content))
+        self.assertEqual([r["donor_id"] for r in body["scores"]], [d.id for d in self.donors])
+        self.assertGreater(body["scores"][0]["match_score"], body["scores"][1]["match_score"])
+
+        single = self.client.post("/api/match-score/", json.dumps({"student_id": self.students[3].id, "donor_id": self.donors[0].id}),
+                                  content_type="application/json")
+        self.assertEqual(single.json()["match_score"], body["scores"][0]["match_score"])
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.post({"pairs": [], "matcher": "magic"}).status_code, 400)
+        self.assertEqual(self.post({"student_id": 1}).status_code, 400)
+        self.assertEqual(self.client.get("/api/match-score/batch/").status_code, 405)
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class AsyncApiTests(TestCase):
+    def setUp(self):
+        self.student = Student.objects.create(student_number="S1", first_name="Ann", last_name="Bee", gpa=3.5, course="ICT", need_score=7)
+        self.donor = Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="ICT", min_gpa=3.0,
+                                          wallet_balance=Decimal("100.00"))
+        self.bursary = BursaryRequest.objects.create(student=self.student, requested_amount=Decimal("80.00"))
+
+    async def test_match_score_matches_sync_view(self):
+        body = json.dumps({"student_id": self.student.id, "donor_id": self.donor.id})
+        sync = await sync_to_async(self.client.post)("/api/match-score/", body, content_type="application/json")
+        response = await self.async_client.post("/api/async/match-score/", body, content_type="application/json")
+        self.assertEqual(response.json(), sync.json())
+        missing = await self.async_client.post("/api/async/match-score/", "{}", content_type="application/json")
+        self.assertEqual(missing.status_code, 400)
+
+    async def test_fund_student(self):
+        def fund(amount, client=None):
+            body = json.dumps({"bursary_id": self.bursary.id, "donor_id": self.donor.id, "amount": amount})
+            return (client or self.async_client).post("/api/async/fund/", body, content_type="application/json")
+
+        self.assertEqual((await fund(80)).status_code, 401)
+        user = await User.objects.acreate_user("acme", password="pw")
+        await Donor.objects.filter(pk=self.donor.pk).aupdate(user=user)
+        csrf_client = self.async_client_class(enforce_csrf_checks=True)
+        await csrf_client.aforce_login(user)
+        self.assertEqual((await fund(80, csrf_client)).status_code, 403)
+
+        await self.async_client.aforce_login(user)
+        self.assertEqual((await fund(-5000)).status_code, 400)
+        self.assertEqual((await fund(500)).status_code, 409)
+        response = await fund(80)
+        self.assertEqual(response.json()["bursary_status"], "fully funded")
+        donor = await Donor.objects.aget(pk=self.donor.pk)
+        self.assertEqual(donor.wallet_balance, Decimal("20.00"))
+
+    async def test_fund_student_needs_a_donor_account(self):
+        other = await User.objects.acreate_user("someone", password="pw")
+        await self.async_client.aforce_login(other)
+        body = json.dumps({"bursary_id": self.bursary.id, "donor_id": self.donor.id, "amount": 80})
+        response = await self.async_client.post("/api/async/fund/", body, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual((await Donor.objects.aget(pk=self.donor.pk)).wallet_balance, Decimal("100.00"))
+
+    async def test_registration_alerts_match_sync_view(self):
+        sync = await sync_to_async(self.client.get)("/api/registration-alerts/?limit=1")
+        response = await self.async_client.get("/api/async/registration-alerts/?limit=1")
+        self.assertEqual(response.json(), sync.json())
+        not_modified = await self.async_client.get("/api/async/registration-alerts/?limit=1", headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(not_modified.status_code, 304)
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True, METRICS_SAMPLE_RATE=1.0)
+class MetricsTests(TestCase):
+    def setUp(self):
+        for metric in metrics.REGISTRY:
+            metric.clear()
+        self.student = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.5, course="ICT", need_score=7)
+        self.donor = Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="ICT", min_gpa=3.0)
+
+    def test_sampled_requests_record_latency_and_queries(self):
+        body = json.dumps({"student_id": self.student.id, "donor_id": self.donor.id})
+        self.client.post("/api/match-score/", body, content_type="application/json")
+        self.assertEqual(metrics.request_duration.count(view="api_match_score", method="POST"), 1)
+        self.assertEqual(metrics.request_queries.total(view="api_match_score"), 2)
+
+        async def post_async():
+            await self.async_client.post("/api/async/match-score/", body, content_type="application/json")
+        async_to_sync(post_async)()
+        self.assertEqual(metrics.request_queries.total(view="api_async_match_score"), 2)
+
+        with override_settings(METRICS_SAMPLE_RATE=0):
+            self.client.post("/api/match-score/", body, content_type="application/json")
+        self.assertEqual(metrics.request_duration.count(view="api_match_score", method="POST"), 1)
+
+    def test_flags_repeated_query_shapes(self):
+        stats, token = metrics.begin_request()
+        for i in range(3):
+            list(Student.objects.filter(pk__in=range(i + 1)))  # IN lists of any length share a shape
+        metrics.end_request(stats, token, "batched", "GET")
+        self.assertEqual(metrics.n_plus_one.value(view="batched"), 0)
+
+        stats, token = metrics.begin_request()
+        with self.assertLogs("predictor.metrics", "WARNING"):
+            for i in range(10):
+                Student.objects.filter(pk=i).exists()
+            metrics.end_request(stats, token, "looped", "GET")
+        self.assertEqual(metrics.n_plus_one.value(view="looped"), 1)
+        self.assertEqual(len(stats.shapes), 1)
+
+    def test_matching_counters_and_endpoint(self):
+        Donor.objects.create(name="Other", donor_type="ngo", min_gpa=2.0)
+        Matcher().generate_for_students([self.student.id])
+        self.assertEqual(metrics.pairs_scored.value(matcher="heuristic"), 2)
+
+        with override_settings(METRICS_TOKEN="s3cret"):
+            text = self.client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).content.decode()
+            self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer guess"}).status_code, 404)
+        self.assertIn('fundforward_match_pairs_scored_total{matcher="heuristic"} 2', text)
+        self.assertIn("# TYPE fundforward_request_duration_seconds histogram", text)
+        # Loopback is not trusted by default: behind a proxy every request would come from it
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="127.0.0.1").status_code, 404)
+        with override_settings(METRICS_ALLOWED_IPS=["10.0.0.9"]):
+            self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.0.0.9").status_code, 200)
+        self.client.force_login(User.objects.create_user("staff", password="pw", is_staff=True))
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+
+class CourseIndexTests(TestCase):
+    def test_courses_are_normalised_and_indexed_on_save(self):
+        civil = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.0, course=" Civil  Engineering")
+        nurse = Student.objects.create(student_number="S2", first_name="C", last_name="D", gpa=3.0, course="Nursing")
+        donor = Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="engineering, Law")
+
+        self.assertEqual(Student.objects.get(pk=civil.pk).course_ref.name, "civil engineering")
+        self.assertEqual(sorted(donor.preferred_courses.values_list("name", flat=True)), ["engineering", "law"])
+        self.assertEqual(list(candidate_students(donor)), [civil])
+        self.assertEqual(list(candidate_donors(civil)), [donor])
+        self.assertEqual(list(candidate_donors(nurse)), [])
+
+        donor.preferred_course = "Any"
+        donor.save()
+        self.assertFalse(donor.preferred_courses.exists())
+        self.assertEqual(set(candidate_students(donor)), {civil, nurse})
+
+
+class BatchInferenceTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from sklearn.ensemble import RandomForestClassifier
+        from .ml import train_synthetic
+
+        pairs = train_synthetic.make_pairs(train_synthetic.gen_students(50), train_synthetic.gen_donors(20), n_pairs=300)
+        X = train_synthetic.fe(pairs.drop(columns=["label"]))
+        model = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, pairs["label"])
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.model_path = os.path.join(cls.tmpdir.name, "matching_model.joblib")
+        joblib.dump({"model": model, "columns": X.columns.tolist()}, cls.model_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+        super().tearDownClass()
+
+    def test_score_many_matches_single_row_prepare(self):
+        from .ml.model_utils import Matcher as MLMatcher
+
+        ml = MLMatcher(self.model_path)
+        students = [
+            {"gpa": 3.4, "need_score": 0.3, "course": "Engineering"},
+            {"gpa": 1.9, "need_score": 0.8, "course": "Health"},
+            {"gpa": 2.5, "course": None},
+        ]
+        donors = [
+            {"donor_type": "corporate", "preferred_course": "Engineering", "min_gpa": 2.0, "max_amount": 5000},
+            {"donor_type": "ngo", "preferred_course": "Any", "min_gpa": 3.0},
+        ]
+        scores = ml.score_many(students, donors, batch_size=4)
+
+        for i, student in enumerate(students):
+            for j, donor in enumerate(donors):
+                expected = ml.model.predict_proba(ml.prepare(student, donor))[0][1]
+                self.assertAlmostEqual(scores[i, j], expected)
+                self.assertAlmostEqual(ml.score(student, donor), expected)
+
+    def test_model_matcher_rematch_in_process_pool(self):
+        Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=0.4)
+        Student.objects.create(student_number="S2", first_name="C", last_name="D", gpa=1.2, course="Health", need_score=0.9)
+        Donor.objects.create(name="Acme", donor_type="corporate", preferred_course="Engineering", min_gpa=3.0)
+
+        matcher = ModelMatcher(min_threshold=0.0, batch_size=1, model_path=self.model_path)
+        self.assertEqual(matcher.generate_for_all(workers=2), 2)
+        for match in Match.objects.select_related("student", "donor"):
+            expected = matcher._model().score(
+                {"gpa": match.student.gpa, "need_score": match.student.need_score, "course": match.student.course},
+                {"donor_type": "corporate", "preferred_course": "Engineering", "min_gpa": 3.0, "max_amount": 5000},
+            )
+            self.assertEqual(match.score, round(expected, 3))
+
+    def test_batch_api_scores_with_ml_matcher(self):
+        from .ml import model_utils
+
+        student = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=0.4)
+        donors = [Donor.objects.create(name=f"D{i}", donor_type="corporate", preferred_course=c, min_gpa=3.0)
+                  for i, c in enumerate(["Engineering", None])]
+        body = {"student_id": student.id, "donor_ids": [d.id for d in donors], "matcher": "ml"}
+        with mock.patch.object(model_utils, "MODEL_PATH", self.model_path):
+            response = self.client.post("/api/match-score/batch/", json.dumps(body), content_type="application/json")
+            scores = json.loads(b"".join(response.streaming_content))["scores"]
+
+        ml = model_utils.Matcher(self.model_path)
+        for result, donor in zip(scores, donors):
+            expected = ml.score(
+                {"gpa": 3.6, "need_score": 0.4, "course": "Engineering"},
+                {"donor_type": "corporate", "preferred_course": donor.preferred_course or "Any", "min_gpa": 3.0, "max_amount": 0},
+            )
+            self.assertEqual(result["match_score"], round(expected, 3))
+            self.assertEqual(result["explanation"], {"model_version": ml.version})
+
+    def test_registry_caches_and_hot_reloads(self):
+        from .ml.model_utils import Matcher as MLMatcher, get_registry
+
+        path = os.path.join(self.tmpdir.name, "reload.joblib")
+        data = joblib.load(self.model_path)
+        joblib.dump(data, path)
+        registry = get_registry(path)
+        registry.check_interval = 0
+
+        first = MLMatcher(path)
+        self.assertIs(MLMatcher(path).model, first.model)
+        self.assertEqual(registry.loads, 1)
+        with open(path, "rb") as f, mock.patch("predictor.ml.model_utils.HASH_CHUNK_SIZE", 7):
+            self.assertEqual(registry._file_version(), hashlib.sha256(f.read()).hexdigest()[:12])
+        self.assertEqual(first.version, registry._file_version())
+
+        data["columns"] = list(data["columns"])
+        data["retrained"] = True
+        joblib.dump(data, path)
+        os.utime(path, ns=(1, 1))
+        second = MLMatcher(path)
+        self.assertEqual(registry.loads, 2)
+        self.assertNotEqual(second.version, first.version)
+        self.assertEqual(registry.stats()["version"], second.version)
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class WalletTests(TestCase):
+    def setUp(self):
+        self.student = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+        self.donor = Donor.objects.create(name="Acme", donor_type="corporate", wallet_balance=Decimal("100.00"))
+
+    def test_fund_match_fulfils_registration_fee(self):
+        match = Match.objects.create(student=self.student, donor=self.donor, score=0.9)
+        bursary = BursaryRequest.objects.create(student=self.student, requested_amount=Decimal("60.00"))
+        RegistrationFlag.objects.create(student=self.student, flagged=True)
+
+        tx = wallet.fund_match(self.donor, match, 60)
+
+        self.assertEqual(self.donor.wallet_balance, Decimal("40.00"))
+        self.assertEqual(tx.bursary_request, bursary)
+        self.assertTrue(Match.objects.get(pk=match.pk).funded)
+        self.assertTrue(BursaryRequest.objects.get(pk=bursary.pk).fulfilled)
+        self.assertTrue(Student.objects.get(pk=self.student.pk).registration_paid)
+        self.assertFalse(RegistrationFlag.objects.filter(student=self.student, flagged=True).exists())
+
+    def test_overdraft_changes_nothing(self):
+        with self.assertRaises(wallet.InsufficientFunds):
+            wallet.fund_student(self.donor, self.student, "100.01")
+        with self.assertRaises(wallet.InsufficientFunds):
+            wallet.top_up(self.donor, -101)
+        self.assertEqual(Donor.objects.get(pk=self.donor.pk).wallet_balance, Decimal("100.00"))
+        self.assertEqual(Student.objects.get(pk=self.student.pk).wallet_balance, Decimal("0.00"))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_fund_bursary_in_parts(self):
+        bursary = BursaryRequest.objects.create(student=self.student, requested_amount=Decimal("80.00"))
+        self.assertEqual(wallet.fund_bursary(self.donor, bursary, 50)[1], False)
+        self.assertEqual(wallet.fund_bursary(self.donor, bursary, 30)[1], True)
+        self.assertEqual(self.donor.wallet_balance, Decimal("20.00"))
+
+    def test_non_finite_amounts_are_rejected(self):
+        for amount in ("NaN", "sNaN", "Infinity", "-Infinity"):
+            with self.assertRaises(ValueError):
+                wallet.to_amount(amount)
+        user = User.objects.create_user("acme", password="pw")
+        Donor.objects.filter(pk=self.donor.pk).update(user=user)
+        self.client.force_login(user)
+        match = Match.objects.create(student=self.student, donor=self.donor, score=0.9)
+        for amount in ("NaN", "Infinity"):
+            self.assertEqual(self.client.post("/donor/wallet/", {"amount": amount}).status_code, 302)
+            self.assertEqual(self.client.post(f"/donor/fund/{match.id}/", {"amount": amount}).status_code, 302)
+        self.assertEqual(Donor.objects.get(pk=self.donor.pk).wallet_balance, Decimal("100.00"))
+
+    def test_payments_must_be_positive(self):
+        match = Match.objects.create(student=self.student, donor=self.donor, score=0.9)
+        bursary = BursaryRequest.objects.create(student=self.student, requested_amount=Decimal("80.00"))
+        for amount in (0, -5000):
+            with self.assertRaises(ValueError):
+                wallet.fund_match(self.donor, match, amount)
+            with self.assertRaises(ValueError):
+                wallet.fund_student(self.donor, self.student, amount)
+            with self.assertRaises(ValueError):
+                wallet.fund_bursary(self.donor, bursary, amount)
+        self.assertEqual(Donor.objects.get(pk=self.donor.pk).wallet_balance, Decimal("100.00"))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_fund_api_spends_only_the_logged_in_donors_wallet(self):
+        bursary = BursaryRequest.objects.create(student=self.student, requested_amount=Decimal("80.00"))
+        other = Donor.objects.create(name="Other", donor_type="ngo", wallet_balance=Decimal("10.00"))
+        body = json.dumps({"bursary_id": bursary.id, "donor_id": other.id, "amount": 80})
+        self.assertEqual(self.client.post("/api/fund/", body, content_type="application/json").status_code, 401)
+
+        self.client.force_login(User.objects.create_user("someone", password="pw"))
+        self.assertEqual(self.client.post("/api/fund/", body, content_type="application/json").status_code, 403)
+
+        user = User.objects.create_user("acme", password="pw")
+        Donor.objects.filter(pk=self.donor.pk).update(user=user)
+        csrf_client = self.client_class(enforce_csrf_checks=True)
+        csrf_client.force_login(user)
+        self.assertEqual(csrf_client.post("/api/fund/", body, content_type="application/json").status_code, 403)
+
+        self.client.force_login(user)
+        negative = json.dumps({"bursary_id": bursary.id, "amount": -5000})
+        self.assertEqual(self.client.post("/api/fund/", negative, content_type="application/json").status_code, 400)
+        response = self.client.post("/api/fund/", body, content_type="application/json")
+        self.assertEqual(response.json()["bursary_status"], "fully funded")
+        self.assertEqual(Donor.objects.get(pk=self.donor.pk).wallet_balance, Decimal("20.00"))
+        self.assertEqual(Donor.objects.get(pk=other.pk).wallet_balance, Decimal("10.00"))
+        self.assertEqual(Donor.objects.get(pk=other.pk).csr_score, 0)
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class BulkFundTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("acme", password="pw")
+        self.donor = Donor.objects.create(user=self.user, name="Acme", donor_type="corporate", wallet_balance=Decimal("10000.00"))
+        self.client.force_login(self.user)
+        self.matches = []
+        for i in range(12):
+            student = Student.objects.create(student_number=f"S{i}", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+            BursaryRequest.objects.create(student=student, requested_amount=Decimal("100.00"))
+            RegistrationFlag.objects.create(student=student, flagged=True)
+            self.matches.append(Match.objects.create(student=student, donor=self.donor, score=0.9))
+
+    def fund(self, matches, amount=100):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/fund/bulk/", json.dumps({
+                "items": [{"match_id": m.id, "amount": amount} for m in matches],
+            }), content_type="application/json")
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_items(self):
+        response, few = self.fund(self.matches[:2])
+        self.assertEqual(response.status_code, 200)
+        response, many = self.fund(self.matches[2:], amount=150)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(few, many)
+        self.assertEqual(response.json()["total"], "1500.00")
+
+        self.donor.refresh_from_db()
+        self.assertEqual(self.donor.wallet_balance, Decimal("8300.00"))
+        self.assertEqual(self.donor.csr_score, 12)
+        self.assertEqual(Transaction.objects.filter(donor=self.donor, bursary_request__isnull=False).count(), 12)
+        self.assertEqual(Match.objects.filter(funded=True).count(), 12)
+        self.assertFalse(BursaryRequest.objects.filter(fulfilled=False).exists())
+        self.assertEqual(Student.objects.filter(registration_paid=True).count(), 12)
+        self.assertFalse(RegistrationFlag.objects.filter(flagged=True).exists())
+
+    def test_nothing_is_funded_unless_everything_is(self):
+        Donor.objects.filter(pk=self.donor.pk).update(wallet_balance=Decimal("1000.00"))
+        response, _ = self.fund(self.matches, amount=100)
+        self.assertEqual(response.status_code, 409)
+        other = Donor.objects.create(name="Other", donor_type="ngo")
+        foreign = Match.objects.create(student=self.matches[0].student, donor=other, score=0.9)
+        response, _ = self.fund([self.matches[1], foreign])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(Match.objects.filter(funded=True).exists())
+        self.assertEqual(Donor.objects.get(pk=self.donor.pk).wallet_balance, Decimal("1000.00"))
+
+    def test_only_the_logged_in_donor_can_spend_their_wallet(self):
+        body = json.dumps({"items": [{"match_id": self.matches[0].id, "amount": 100}]})
+        self.client.logout()
+        self.assertEqual(self.client.post("/api/fund/bulk/", body, content_type="application/json").status_code, 401)
+
+        self.client.force_login(User.objects.create_user("someone", password="pw"))
+        self.assertEqual(self.client.post("/api/fund/bulk/", body, content_type="application/json").status_code, 403)
+
+        csrf_client = self.client_class(enforce_csrf_checks=True)
+        csrf_client.force_login(self.user)
+        self.assertEqual(csrf_client.post("/api/fund/bulk/", body, content_type="application/json").status_code, 403)
+
+        # A donor_id in the body does not pick the wallet
+        other = Donor.objects.create(name="Other", donor_type="ngo", wallet_balance=Decimal("10000.00"))
+        self.client.force_login(self.user)
+        response = self.client.post("/api/fund/bulk/", json.dumps({"donor_id": other.id, **json.loads(body)}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Donor.objects.get(pk=other.pk).wallet_balance, Decimal("10000.00"))
+        self.assertEqual(Donor.objects.get(pk=self.donor.pk).wallet_balance, Decimal("9900.00"))
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.student = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+        self.donor = Donor.objects.create(name="Acme", donor_type="corporate", wallet_balance=Decimal("100.00"))
+        wallet.open_wallet(self.donor)
+
+    def test_every_wallet_change_is_an_entry(self):
+        wallet.top_up(self.donor, 50)
+        wallet.top_up(self.donor, -30)
+        tx = wallet.fund_student(self.donor, self.student, 20)
+        self.assertEqual(
+            list(LedgerEntry.objects.order_by("id").values_list("kind", "amount", "transaction")),
+            [("opening", Decimal("100.00"), None), ("top_up", Decimal("50.00"), None), ("withdrawal", Decimal("-30.00"), None),
+             ("debit", Decimal("-20.00"), tx.id), ("credit", Decimal("20.00"), tx.id)],
+        )
+        self.assertEqual(ledger.balance(self.donor), Decimal("100.00"))
+        self.assertEqual(ledger.balance(self.student), Decimal("20.00"))
+        entry = LedgerEntry.objects.first()
+        entry.amount = 0
+        with self.assertRaises(ValueError):
+            entry.save()
+
+    def test_wallets_with_history_cannot_be_deleted(self):
+        wallet.fund_student(self.donor, self.student, 10)
+        ledger.compact(grace_seconds=0)
+        entries = LedgerEntry.objects.count()
+        with self.assertRaises(ProtectedError):
+            self.donor.delete()
+        with self.assertRaises(ProtectedError):
+            self.student.delete()
+        self.assertEqual(LedgerEntry.objects.count(), entries)
+        self.assertEqual(WalletSnapshot.objects.count(), 2)
+
+    def test_compaction_makes_reads_constant(self):
+        for _ in range(5):
+            wallet.fund_student(self.donor, self.student, 10)
+        self.assertEqual(ledger.compact(grace_seconds=0), 2)
+        self.assertEqual(ledger.compact(grace_seconds=0), 0)
+        wallet.top_up(self.donor, 5)
+        self.assertEqual(ledger.compact(grace_seconds=0), 1)
+        self.assertEqual(WalletSnapshot.objects.filter(donor=self.donor).count(), 1)
+        with self.assertNumQueries(2):
+            self.assertEqual(ledger.balance(self.donor), Decimal("55.00"))
+        self.assertEqual(ledger.balance(self.student), Decimal("50.00"))
+        self.assertEqual(list(ledger.audit()), [])
+
+    def test_audit_reports_out_of_band_changes(self):
+        wallet.top_up(self.donor, 50)
+        ledger.compact(grace_seconds=0)
+        Donor.objects.filter(pk=self.donor.pk).update(wallet_balance=Decimal("1.00"))
+        WalletSnapshot.objects.filter(donor=self.donor).update(balance=Decimal("2.00"))
+        problems = {(p["check"], p["recorded"], p["ledger"]) for p in ledger.audit(chunk_size=1)}
+        self.assertEqual(problems, {("snapshot", Decimal("2.00"), Decimal("150.00")), ("balance", Decimal("1.00"), Decimal("150.00"))})
+
+    def test_reconcile_compares_wallet_balances_with_the_ledger(self):
+        other = Donor.objects.create(name="Other", donor_type="ngo")
+        wallet.top_up(self.donor, 50)
+        ledger.compact(grace_seconds=0)
+        wallet.fund_student(self.donor, self.student, 20)  # after the snapshot
+        wallet.top_up(other, 5)  # no snapshot yet
+        self.assertEqual(list(ledger.reconcile(chunk_size=1)), [])
+
+        Donor.objects.filter(pk=other.pk).update(wallet_balance=Decimal("7.00"))
+        Student.objects.filter(pk=self.student.pk).update(wallet_balance=Decimal("0.00"))
+        self.assertEqual(
+            {(p["wallet"], p["id"], p["recorded"], p["ledger"]) for p in ledger.reconcile()},
+            {("donor", other.id, Decimal("7.00"), Decimal("5.00")), ("student", self.student.id, Decimal("0.00"), Decimal("20.00"))},
+        )
+        with self.assertRaises(CommandError):
+            call_command("reconcile_ledger", stdout=StringIO())
+
+    def test_admin_tops_up_through_the_ledger(self):
+        self.client.force_login(User.objects.create_superuser("admin", password="pw"))
+        page = self.client.get(f"/admin/predictor/donor/{self.donor.pk}/change/")
+        self.assertNotContains(page, 'name="wallet_balance"')
+        self.client.post("/admin/predictor/donor/", {
+            "action": "top_up_wallets", "_selected_action": [self.donor.pk], "amount": "25.00",
+        })
+        self.assertEqual(Donor.objects.get(pk=self.donor.pk).wallet_balance, Decimal("125.00"))
+        self.assertEqual(ledger.balance(self.donor), Decimal("125.00"))
+        self.assertEqual(list(ledger.reconcile()), [])
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class FundingRollupTests(TestCase):
+    def setUp(self):
+        caches["dashboard"].clear()
+        self.students = [
+            Student.objects.create(student_number=f"S{i}", first_name="Stu", last_name=str(i), gpa=3.0, course="ICT")
+            for i in range(3)
+        ]
+        self.donors = [Donor.objects.create(name=f"Donor {i}", donor_type="ngo") for i in range(2)]
+        self.day = timezone.now() - timedelta(days=3)
+
+    def pay(self, n, start=0):
+        for i in range(start, start + n):
+            with self.captureOnCommitCallbacks(execute=True):
+                UniversityPayment.objects.create(
+                    student=self.students[i % 3], donor=self.donors[i % 2] if i % 5 else None,
+                    amount=Decimal("10.00") * (i + 1), approved=i % 4 != 0, timestamp=self.day + timedelta(days=i % 3),
+                )
+
+    def rollup_rows(self):
+        return sorted(FundingRollup.objects.filter(payments__gt=0).values_list(
+            "scope", "day", "donor_key", "student_key", "amount", "approved_amount", "payments"))
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        self.pay(10)
+        payment = UniversityPayment.objects.only("id", "amount").order_by("id")[3]
+        payment.amount = Decimal("1.00")
+        payment.save()
+        payment = UniversityPayment.objects.order_by("id")[4]
+        payment.approved, payment.donor, payment.timestamp = False, self.donors[1], self.day - timedelta(days=1)
+        payment.save()
+        UniversityPayment.objects.order_by("id")[5].delete()
+
+        incremental = self.rollup_rows()
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), incremental)
+
+        approved = UniversityPayment.objects.filter(approved=True).aggregate(total=Sum("amount"))["total"]
+        self.assertEqual(rollups.dashboard_totals()["total_funded"], approved)
+        per_donor = {d["id"]: d["total"] for d in rollups.dashboard_totals(student=self.students[0])["donors"]}
+        expected = dict(UniversityPayment.objects.filter(student=self.students[0]).order_by()
+                        .values_list("donor").annotate(Sum("amount")))
+        self.assertEqual(per_donor, {k or 0: v for k, v in expected.items()})
+
+    def test_deleting_donors_and_students_keeps_rollups_in_step(self):
+        self.pay(10)
+        donor_id = self.donors[0].pk
+        self.assertTrue(FundingRollup.objects.filter(donor_key=donor_id).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.donors[0].delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.students[1].delete()
+        self.assertFalse(FundingRollup.objects.filter(donor_key=donor_id).exists())
+
+        incremental = self.rollup_rows()
+        rollups.rebuild()
+        self.assertEqual(self.rollup_rows(), incremental)
+
+    def test_rankings_cover_all_time_and_the_chart_a_window(self):
+        self.pay(3)
+        old = UniversityPayment.objects.create(student=self.students[2], donor=self.donors[1], amount=Decimal("500.00"),
+                                               approved=True, timestamp=timezone.now() - timedelta(days=rollups.DASHBOARD_DAYS + 5))
+        with CaptureQueriesContext(connection) as queries:
+            totals = rollups.dashboard_totals()
+        self.assertFalse(any("GROUP BY" in q["sql"] for q in queries.captured_queries))
+        self.assertEqual(totals["total_funded"], Decimal("550.00"))
+        self.assertEqual(totals["donors"][0], {"id": self.donors[1].pk, "name": "Donor 1", "total": Decimal("520.00")})
+        self.assertEqual(totals["students"][0]["id"], self.students[2].pk)
+        self.assertEqual([f["day"] for f in totals["daily_funding"]], sorted({timezone.localdate(p.timestamp) for p in
+                                                                              UniversityPayment.objects.exclude(pk=old.pk)}))
+
+    def test_dashboard_queries_do_not_grow_with_history(self):
+        staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        self.client.force_login(staff)
+        self.pay(5)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get("/transparency/").status_code, 200)
+        self.pay(60, start=5)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get("/transparency/")
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.context["payments"]), 50)
+        self.assertFalse(any("predictor_universitypayment" in q["sql"] and "SUM" in q["sql"] for q in many.captured_queries))
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        caches["dashboard"].clear()
+        self.students = [Student.objects.create(student_number=f"S{i}", first_name="Stu", last_name=str(i)) for i in range(2)]
+        self.donor = Donor.objects.create(name="Acme", donor_type="corporate")
+        self.pay(self.students[0], 100)
+
+    def pay(self, student, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            UniversityPayment.objects.create(student=student, donor=self.donor, amount=Decimal(amount))
+
+    def warm(self):
+        return {
+            "global": rollups.cached_dashboard_totals(),
+            "student0": rollups.cached_dashboard_totals(student=self.students[0]),
+            "student1": rollups.cached_dashboard_totals(student=self.students[1]),
+            "donor": rollups.cached_dashboard_totals(donor=self.donor),
+        }
+
+    def test_payments_invalidate_only_their_scopes(self):
+        self.warm()
+        with self.assertNumQueries(0):
+            self.warm()
+        self.pay(self.students[0], 50)
+        # global, student 0 and the donor are recomputed (6 queries each); student 1 is still cached
+        with self.assertNumQueries(18):
+            totals = self.warm()
+        self.assertEqual(totals["global"]["total_funded"], Decimal("150.00"))
+        self.assertEqual(totals["student0"]["total_funded"], Decimal("150.00"))
+        self.assertEqual(totals["donor"]["total_funded"], Decimal("150.00"))
+        self.assertEqual(totals["student1"]["total_funded"], Decimal("0.00"))
+
+    def test_lock_holder_makes_others_serve_stale_or_wait(self):
+        cache = caches["dashboard"]
+        key = f"transparency:global:v{rollups._version(cache, 'global')}"
+        with cache_locks.try_lock(cache, key) as won:  # another worker is recomputing
+            self.assertTrue(won)
+
+            # Stale copy available: served without touching the database
+            cache.set(key, {"fresh_until": 0, "totals": {"total_funded": "stale"}})
+            with self.assertNumQueries(0):
+                self.assertEqual(rollups.cached_dashboard_totals()["total_funded"], "stale")
+
+            # Nothing cached: wait for the other worker's result instead of recomputing
+            cache.delete(key)
+            timer = threading.Timer(0.2, cache.set, args=(key, {"fresh_until": time.time() + 60, "totals": {"total_funded": "fresh"}}))
+            timer.start()
+            with self.assertNumQueries(0):
+                self.assertEqual(rollups.cached_dashboard_totals()["total_funded"], "fresh")
+            timer.join()
+
+    def test_concurrent_misses_recompute_once(self):
+        calls = []
+
+        def slow_totals(student=None, donor=None):
+            calls.append(1)
+            time.sleep(0.3)
+            return {"total_funded": "computed"}
+
+        start = threading.Barrier(8)
+        results = []
+
+        def reader():
+            start.wait()
+            results.append(rollups.cached_dashboard_totals()["total_funded"])
+
+        with mock.patch.object(rollups, "dashboard_totals", slow_totals):
+            threads = [threading.Thread(target=reader) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        self.assertEqual((len(calls), results), (1, ["computed"] * 8))
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class CsrLeaderboardTests(TestCase):
+    def setUp(self):
+        caches["dashboard"].clear()
+        self.student = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+        self.acme = Donor.objects.create(name="Acme", donor_type="corporate", wallet_balance=Decimal("10000.00"))
+        self.globex = Donor.objects.create(name="Globex", donor_type="corporate", wallet_balance=Decimal("10000.00"))
+        self.alum = Donor.objects.create(name="Alum", donor_type="alumni", wallet_balance=Decimal("10000.00"))
+
+    def fund(self, donor, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            wallet.fund_student(donor, self.student, amount)
+
+    def test_donations_update_totals_and_cached_boards(self):
+        self.fund(self.acme, 250)
+        self.fund(self.alum, 500)
+        self.assertEqual([(e["name"], e["rank"]) for e in leaderboard.get_leaderboard()], [("Alum", 1), ("Acme", 2)])
+
+        # Boards are now cached: further donations patch them without a rebuild query
+        leaderboard.get_leaderboard("corporate")
+        self.fund(self.globex, 199)
+        self.fund(self.acme, 300)
+        with self.assertNumQueries(0):
+            overall = leaderboard.get_leaderboard()
+            corporate = leaderboard.get_leaderboard("corporate")
+        self.assertEqual([(e["name"], e["csr_score"], e["rank"]) for e in overall],
+                         [("Acme", 5, 1), ("Alum", 5, 1), ("Globex", 1, 3)])
+        self.assertEqual([e["name"] for e in corporate], ["Acme", "Globex"])
+        self.assertEqual(leaderboard.position(self.globex, "corporate"), 2)
+
+        self.acme.refresh_from_db()
+        self.assertEqual((self.acme.csr_score, self.acme.total_donated), (5, Decimal("550.00")))
+        self.assertEqual(self.acme.current_rank, "Newbie")
+        self.assertEqual(self.acme.next_rank_goal, 100)
+
+    def test_recompute_rebuilds_from_transactions(self):
+        self.fund(self.acme, 250)
+        self.fund(self.acme, 199)
+        Transaction.objects.create(donor=self.alum, amount=Decimal("1000.00"))
+        Donor.objects.filter(pk=self.acme.pk).update(csr_score=999, total_donated=0)
+        leaderboard.get_leaderboard()
+
+        call_command("recompute_csr", stdout=StringIO())
+
+        self.assertEqual(
+            list(Donor.objects.order_by("id").values_list("csr_score", "total_donated")),
+            [(3, Decimal("449.00")), (0, Decimal("0.00")), (10, Decimal("1000.00"))],
+        )
+        self.assertEqual([e["name"] for e in leaderboard.get_leaderboard()], ["Alum", "Acme"])
+
+    def test_boards_are_shared_between_processes(self):
+        self.fund(self.acme, 250)
+        self.assertEqual([e["name"] for e in leaderboard.get_leaderboard()], ["Acme"])
+        # Another process: its own cache instance on the same directory
+        other = caches.create_connection("dashboard")
+        with mock.patch.object(leaderboard, "_cache", return_value=other):
+            self.fund(self.alum, 500)
+        with self.assertNumQueries(0):  # patched there, seen here
+            self.assertEqual([e["name"] for e in leaderboard.get_leaderboard()], ["Alum", "Acme"])
+        Donor.objects.filter(pk=self.globex.pk).update(csr_score=50)
+        with mock.patch.object(leaderboard, "_cache", return_value=other):
+            leaderboard.invalidate()
+        self.assertEqual([e["name"] for e in leaderboard.get_leaderboard()], ["Globex", "Alum", "Acme"])
+
+    def test_donation_during_another_patch_invalidates(self):
+        self.fund(self.acme, 250)
+        leaderboard.get_leaderboard()
+        cache = caches["dashboard"]
+        with cache_locks.try_lock(cache, leaderboard.VERSION_KEY):  # another process is patching
+            self.fund(self.alum, 500)
+        self.assertEqual([e["name"] for e in leaderboard.get_leaderboard()], ["Alum", "Acme"])
+
+
+@override_settings(MATCHING_BACKGROUND_WORKER=True)
+class SqliteTuningTests(SimpleTestCase):
+    PRAGMAS = {"busy_timeout": 5000, "journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -64000}
+
+    def test_production_pragmas_applied_to_new_connections(self):
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(SQLITE_PRAGMAS=self.PRAGMAS):
+            conn = type(connections["default"])({**connection.settings_dict, "NAME": os.path.join(tmpdir, "tuned.sqlite3")}, "tuned")
+            try:
+                conn.ensure_connection()  # fires connection_created
+                with conn.cursor() as cursor:
+                    settings_now = {name: cursor.execute(f"PRAGMA {name}").fetchone()[0] for name in self.PRAGMAS}
+            finally:
+                conn.close()
+        # synchronous=NORMAL reads back as 1
+        self.assertEqual(settings_now, {"busy_timeout": 5000, "journal_mode": "wal", "synchronous": 1, "cache_size": -64000})
+
+    def test_retry_on_lock_retries_only_lock_errors(self):
+        calls = []
+
+        @db.retry_on_lock
+        def write(error):
+            calls.append(error)
+            if len(calls) < 3:
+                raise OperationalError(error)
+            return "done"
+
+        with mock.patch.object(db.time, "sleep") as sleep:
+            self.assertEqual(write("database is locked"), "done")
+            self.assertEqual((len(calls), sleep.call_count), (3, 2))
+
+            calls.clear()
+            with self.assertRaises(OperationalError):
+                write("no such table: predictor_student")
+            self.assertEqual(len(calls), 1)
+
+
+class WalletConcurrencyTests(TransactionTestCase):
+    # Bounded, so lock retries cannot run out however the threads interleave
+    THREADS = 4
+    DEBITS_PER_THREAD = 20
+    MIN_DEBITS_PER_SECOND = 10
+
+    def test_concurrent_debits_never_overdraw(self):
+        student = Student.objects.create(student_number="S1", first_name="A", last_name="B", gpa=3.6, course="Engineering", need_score=8)
+        # Room for 50 of the 80 attempted R10 debits
+        donor = Donor.objects.create(name="Acme", donor_type="corporate", wallet_balance=Decimal("500.00"))
+        wallet.open_wallet(donor)
+        results, errors = [], []
+
+        def worker():
+            try:
+                for _ in range(self.DEBITS_PER_THREAD):
+                    try:
+                        wallet.fund_student(donor, student, 10)
+                        results.append(True)
+                    except wallet.InsufficientFunds:
+                        results.append(False)
+            except Exception as e:  # surfaced below instead of dying with the thread
+                errors.append(e)
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        # Far more retries than 4 writers can need: a lock error here would be a bug, not bad luck
+        with mock.patch.object(db, "LOCK_RETRIES", 1000):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=30)
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(errors, [])
+        succeeded = results.count(True)
+        self.assertEqual(len(results), self.THREADS * self.DEBITS_PER_THREAD)
+        self.assertGreater(len(results) / elapsed, self.MIN_DEBITS_PER_SECOND)
+        self.assertEqual(succeeded, 50)
+        donor.refresh_from_db()
+        student.refresh_from_db()
+        self.assertEqual(donor.wallet_balance, Decimal("0.00"))
+        self.assertEqual(student.wallet_balance, Decimal("500.00"))
+        self.assertEqual(Transaction.objects.filter(donor=donor).count(), succeeded)
+        self.assertEqual(list(ledger.audit()), [])
@@ -51,6 +51,6 @@ urlpatterns = [
     # funds
     path("student/wallet/", views.student_wallet, name="student_wallet"),
     path("donor/fund/<int:student_id>/", views.donor_fund_student, name="fund_student"),
-    # Queue alerts
-    path('admin/queue-alerts/', views.queue_alerts, name='queue_alerts'),
+    # Finance exports (staff)
+    path('exports/<str:kind>/', views.export_history, name='export_history'),
 ]
@@ -1,11 +1,14 @@
 # predictor/views.py
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.http import HttpResponseForbidden, HttpResponse
+from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, HttpResponseForbidden, HttpResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.contrib.auth.views import LogoutView
 from django.contrib.auth import logout
@@ -14,23 +17,33 @@ from .forms import WalletTopUpForm
 from .forms import TopUpForm, FundStudentForm
 from .forms import DonorRegistrationForm, StudentRegistrationForm
 from .ai_matching import match_donors_to_students
-from django.db.models import Sum
-from django.db.models.functions import TruncDate
 from django.urls import reverse_lazy
 from django.contrib.auth.views import LoginView
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.crypto import constant_time_compare
 from decimal import Decimal
 
 
 
 from .models import (
-    Student, Donor, BursaryRequest, Match, Transaction,
+    Student, Donor, Match, Transaction,
     RegistrationFlag, AcademicRecord, AccessRequest, UniversityPayment
 )
 from .forms import (
     StudentRegistrationForm, DonorRegistrationForm,
     BursaryRequestForm, AcademicUploadForm
 )
-from .matcher import score as matcher_score  # simple ML/heuristic function
+from .matcher import Matcher, save_matches
+from .match_queue import has_pending_jobs
+from . import alert_feed, exports, leaderboard, metrics, rollups, wallet
+from .pagination import InvalidCursor, keyset_page
+
+# Page sizes of the keyset-paginated lists
+PAYMENTS_PAGE_SIZE = 50
+TRANSACTIONS_PAGE_SIZE = 20
+QUEUE_ALERTS_PAGE_SIZE = 24
+# Without the live stream (WSGI) the queue alerts page reloads itself this often
+QUEUE_ALERTS_POLL_SECONDS = 60
 
 # -----------------------
 # Helper role checks
@@ -42,6 +55,14 @@ def is_student(user):
     return hasattr(user, "student")
 
 
+def paginate(request, queryset, field, page_size):
+    """Newest-first keyset page selected by ?cursor=; a malformed cursor shows the first page."""
+    try:
+        return keyset_page(queryset, field, request.GET.get("cursor"), page_size, request=request)
+    except InvalidCursor:
+        return keyset_page(queryset, field, None, page_size, request=request)
+
+
 
 # -----------------------
 # Home
@@ -131,8 +152,13 @@ def donor_register(request):
             donor = form.save(commit=False)
             donor.user = user
             donor.save()
+            wallet.open_wallet(donor)
 
-            messages.success(request, "Donor account created. Please log in.")
+            message = "Donor account created. Please log in."
+            if settings.MATCHING_BACKGROUND_WORKER:
+                # The worker matches the donor later; the dashboard shows it as pending until then.
+                message += " Your student matches are being prepared."
+            messages.success(request, message)
             return redirect("login")
     else:
         form = DonorRegistrationForm()
@@ -162,24 +188,15 @@ def request_fee(request, student_id):
             br.student = student
             br.save()
             
-            # Match donors
-            donors = Donor.objects.all()
-            results = []
-            for d in donors:
-                s = {'gpa': student.gpa, 'need_score': student.need_score, 'course': student.course}
-                donor_info = {
-                    'donor_type': d.donor_type,
-                    'preferred_course': d.preferred_course or 'Any',
-                    'min_gpa': d.min_gpa,
-                    'max_amount': float(d.max_amount)
-                }
-                score = matcher_score(s, donor_info)
-                results.append({'donor': d, 'score': score})
-            results = sorted(results, key=lambda x: x['score'], reverse=True)[:10]
-
-            # Save matches
-            for r in results:
-                Match.objects.create(student=student, donor=r['donor'], score=r['score'])
+            # Match donors (one vectorised pass over all donors)
+            matcher = Matcher()
+            ranked = matcher.rank_donors(student, limit=10)
+            donors = Donor.objects.in_bulk([row[1] for row in ranked])
+            results = [{'donor': donors[donor_id], 'score': score} for _, donor_id, score, _ in ranked]
+
+            # Save matches (upsert: the student may already be matched with these donors).
+            # Only those above the threshold, as generate_for_all would: the rest are shown, not kept.
+            save_matches(row for row in ranked if row[2] >= matcher.min_threshold)
 
             return render(request, 'predictor/match_result.html', {'results': results, 'student': student})
     else:
@@ -200,9 +217,12 @@ def donor_dashboard(request):
     if request.method == "POST" and request.POST.get("form_type") == "topup":
         if topup_form.is_valid():
             amount = topup_form.cleaned_data["amount"]
-            donor.wallet_balance += amount
-            donor.save(update_fields=["wallet_balance"])
-            messages.success(request, f"Wallet topped up by R{amount:.2f}.")
+            try:
+                wallet.top_up(donor, amount)
+            except wallet.InsufficientFunds:
+                messages.error(request, "Insufficient wallet balance.")
+            else:
+                messages.success(request, f"Wallet topped up by R{amount:.2f}.")
             return redirect("donor_dashboard")
 
     # ---------- Fetch AI matches (from DB) ----------
@@ -214,16 +234,20 @@ def donor_dashboard(request):
     )
 
     # ---------- Transactions ----------
-    transactions = Transaction.objects.filter(donor=donor).order_by("-created_at")[:20]
+    transactions = paginate(
+        request, Transaction.objects.filter(donor=donor).select_related("student"), "created_at", TRANSACTIONS_PAGE_SIZE
+    )
 
     context = {
         "donor": donor,
         "topup_form": topup_form,
         "matches": matches,
+        "matches_pending": has_pending_jobs(donor=donor),
         "transactions": transactions,
         "csr_rank": donor.current_rank,
         "csr_progress": donor.progress_to_next,
         "csr_next_goal": donor.next_rank_goal,
+        "leaderboard_position": leaderboard.position(donor, donor.donor_type),
     }
     return render(request, "predictor/donor_dashboard.html", context)
 @login_required
@@ -234,13 +258,12 @@ def donor_wallet(request):
 
     if request.method == "POST":
         try:
-            amount = Decimal(request.POST.get("amount", "0"))
-        except (TypeError, ValueError):
+            amount = wallet.to_amount(request.POST.get("amount", "0"))
+        except (TypeError, ValueError, ArithmeticError):
             amount = Decimal("0")
 
         if amount > 0:
-            donor.wallet_balance += amount
-            donor.save(update_fields=["wallet_balance"])
+            wallet.top_up(donor, amount)
             messages.success(request, f"Wallet topped up by R{amount:.2f}")
         else:
             messages.error(request, "Invalid top-up amount.")
@@ -348,7 +371,7 @@ def fund_match(request, match_id):
 
     # POST: Process funding
     try:
-        amount = Decimal(request.POST.get("amount", "0"))
+        amount = wallet.to_amount(request.POST.get("amount", "0"))
     except (TypeError, ValueError, ArithmeticError):
         messages.error(request, "Invalid amount.")
         return redirect("donor_dashboard")  #  removed donor_id
@@ -357,46 +380,13 @@ def fund_match(request, match_id):
         messages.error(request, "Amount must be greater than 0.")
         return redirect("donor_dashboard")  #  removed donor_id
 
-    if donor.wallet_balance < amount:
+    # Debit, Transaction, match/bursary/registration flags: one short atomic unit
+    try:
+        tx = wallet.fund_match(donor, match, amount)
+    except wallet.InsufficientFunds:
         messages.error(request, "Insufficient wallet balance.")
         return redirect("donor_wallet")  #  donor_id removed, assuming donor_wallet updated to not use donor_id
 
-    # Deduct funds
-    donor.wallet_balance -= amount
-    donor.save(update_fields=["wallet_balance"])
-
-    # Link to open bursary request if available
-    bursary = BursaryRequest.objects.filter(student=match.student, fulfilled=False).first()
-
-    tx = Transaction.objects.create(
-        match=match,
-        donor=donor,
-        student=match.student,
-        bursary_request=bursary,
-        amount=amount,
-        tx_ref=f"MOCK-{timezone.now().strftime('%Y%m%d%H%M%S')}"
-    )
-
-    # Mark match funded
-    match.funded = True
-    match.save(update_fields=["funded"])
-
-    # Mark bursary fulfilled if needed
-    if bursary:
-        bursary.fulfilled = True
-        bursary.save(update_fields=["fulfilled"])
-
-        # Special case: registration fee
-        if bursary.priority == "registration_fee":
-            rf = RegistrationFlag.objects.filter(student=bursary.student, flagged=True).first()
-            if rf:
-                rf.is_paid = True
-                rf.flagged = False
-                rf.flagged_reason = "Paid via donor micro-bursary"
-                rf.save(update_fields=["is_paid", "flagged", "flagged_reason"])
-                bursary.student.registration_paid = True
-                bursary.student.save(update_fields=["registration_paid"])
-
     messages.success(request, f"Funded R{amount:.2f}. Transaction ref: {tx.tx_ref}")
     return redirect("donor_dashboard")  
 
@@ -404,13 +394,79 @@ def fund_match(request, match_id):
 # -----------------------
 # Queue alerts page for admins/university staff (list flagged registrations)
 # -----------------------
+@login_required
+def export_history(request, kind):
+    """
+    Staff-only streamed export of Transaction / UniversityPayment history.
+    GET ?format=csv|ndjson&start=YYYY-MM-DD&end=YYYY-MM-DD&donor=<id>&student=<id>
+    """
+    if not request.user.is_superuser and not request.user.is_staff:
+        return HttpResponseForbidden("Only staff can export funding history.")
+    fmt = request.GET.get("format", "csv")
+    try:
+        columns, rows = exports.export_rows(
+            kind, start=request.GET.get("start"), end=request.GET.get("end"),
+            donor=request.GET.get("donor"), student=request.GET.get("student"),
+        )
+        stream = exports.iter_export(fmt, columns, rows)
+    except exports.ExportError as e:
+        return HttpResponseBadRequest(str(e))
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{kind}-{timezone.now():%Y%m%d}.{fmt}"'
+    return response
+
+
 @login_required
 def queue_alerts(request):
     # allow only superuser or staff to view queue alerts (or extend with permission checks)
     if not request.user.is_superuser and not request.user.is_staff:
         return HttpResponseForbidden("Only staff can view queue alerts.")
-    flags = RegistrationFlag.objects.filter(flagged=True).order_by("-created_at")
-    return render(request, "predictor/queue_alerts.html", {"flags": flags})
+    flags = paginate(
+        request, RegistrationFlag.objects.filter(flagged=True).select_related("student"), "created_at", QUEUE_ALERTS_PAGE_SIZE
+    )
+    return render(request, "predictor/queue_alerts.html", {
+        "flags": flags,
+        "live": isinstance(request, ASGIRequest),
+        "poll_seconds": QUEUE_ALERTS_POLL_SECONDS,
+    })
+
+
+def _sse(event):
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+@login_required
+async def queue_alerts_stream(request):
+    """
+    Server-sent events for the queue alerts page: "new" and "resolved" RegistrationFlag
+    events from the in-process feed, plus a keep-alive comment when idle. A reconnecting
+    browser sends Last-Event-ID and first receives what it missed.
+
+    Only served under ASGI: a WSGI worker would be held by the endless stream, so it
+    answers 204, which tells EventSource not to reconnect (the page polls instead).
+    """
+    user = await request.auser()
+    if not user.is_superuser and not user.is_staff:
+        return HttpResponseForbidden("Only staff can view queue alerts.")
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    try:
+        last_event_id = int(request.headers["Last-Event-ID"])
+    except (KeyError, ValueError):
+        last_event_id = None
+
+    async def stream():
+        yield "retry: 5000\n\n"
+        async for event in alert_feed.listen(last_event_id):
+            yield _sse(event)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # keep proxies from buffering the stream
+    return response
 
 @login_required
 @user_passes_test(is_student)
@@ -439,7 +495,7 @@ def student_wallet(request):
 
     context = {
         "student": student,
-        "transactions": student.transactions.all().order_by("-created_at")[:20],
+        "transactions": paginate(request, student.transactions.all(), "created_at", TRANSACTIONS_PAGE_SIZE),
     }
     return render(request, "predictor/student_wallet.html", context)
 
@@ -452,20 +508,16 @@ def donor_fund_student(request, student_id):
         form = FundStudentForm(request.POST)
         if form.is_valid():
             amount = form.cleaned_data["amount"]
-            if donor.wallet_balance >= amount:
-                donor.wallet_balance -= amount
-                student.wallet_balance += amount
-                donor.save()
-                student.save()
-
-                Transaction.objects.create(
-                    donor=donor, student=student, amount=amount,
+            try:
+                wallet.fund_student(
+                    donor, student, amount,
                     description=f"Donor {donor.name} funded student {student.user.get_full_name()}"
                 )
+            except wallet.InsufficientFunds:
+                messages.error(request, "Insufficient balance in donor wallet.")
+            else:
                 messages.success(request, f"Successfully funded R {amount:.2f} to {student.user.get_full_name()}.")
                 return redirect('donor_dashboard')
-            else:
-                messages.error(request, "Insufficient balance in donor wallet.")
     else:
         form = FundStudentForm()
 
@@ -482,41 +534,49 @@ def transparency_dashboard(request):
             topup_form = WalletTopUpForm(request.POST)
             if topup_form.is_valid():
                 amount = topup_form.cleaned_data['amount']
-                donor.wallet_balance += amount  # positive for top-up
-                donor.save()
-                messages.success(request, f"Wallet updated by R {amount:.2f}")
+                try:
+                    wallet.top_up(donor, amount)  # positive for top-up
+                except wallet.InsufficientFunds:
+                    messages.error(request, "Insufficient wallet balance.")
+                else:
+                    messages.success(request, f"Wallet updated by R {amount:.2f}")
                 return redirect('transparency_dashboard')
         else:
             topup_form = WalletTopUpForm()
 
-    # Payments
+    # Payments (one keyset page) and aggregates read from the daily rollups (cached
+    # per student/donor/global scope), so the page costs the same however long the payment history is.
+    payments = UniversityPayment.objects.select_related('student__user', 'donor__user')
     if hasattr(user, 'student'):
-        payments = UniversityPayment.objects.filter(student=user.student).order_by('-timestamp')
+        payments = payments.filter(student=user.student)
+        totals = rollups.cached_dashboard_totals(student=user.student)
     elif hasattr(user, 'donor'):
-        payments = UniversityPayment.objects.filter(donor=user.donor).order_by('-timestamp')
+        payments = payments.filter(donor=user.donor)
+        totals = rollups.cached_dashboard_totals(donor=user.donor)
     else:
-        payments = UniversityPayment.objects.all().order_by('-timestamp')
-
-    total_funded = sum([p.amount for p in payments if p.approved])
-
-    # Aggregates for tables
-    donors = payments.values('donor__user__first_name', 'donor__user__last_name')\
-                     .annotate(total_funded=Sum('amount')).order_by('-total_funded')
-    students = payments.values('student__user__first_name', 'student__user__last_name')\
-                       .annotate(total_received=Sum('amount')).order_by('-total_received')
-
-    # Daily funding for chart
-    daily_funding = payments.values('timestamp__date')\
-                            .annotate(total=Sum('amount'))\
-                            .order_by('timestamp__date')
+        totals = rollups.cached_dashboard_totals()
 
     context = {
-        'payments': payments,
-        'total_funded': total_funded,
-        'donors': donors,
-        'students': students,
-        'daily_funding': daily_funding,
+        'payments': paginate(request, payments, 'timestamp', PAYMENTS_PAGE_SIZE),
+        **totals,
         'topup_form': topup_form,
     }
 
-    return render(request, 'predictor/transparency_dashboard.html', context)
\ No newline at end of file
+    return render(request, 'predictor/transparency_dashboard.html', context)
+
+
+def metrics_endpoint(request):
+    """
+    Prometheus metrics (text format) of this process. Internal: only logged-in staff, a
+    scraper sending "Authorization: Bearer <METRICS_TOKEN>" and addresses in
+    METRICS_ALLOWED_IPS get them; everyone else a 404.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    allowed = (
+        request.user.is_staff
+        or (token and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"))
+        or request.META.get("REMOTE_ADDR") in getattr(settings, "METRICS_ALLOWED_IPS", ())
+    )
+    if not allowed:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,244 @@
+# predictor/wallet.py
+# Wallet operations for donors and students. Balances are only changed with conditional
+# UPDATE ... SET balance = balance +/- x statements inside one short transaction, never
+# read-modify-write in Python, so concurrent requests cannot lose updates or overdraw.
+# Each change is also appended to the ledger (predictor.ledger) in the same transaction.
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import alert_feed, leaderboard, ledger
+from .db import retry_on_lock
+from .models import Donor, Student, Transaction, BursaryRequest, RegistrationFlag, Match, LedgerEntry
+
+# Upper bound for fund_matches, keeping its IN (...) lists within database parameter limits
+MAX_BULK_FUND_ITEMS = 500
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+def to_amount(amount):
+    """Normalise to a 2dp Decimal (Rands). Raises ValueError for NaN/Infinity, ArithmeticError for non-numbers."""
+    value = Decimal(str(amount))
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {amount}")
+    return value.quantize(Decimal('0.01'))
+
+
+def to_payment(amount):
+    """to_amount for money a donor pays out: also raises ValueError unless it is above 0."""
+    value = to_amount(amount)
+    if value <= 0:
+        raise ValueError("Amount must be greater than 0.")
+    return value
+
+
+# ---------- Primitive balance updates (call inside transaction.atomic) ----------
+# Each returns the unsaved LedgerEntry for the change; pass them to ledger.append.
+def debit_donor(donor, amount, kind='debit'):
+    """Take `amount` from the donor's wallet, only if the balance covers it."""
+    updated = Donor.objects.filter(pk=donor.pk, wallet_balance__gte=amount).update(
+        wallet_balance=F('wallet_balance') - amount
+    )
+    if not updated:
+        raise InsufficientFunds("Insufficient wallet balance.")
+    return LedgerEntry(donor_id=donor.pk, kind=kind, amount=-amount)
+
+
+def credit_donor(donor, amount, kind='top_up'):
+    Donor.objects.filter(pk=donor.pk).update(wallet_balance=F('wallet_balance') + amount)
+    return LedgerEntry(donor_id=donor.pk, kind=kind, amount=amount)
+
+
+def credit_student(student, amount):
+    Student.objects.filter(pk=student.pk).update(wallet_balance=F('wallet_balance') + amount)
+    return LedgerEntry(student_id=student.pk, kind='credit', amount=amount)
+
+
+def _refresh_balances(*instances):
+    for instance in instances:
+        instance.refresh_from_db(fields=['wallet_balance'])
+
+
+def _record_donation(donor, amount, points=None):
+    """Credit CSR points/total_donated; the leaderboard is patched once the donation commits."""
+    donor.update_csr_score(amount, points=points)
+    snapshot = Donor(pk=donor.pk, name=donor.name, donor_type=donor.donor_type,
+                     csr_score=donor.csr_score, total_donated=donor.total_donated)
+    transaction.on_commit(lambda: leaderboard.record_donation(snapshot))
+
+
+def _tx_ref():
+    return f"MOCK-{timezone.now().strftime('%Y%m%d%H%M%S')}"
+
+
+def _fulfil_bursaries(bursaries):
+    """
+    Mark bursaries fulfilled; a paid registration fee also clears the student's (first)
+    queue flag. A fixed number of queries however many bursaries are passed.
+    """
+    if not bursaries:
+        return
+    BursaryRequest.objects.filter(pk__in=[b.pk for b in bursaries]).update(fulfilled=True)
+    for bursary in bursaries:
+        bursary.fulfilled = True
+    fee_students = {b.student_id for b in bursaries if b.priority == "registration_fee"}
+    if not fee_students:
+        return
+    flags = {}
+    for flag in (RegistrationFlag.objects.filter(student_id__in=fee_students, flagged=True)
+                 .select_related("student").order_by("-id")):
+        flags[flag.student_id] = flag  # lowest id wins, as .first() would pick
+    if flags:
+        RegistrationFlag.objects.filter(pk__in=[f.pk for f in flags.values()]).update(
+            is_paid=True, flagged=False, flagged_reason="Paid via donor micro-bursary"
+        )
+        Student.objects.filter(pk__in=flags).update(registration_paid=True, updated_at=timezone.now())
+        for flag in flags.values():
+            flag.flagged_reason = "Paid via donor micro-bursary"
+        alert_feed.publish_on_commit(alert_feed.flag_event("resolved", flag) for flag in flags.values())
+
+
+# ---------- Funding flows ----------
+@retry_on_lock
+def top_up(donor, amount):
+    """
+    Add `amount` to the donor's wallet (a negative amount withdraws, if covered).
+    Returns the new balance.
+    """
+    amount = to_amount(amount)
+    with transaction.atomic():
+        if amount < 0:
+            entry = debit_donor(donor, -amount, kind='withdrawal')
+        else:
+            entry = credit_donor(donor, amount)
+        ledger.append([entry])
+        _refresh_balances(donor)
+    return donor.wallet_balance
+
+
+def open_wallet(instance):
+    """
+    Record the balance a Donor/Student was created with as its opening ledger entry
+    (e.g. the starting balance entered on the donor registration form).
+    """
+    if instance.wallet_balance:
+        field = 'donor_id' if isinstance(instance, Donor) else 'student_id'
+        ledger.append([LedgerEntry(**{field: instance.pk}, kind='opening', amount=to_amount(instance.wallet_balance))])
+
+
+@retry_on_lock
+def fund_match(donor, match, amount):
+    """
+    Donor funds one of their matches: debit the wallet, record the Transaction, mark the
+    match funded and fulfil the student's oldest open bursary request.
+    """
+    amount = to_payment(amount)
+    with transaction.atomic():
+        entry = debit_donor(donor, amount)
+        bursary = BursaryRequest.objects.filter(student_id=match.student_id, fulfilled=False).first()
+        tx = Transaction.objects.create(
+            match=match,
+            donor=donor,
+            student_id=match.student_id,
+            bursary_request=bursary,
+            amount=amount,
+            tx_ref=_tx_ref(),
+        )
+        ledger.append([entry], tx)
+        Match.objects.filter(pk=match.pk).update(funded=True)
+        match.funded = True
+        if bursary:
+            _fulfil_bursaries([bursary])
+        _record_donation(donor, amount)
+        _refresh_balances(donor)
+    return tx
+
+
+@retry_on_lock
+def fund_matches(donor, items):
+    """
+    Fund several of the donor's matches at once. `items` is a list of (match_id, amount).
+    Same effects as fund_match per item, but the wallet is checked and debited once and
+    every table is written in bulk: the query count does not grow with len(items).
+    Returns the Transactions in item order.
+    """
+    if not items:
+        raise ValueError("No matches to fund.")
+    if len(items) > MAX_BULK_FUND_ITEMS:
+        raise ValueError(f"At most {MAX_BULK_FUND_ITEMS} matches can be funded at once.")
+    amounts = {}
+    for match_id, amount in items:
+        amount = to_payment(amount)
+        if match_id in amounts:
+            raise ValueError(f"Match {match_id} is listed more than once.")
+        amounts[match_id] = amount
+    total = sum(amounts.values())
+
+    with transaction.atomic():
+        matches = Match.objects.filter(donor=donor).in_bulk(list(amounts))
+        missing = [match_id for match_id in amounts if match_id not in matches]
+        if missing:
+            raise ValueError(f"Unknown matches for this donor: {missing}")
+        debit_donor(donor, total)
+
+        # The oldest open bursary of each student, as fund_match picks it
+        bursaries = {}
+        student_ids = {m.student_id for m in matches.values()}
+        for bursary in BursaryRequest.objects.filter(student_id__in=student_ids, fulfilled=False).order_by("-id"):
+            bursaries[bursary.student_id] = bursary
+
+        tx_ref = _tx_ref()
+        transactions = Transaction.objects.bulk_create([
+            Transaction(match=matches[match_id], donor=donor, student_id=matches[match_id].student_id,
+                        bursary_request=bursaries.get(matches[match_id].student_id), amount=amount, tx_ref=tx_ref)
+            for match_id, amount in amounts.items()
+        ])
+        LedgerEntry.objects.bulk_create(
+            LedgerEntry(donor_id=donor.pk, kind='debit', amount=-tx.amount, transaction=tx) for tx in transactions
+        )
+        Match.objects.filter(pk__in=list(matches)).update(funded=True)
+        for match in matches.values():
+            match.funded = True
+        _fulfil_bursaries(list(bursaries.values()))
+        _record_donation(donor, total, points=sum(Donor.csr_points(tx.amount) for tx in transactions))
+        _refresh_balances(donor)
+    return transactions
+
+
+@retry_on_lock
+def fund_student(donor, student, amount, description=""):
+    """Move `amount` from the donor's wallet to the student's wallet."""
+    amount = to_payment(amount)
+    with transaction.atomic():
+        entries = [debit_donor(donor, amount), credit_student(student, amount)]
+        tx = Transaction.objects.create(donor=donor, student=student, amount=amount, description=description)
+        ledger.append(entries, tx)
+        _record_donation(donor, amount)
+        _refresh_balances(donor, student)
+    return tx
+
+
+@retry_on_lock
+def fund_bursary(donor, bursary, amount):
+    """
+    Donor pays towards a bursary request; it is fulfilled once its transactions
+    cover the requested amount. Returns (transaction, fulfilled).
+    """
+    amount = to_payment(amount)
+    with transaction.atomic():
+        entry = debit_donor(donor, amount)
+        tx = Transaction.objects.create(
+            donor=donor, student_id=bursary.student_id, bursary_request=bursary, amount=amount, tx_ref=_tx_ref(),
+        )
+        ledger.append([entry], tx)
+        funded = Transaction.objects.filter(bursary_request=bursary).aggregate(total=Sum('amount'))['total']
+        if not bursary.fulfilled and funded >= bursary.requested_amount:
+            _fulfil_bursaries([bursary])
+        _record_donation(donor, amount)
+        _refresh_balances(donor)
+    return tx, bursary.fulfilled